@@ -18,13 +18,20 @@ import requests
 
 
 import CFScriptConfig as CFG
+import CF_Decode as CFDecode
+import CF_Metrics as CFMetrics
+import CF_Profile as CFProfile
 
 
-SEARCH_URL = CFG.API_BASE_URL+ "/investigate"
+STREAM_BATCH = 200   # records per on_records call when pages are decoded incrementally
 
 # ---------------------------
 # Helpers (unchanged / reused)
 # ---------------------------
+def _search_url():
+    # built per call: reading CFG.API_BASE_URL loads and validates the credentials
+    return CFG.API_BASE_URL + "/investigate"
+
 def _iso(dt: datetime):
     return dt.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
 
@@ -57,31 +64,151 @@ def _get_record_id(rec):
     except Exception:
         return str(rec)[:400]
 
-def _save_debug_response(resp, params, url, note=None):
+# ---------------------------
+# Record field accessors + local matcher (mirrors the server-side search filters)
+# ---------------------------
+_ANGLE_ADDR_RE = re.compile(r"<([^>]+)>")
+
+def _address_only(value):
+    if not value:
+        return ""
+    s = str(value).strip()
+    m = _ANGLE_ADDR_RE.search(s)
+    return (m.group(1) if m else s).strip().lower()
+
+def record_sender(rec):
+    if not isinstance(rec, dict):
+        return ""
+    return _address_only(rec.get("from") or rec.get("envelope_from") or rec.get("sender"))
+
+def record_sender_domain(rec):
+    sender = record_sender(rec)
+    return sender.rsplit("@", 1)[1] if "@" in sender else ""
+
+def record_recipients(rec):
+    if not isinstance(rec, dict):
+        return []
+    out = []
+    for k in ("to", "client_recipients", "envelope_to"):
+        v = rec.get(k)
+        if not v:
+            continue
+        for addr in (v if isinstance(v, list) else [v]):
+            a = _address_only(addr)
+            if a and a not in out:
+                out.append(a)
+    return out
+
+def record_subject(rec):
+    if not isinstance(rec, dict):
+        return ""
+    return str(rec.get("subject") or "")
+
+def record_time(rec):
+    if not isinstance(rec, dict):
+        return None
+    for k in ("ts", "scanned_at", "sent_date"):
+        dt = _parse_iso_to_dt_or_none(rec.get(k))
+        if dt:
+            return dt
+    return None
+
+def is_full_address(value):
+    local, _, dom = (value or "").partition("@")
+    return bool(local) and "." in dom
+
+def filter_key(subject=None, sender=None, recipient=None, domain=None, query=None):
+    """Canonical, order-independent key for a set of search filters (query wins, like the API)."""
+    if query:
+        return json.dumps({"query": query.lower()}, sort_keys=True)
+    f = {"subject": subject, "sender": sender, "recipient": recipient, "domain": domain}
+    return json.dumps({k: v.lower() for k, v in f.items() if v}, sort_keys=True)
+
+def compile_record_matcher(subject=None, sender=None, recipient=None, domain=None, query=None):
+    """
+    Build a predicate rec -> bool that applies the same filters as _fetch_page, locally.
+    Like the API, a query takes precedence over the individual field filters. Field
+    filters are case-insensitive; a full address (contains '@' and a dot after it) must
+    match exactly, anything else is a substring match. Domain also accepts subdomains.
+    Query terms must all appear somewhere in the sender/recipient/subject/id fields.
+    """
+    checks = []
+    if query:
+        terms = [t.lower() for t in query.split() if t]
+
+        def _query_check(rec):
+            hay = " ".join([record_sender(rec), str(rec.get("from_name") or ""), " ".join(record_recipients(rec)),
+                            record_subject(rec), str(rec.get("message_id") or ""), str(rec.get("postfix_id") or "")]).lower()
+            return all(t in hay for t in terms)
+        checks.append(_query_check)
+    else:
+        if subject:
+            s = subject.lower()
+            checks.append(lambda rec: s in record_subject(rec).lower())
+        if sender:
+            snd = _address_only(sender)
+            if is_full_address(snd):
+                checks.append(lambda rec: record_sender(rec) == snd)
+            else:
+                checks.append(lambda rec: snd in record_sender(rec))
+        if recipient:
+            rcp = _address_only(recipient)
+            if is_full_address(rcp):
+                checks.append(lambda rec: rcp in record_recipients(rec))
+            else:
+                checks.append(lambda rec: any(rcp in r for r in record_recipients(rec)))
+        if domain:
+            dom = domain.lower().lstrip("@")
+            checks.append(lambda rec: record_sender_domain(rec) == dom or record_sender_domain(rec).endswith("." + dom))
+
+    if not checks:
+        return lambda rec: isinstance(rec, dict)
+
+    def _match(rec):
+        if not isinstance(rec, dict):
+            return False
+        for check in checks:
+            if not check(rec):
+                return False
+        return True
+    return _match
+
+def _save_debug_response(resp, params, url, note=None, keep_decoded=True):
     try:
         fname = CFG.DEBUG_DIR / f"resp_{int(time.time()*1000)}_{uuid.uuid4().hex[:6]}.json"
-        try:
-            body = resp.json() if resp is not None else None
-        except Exception:
-            try:
-                body = resp.text
-            except Exception:
-                body = "<unreadable>"
         obj = {
             "timestamp": datetime.utcnow().isoformat() + "Z",
             "request": {"url": url, "params": params},
             "status": resp.status_code if resp is not None else None,
             "headers": dict(resp.headers) if resp is not None else None,
-            "body": body,
             "note": note,
         }
+        # the body is written as received, not re-encoded; checking it is JSON parses it, and unless
+        # the page is walked incrementally that parse is what the page handler uses
+        body = CFDecode.raw_json_or_string(resp, keep=keep_decoded) if resp is not None else "null"
+        head = json.dumps(obj, ensure_ascii=False, indent=2, default=str)
         with open(fname, "w", encoding="utf-8") as f:
-            json.dump(obj, f, ensure_ascii=False, indent=2, default=str)
+            f.write(head[:-2] + ',\n  "body": ')
+            f.write(body)
+            f.write("\n}")
         return str(fname)
     except Exception as e:
         print("[debug] failed to save resp:", e)
         return None
 
+def _feed_local_index(page, coverage=None):
+    """Hand freshly downloaded records (and, for complete chunks, the covered window) to the local index."""
+    if not CFG.LOCAL_INDEX_ENABLED or (not page and not coverage):
+        return
+    try:
+        import CF_LocalIndex
+        if page:
+            CF_LocalIndex.add_records(page)
+        if coverage:
+            CF_LocalIndex.mark_covered(*coverage)
+    except Exception as e:
+        print("[debug] local index update failed:", e)
+
 def _extract_cursor_from_next(next_val):
     if not next_val:
         return None
@@ -100,7 +227,12 @@ def _extract_cursor_from_next(next_val):
 # ---------------------------
 # Single page fetch with retries + debug (shared)
 # ---------------------------
-def _fetch_page(start_iso=None, end_iso=None, subject=None, sender=None, recipient=None, domain=None, query=None, per_page=CFG.PER_PAGE):
+def _fetch_page(start_iso=None, end_iso=None, subject=None, sender=None, recipient=None, domain=None, query=None, per_page=CFG.PER_PAGE, stream=False):
+    """
+    Returns (records, count, result_info). With stream=True, records is a CF_Decode.ResultStream
+    that decodes the downloaded page one record at a time; count and result_info are then None
+    (the stream's .count and .meta hold them once it has been consumed).
+    """
     params = {"per_page": per_page, "detections_only": "false"}
     if start_iso:
         params["start"] = start_iso
@@ -121,20 +253,28 @@ def _fetch_page(start_iso=None, end_iso=None, subject=None, sender=None, recipie
 
     print(params)
 
+    search_url = _search_url()
     last_exc = None
     for attempt in range(CFG.MAX_RETRIES):
         try:
-            resp = CFG.session.get(SEARCH_URL, params=params, timeout=CFG.TIMEOUT)
+            with CFProfile.span("fetch"):
+                resp = CFG.session.get(search_url, params=params)
         except requests.RequestException as e:
             last_exc = e
-            time.sleep((2 ** attempt) * 0.5)
+            CFMetrics.sleep((2 ** attempt) * 0.5, "backoff", url=search_url)
             continue
 
-        _save_debug_response(resp, params, SEARCH_URL, note=f"attempt_{attempt}")
+        with CFProfile.span("debug_dump"):
+            _save_debug_response(resp, params, search_url, note=f"attempt_{attempt}", keep_decoded=not stream)
 
         if resp.status_code == 200:
+            if stream:
+                # an undecodable body ends the page, as the non-streaming path treats it as {}
+                return CFDecode.iter_results(resp, on_done=lambda n: CFMetrics.record_page(search_url, n),
+                                             on_error=lambda e: print(f"[warn] page body is not valid JSON ({e}); ignoring the rest of the page")), None, None
             try:
-                data = resp.json()
+                with CFProfile.span("decode"):
+                    data = CFDecode.decode_response(resp)
             except Exception:
                 data = {}
             page_results = data.get("result") or []
@@ -145,10 +285,11 @@ def _fetch_page(start_iso=None, end_iso=None, subject=None, sender=None, recipie
                         break
             if page_results is None:
                 page_results = []
+            CFMetrics.record_page(search_url, len(page_results))
             ri = data.get("result_info") or {}
             return page_results, len(page_results), ri
         if resp.status_code in (429, 500, 502, 503, 504):
-            time.sleep((2 ** attempt) * 0.5 + CFG.RATE_LIMIT_SLEEP)
+            CFMetrics.sleep((2 ** attempt) * 0.5 + CFG.RATE_LIMIT_SLEEP, "backoff", url=search_url)
             last_exc = Exception(f"Transient HTTP {resp.status_code}")
             continue
         raise Exception(f"API error {resp.status_code}: {resp.text}")
@@ -164,6 +305,7 @@ def fetch_by_message_id(message_id, per_page=CFG.PER_PAGE, preserve_duplicates=T
     collected = []
     requests_made = 0
     cursor = None
+    search_url = _search_url()
     max_iters = 10000
 
     for it in range(max_iters):
@@ -177,16 +319,18 @@ def fetch_by_message_id(message_id, per_page=CFG.PER_PAGE, preserve_duplicates=T
         last_exc = None
         for attempt in range(CFG.MAX_RETRIES):
             try:
-                resp = CFG.session.get(SEARCH_URL, params=params_query, timeout=CFG.TIMEOUT)
+                with CFProfile.span("fetch"):
+                    resp = CFG.session.get(search_url, params=params_query)
             except requests.RequestException as e:
                 last_exc = e
-                time.sleep((2 ** attempt) * 0.5)
+                CFMetrics.sleep((2 ** attempt) * 0.5, "backoff", url=search_url)
                 continue
-            _save_debug_response(resp, params_query, SEARCH_URL, note=f"msgid_attempt_{attempt}")
+            with CFProfile.span("debug_dump"):
+                _save_debug_response(resp, params_query, search_url, note=f"msgid_attempt_{attempt}")
             if resp.status_code == 200:
                 break
             if resp.status_code in (429, 500, 502, 503, 504):
-                time.sleep((2 ** attempt) * 0.5 + CFG.RATE_LIMIT_SLEEP)
+                CFMetrics.sleep((2 ** attempt) * 0.5 + CFG.RATE_LIMIT_SLEEP, "backoff", url=search_url)
                 last_exc = Exception(f"Transient HTTP {resp.status_code}")
                 continue
             raise Exception(f"API error {resp.status_code}: {resp.text}")
@@ -195,7 +339,8 @@ def fetch_by_message_id(message_id, per_page=CFG.PER_PAGE, preserve_duplicates=T
         requests_made += 1
 
         try:
-            data = resp.json()
+            with CFProfile.span("decode"):
+                data = CFDecode.decode_response(resp)
         except Exception:
             data = {}
         page = data.get("result") or []
@@ -207,8 +352,10 @@ def fetch_by_message_id(message_id, per_page=CFG.PER_PAGE, preserve_duplicates=T
         if page is None:
             page = []
 
+        CFMetrics.record_page(search_url, len(page))
         for r in page:
             collected.append(r)
+        _feed_local_index(page)
 
         ri = data.get("result_info") or {}
         next_val = ri.get("next") or data.get("next") or ri.get("next_cursor") or data.get("next_cursor") or None
@@ -224,7 +371,7 @@ def fetch_by_message_id(message_id, per_page=CFG.PER_PAGE, preserve_duplicates=T
         next_cursor = _extract_cursor_from_next(next_val)
         if next_cursor:
             cursor = next_cursor
-            time.sleep(CFG.SLEEP_BETWEEN_REQUESTS)
+            CFMetrics.sleep(CFG.SLEEP_BETWEEN_REQUESTS)
             continue
         break
 
@@ -234,21 +381,90 @@ def fetch_by_message_id(message_id, per_page=CFG.PER_PAGE, preserve_duplicates=T
 # ---------------------------
 # Deterministic divide-and-conquer fetcher (unchanged)
 # ---------------------------
-def fetch_all_by_time_divide_and_conquer(start_iso, end_iso, subject=None, sender=None, recipient=None, domain=None, query=None, per_page=CFG.PER_PAGE):
+def fetch_all_by_time_divide_and_conquer(start_iso, end_iso, subject=None, sender=None, recipient=None, domain=None, query=None, per_page=CFG.PER_PAGE, on_records=None, keep_records=True, initial_slices=None, on_chunk=None, feed_index=True, should_stop=None):
+    """
+    on_records: optional callback, called with each page's newly seen (deduplicated) records.
+    keep_records: set False together with on_records to stream without materializing the results
+    (the returned list is then empty; meta["records_seen"] still counts them). Duplicates are then
+    found without remembering every ID: a record can only come back in a sub-window of a full page
+    that is being split, or in the page next to a shared slice boundary, so only the IDs of the
+    full pages on the current recursion path and of the previous page are kept.
+    initial_slices: optional sorted list of datetimes strictly inside (start, end) to pre-split the
+    range at (see CF_Planner.plan_slices); each slice is then bisected as usual.
+    on_chunk: optional callback (s_dt, e_dt, returned_count, elapsed_seconds) after every page request.
+    With keep_records=False pages are decoded incrementally (CF_Decode.iter_results) and handed to
+    on_records in batches of STREAM_BATCH, so a whole decoded page is never held at once.
+    feed_index: set False to leave the local index (CF_LocalIndex.py) alone, e.g. for aggregates.
+    should_stop: optional callable checked before every page request; once it returns True the
+    search ends (meta["completed"] False, meta["reason"] "stopped").
+    """
     start_dt = _parse_iso_to_dt_or_none(start_iso)
     end_dt = _parse_iso_to_dt_or_none(end_iso)
     if not start_dt or not end_dt:
         raise ValueError("start_iso/end_iso must be valid ISO strings")
 
     collected = []
-    seen_ids = set()
+    seen_ids = set()    # keep_records: every ID (the records themselves are kept anyway)
+    scopes = []         # streaming: ID sets of the full pages being split on the current path
+    last_ids = set()    # streaming: IDs of the previous page
+    records_seen = 0
     requests_made = 0
     aborted = False
+    stopped = False
+    fkey = filter_key(subject=subject, sender=sender, recipient=recipient, domain=domain, query=query)
+    streaming = not keep_records
+
+    def _index(page, coverage=None):
+        if feed_index:
+            _feed_local_index(page, coverage)
+
+    def _hand_off(fresh):
+        if not fresh:
+            return
+        if keep_records:
+            collected.extend(fresh)
+        if on_records is not None:
+            on_records(fresh)
+        _index(fresh)
+
+    def _seen(rid, page_ids):
+        if rid in page_ids:
+            return True
+        if streaming:
+            return rid in last_ids or any(rid in ids for ids in scopes)
+        return rid in seen_ids
+
+    def _accept(page):
+        """Dedup a page (a list, or a ResultStream when streaming) into the results; returns (record count, page IDs)."""
+        nonlocal records_seen, last_ids
+        fresh = []
+        page_ids = set()
+        n = 0
+        with CFProfile.span("dedup"):
+            for r in page:
+                n += 1
+                rid = _get_record_id(r)
+                if not _seen(rid, page_ids):
+                    records_seen += 1
+                    if not streaming:
+                        seen_ids.add(rid)
+                    fresh.append(r)
+                    if streaming and len(fresh) >= STREAM_BATCH:
+                        _hand_off(fresh)
+                        fresh = []
+                page_ids.add(rid)
+        _hand_off(fresh)
+        last_ids = page_ids
+        return n, page_ids
 
     def _recurse(s_dt: datetime, e_dt: datetime, depth=0):
-        nonlocal requests_made, aborted
+        nonlocal requests_made, aborted, stopped
         if aborted:
             return
+        if should_stop is not None and should_stop():
+            aborted = stopped = True
+            print("[info] search stopped by its caller")
+            return
         if requests_made >= CFG.MAX_TOTAL_REQUESTS:
             aborted = True
             print("[abort] reached MAX_TOTAL_REQUESTS")
@@ -260,34 +476,33 @@ def fetch_all_by_time_divide_and_conquer(start_iso, end_iso, subject=None, sende
         if depth > CFG.MAX_RECURSION_DEPTH:
             print(f"[warn] max recursion depth ({CFG.MAX_RECURSION_DEPTH}) reached; fetching once: {s_dt} -> {e_dt}")
             try:
-                page, plen, ri = _fetch_page(_iso(s_dt), _iso(e_dt), subject=subject, sender=sender, recipient=recipient, domain=domain, query=query, per_page=per_page)
+                page, plen, ri = _fetch_page(_iso(s_dt), _iso(e_dt), subject=subject, sender=sender, recipient=recipient, domain=domain, query=query, per_page=per_page, stream=streaming)
                 requests_made += 1
+                plen, _ = _accept(page)
             except Exception as ex:
                 print("[error] request failed at max depth:", ex)
                 aborted = True
                 return
-            for r in page:
-                rid = _get_record_id(r)
-                if rid not in seen_ids:
-                    seen_ids.add(rid)
-                    collected.append(r)
+            _index(None, (fkey, s_dt, e_dt) if plen < per_page else None)
             return
 
         try:
-            page, plen, ri = _fetch_page(_iso(s_dt), _iso(e_dt), subject=subject, sender=sender, recipient=recipient, domain=domain, query=query, per_page=per_page)
+            t0 = time.perf_counter()
+            page, plen, ri = _fetch_page(_iso(s_dt), _iso(e_dt), subject=subject, sender=sender, recipient=recipient, domain=domain, query=query, per_page=per_page, stream=streaming)
+            elapsed = time.perf_counter() - t0
             requests_made += 1
+            plen, page_ids = _accept(page)
         except Exception as ex:
             print("[error] request failed:", ex)
             aborted = True
             return
+        if on_chunk is not None:
+            on_chunk(s_dt, e_dt, plen, elapsed)
 
         print(f"[chunk depth={depth}] {s_dt.isoformat()} -> {e_dt.isoformat()} : returned {plen} items (requests={requests_made})")
 
-        for r in page:
-            rid = _get_record_id(r)
-            if rid not in seen_ids:
-                seen_ids.add(rid)
-                collected.append(r)
+        # a chunk that came back short of a full page is complete for its whole window
+        _index(None, (fkey, s_dt, e_dt) if plen < per_page else None)
 
         if plen < per_page:
             return
@@ -297,37 +512,48 @@ def fetch_all_by_time_divide_and_conquer(start_iso, end_iso, subject=None, sende
             if delta.total_seconds() <= 0:
                 print("[warn] cannot split tiny chunk further; accepting current results from this chunk")
                 return
-            for i in range(CFG.MICRO_SUBSLICES):
-                a = s_dt + delta * i
-                b = s_dt + delta * (i + 1)
+            subs = [(s_dt + delta * i, s_dt + delta * (i + 1)) for i in range(CFG.MICRO_SUBSLICES)]
+        else:
+            mid = s_dt + (e_dt - s_dt) / 2
+            subs = [(s_dt, mid), (mid, e_dt)]
+
+        # this page's records come back in the sub-windows: remember them only while those are fetched
+        scopes.append(page_ids)
+        try:
+            for a, b in subs:
                 _recurse(a, b, depth + 1)
                 if aborted:
                     return
-            return
+        finally:
+            scopes.pop()
 
-        mid = s_dt + (e_dt - s_dt) / 2
-        _recurse(s_dt, mid, depth + 1)
+    bounds = [start_dt] + [b for b in (initial_slices or []) if start_dt < b < end_dt] + [end_dt]
+    for a, b in zip(bounds, bounds[1:]):
+        _recurse(a, b, depth=0)
         if aborted:
-            return
-        _recurse(mid, e_dt, depth + 1)
-
-    _recurse(start_dt, end_dt, depth=0)
+            break
 
-    meta = {"requests_made": requests_made, "completed": not aborted, "reason": "done" if not aborted else "aborted"}
+    meta = {"requests_made": requests_made, "completed": not aborted,
+            "reason": "stopped" if stopped else "aborted" if aborted else "done", "records_seen": records_seen}
+    if len(bounds) > 2:
+        meta["initial_slices"] = len(bounds) - 1
     return collected, meta
 
 # ---------------------------
 # Flatten + CSV export (unchanged)
 # ---------------------------
-def filter_for_delivered_emails_and_output(path, emails):
-    delivered_emails = []
+PURGABLE_RECIPIENT_SUFFIXES = ('@exchange.asu.edu', '@email.asu.edu', '@mainex1.asu.edu')
 
-    for email in emails:
-        if email["is_quarantined"] == False:
-            for recipient in email["client_recipients"]:
-                if recipient.endswith(('@exchange.asu.edu', '@email.asu.edu', '@mainex1.asu.edu')):
-                    delivered_emails.append(email)
-                    break
+def is_delivered_to_purgable(email):
+    if email.get("is_quarantined") != False:
+        return False
+    for recipient in email.get("client_recipients") or []:
+        if recipient.endswith(PURGABLE_RECIPIENT_SUFFIXES):
+            return True
+    return False
+
+def filter_for_delivered_emails_and_output(path, emails):
+    delivered_emails = [email for email in emails if is_delivered_to_purgable(email)]
 
     if len(delivered_emails) > 0:
         ok, written = export_csv_and_validate(path, delivered_emails)
@@ -374,16 +600,17 @@ def export_csv_and_validate(path, items):
     flat_rows = []
     all_keys = set()
 
-    for rec in items:
-        flat = flatten_record(rec)
-        flat_rows.append(flat)
-        all_keys.update(flat.keys())
+    with CFProfile.span("flatten"):
+        for rec in items:
+            flat = flatten_record(rec)
+            flat_rows.append(flat)
+            all_keys.update(flat.keys())
 
     fieldnames = sorted(all_keys)
 
     written = 0
     try:
-        with open(p, "w", newline="", encoding="utf-8") as cf:
+        with CFProfile.span("write"), open(p, "w", newline="", encoding="utf-8") as cf:
             writer = csv.DictWriter(cf, fieldnames=fieldnames)
             writer.writeheader()
             for flat in flat_rows:
@@ -488,7 +715,7 @@ def process_message_id_file(in_csv_path, out_csv_path, delay_between_ids=CFG.DEL
         progress["index"] = idx + 1
         progress["done_ids"] = list(done_ids)
         save_msgid_progress(progress)
-        time.sleep(delay_between_ids)
+        CFMetrics.sleep(delay_between_ids)
 
     print(f"[batch done] fetched total records across IDs: {len(collected_all)} requests_total={requests_total}")
     ok, written = export_csv_and_validate(out_csv_path, collected_all)
@@ -1,31 +1,61 @@
 import os
-import requests
-from dotenv import load_dotenv
+import threading
 from pathlib import Path
 
+# Everything that costs time at import (reading .env, checking credentials, importing
+# requests, creating debug/) is done on first use of the attribute that needs it, via
+# the module __getattr__ at the bottom. 'CFTools.py --help' never touches any of it.
+#   ACCOUNT_ID, AUTH_EMAIL, AUTH_KEY, API_BASE_URL -> load .env, validate credentials, install CF_Metrics
+#   session                                        -> import requests, build the shared session (CF_Transport.py)
+#   DEBUG_DIR, MSGID_PROGRESS, LOCAL_INDEX_PATH, JOURNAL_PATH, RECLASSIFY_REJECTIONS,
+#   SETTINGS_SNAPSHOT_PATH                         -> create debug/
+
 # ---------------------------
 # CONFIG / TUNABLES
 # ---------------------------
 env_path = Path(__file__).resolve().parent / ".env"
-if env_path.exists():
-    load_dotenv(dotenv_path=env_path)
-
-ACCOUNT_ID = os.getenv("CF_ACCOUNT_ID")
-AUTH_EMAIL = os.getenv("CLOUDFLARE_EMAIL")
-AUTH_KEY = os.getenv("CLOUDFLARE_API_KEY")
-
-if not all((ACCOUNT_ID, AUTH_EMAIL, AUTH_KEY)):
-    raise EnvironmentError("Missing CF_ACCOUNT_ID or CLOUDFLARE_EMAIL or CLOUDFLARE_API_KEY in environment or .env")
-
-API_BASE_URL = f"https://api.cloudflare.com/client/v4/accounts/{ACCOUNT_ID}/email-security"
 
 API_MAX_PER_PAGE = 1000
 PER_PAGE = 1000      # Cloudflare limit
 TIMEOUT = 90
+CONNECT_TIMEOUT = 10
+# read timeout per endpoint class (CF_Transport.endpoint_class), used when a call passes no timeout
+READ_TIMEOUTS = {"search": TIMEOUT, "bulk": TIMEOUT * 2, "action": TIMEOUT, "content": 120, "settings": 30}
+HTTP_POOL_SIZE = 32         # keep-alive connections per host; at least the number of concurrent workers
+# auth headers for every request: auto | token (Authorization: Bearer) | key (X-Auth-Email + X-Auth-Key)
+AUTH_MODE = os.getenv("CF_AUTH_MODE", "auto").lower()
 MAX_RETRIES = 5
 SLEEP_BETWEEN_REQUESTS = 0.05
 RATE_LIMIT_SLEEP = 1.0
 
+# Limiter shared by every request on the session (CF_RateLimit.py); Cloudflare allows 1200 requests / 5 min
+RATE_LIMIT_RPS = float(os.getenv("CF_RATE_LIMIT_RPS", "4"))
+RATE_LIMIT_BURST = 20       # requests a rested bucket lets through at once (5 s of refill)
+RATE_LIMIT_WINDOW = 300     # seconds; no more than RATE_LIMIT_WINDOW_MAX requests in any window this long
+RATE_LIMIT_WINDOW_MAX = int(os.getenv("CF_RATE_LIMIT_WINDOW_MAX", "1200"))   # 0 = no window cap
+
+# Bulk move pipeline (CF_Pipeline.py): batches in flight at once, adaptive batch size within the API maximum
+MOVE_MAX_BATCH = 100
+MOVE_INITIAL_BATCH = 50
+MOVE_WORKERS = 4
+MOVE_TARGET_LATENCY = 10.0  # seconds; slower batches shrink the batch size
+RELEASE_MAX_BATCH = 100     # quarantine release (CF_QuarantineRelease.py): same pipeline and limits as bulk move
+RELEASE_INITIAL_BATCH = 50
+RELEASE_WORKERS = 4
+RECLASSIFY_WORKERS = 8      # reclassify submissions in flight; at most this many - 1 past the success target
+RECLASSIFY_REJECTION_TTL_DAYS = 30   # how long a rejected postfix ID is skipped by later runs
+# The account's raw message retention: older reclassify candidates are tried last. The API does not
+# report it and it differs per plan, so it is off (0) unless CF_RECLASSIFY_RAW_RETENTION_HOURS is set;
+# a guessed value would push messages that are still retained to the back.
+RECLASSIFY_RAW_RETENTION_HOURS = float(os.getenv("CF_RECLASSIFY_RAW_RETENTION_HOURS", "0"))
+FETCH_TARGET_LATENCY = 5.0  # seconds; a slower one-ID GET (raw, preview, trace) takes one request out of flight
+RAW_WORKERS = 8             # raw EML downloads in flight (CF_RAWMESSAGE.py)
+RAW_CHUNK_BYTES = 64 * 1024 # streamed to disk in pieces of this size
+IOC_WORKERS = None          # EML parser processes (CF_IOC.py); None = one per CPU
+IOC_CHUNKSIZE = 16          # files handed to a parser process at a time
+PREVIEW_WORKERS = 8         # preview screenshots fetched at once (CF_EmailPreview.py)
+TRACE_WORKERS = 8           # message traces fetched at once (CF_Messagetrace.py)
+
 # Safety caps
 MAX_TOTAL_REQUESTS = 200000
 MAX_RECURSION_DEPTH = 40
@@ -34,17 +64,93 @@ MAX_RECURSION_DEPTH = 40
 MIN_CHUNK_SECONDS = 0.001   # 1 ms
 MICRO_SUBSLICES = 10
 
-# Debug & checkpoint folder
-DEBUG_DIR = Path(__file__).resolve().parent / "debug"
-DEBUG_DIR.mkdir(exist_ok=True)
-MSGID_PROGRESS = DEBUG_DIR / "msgid_progress.json"
+# Debug & checkpoint folder (created on first use)
+_DEBUG_PATH = Path(__file__).resolve().parent / "debug"
+
+# Local index of everything the search functions download (CFTools.py local-search)
+LOCAL_INDEX_ENABLED = os.getenv("CF_LOCAL_INDEX", "1") != "0"
+LOCAL_INDEX_GAP_TOLERANCE = 300   # seconds of uncovered time ignored when checking coverage
+
+# Job journal of bulk actions (CF_Journal.py); item states are written in batches
+JOURNAL_FLUSH_ITEMS = 500
+JOURNAL_FLUSH_SECONDS = 2.0
 
 # Default delay between each message-id query (no prompt)
 DELAY_BETWEEN_IDS = 0.2
 
-# HTTP session
-session = requests.Session()
-session.headers.update({
-            "Authorization": f"Bearer {AUTH_KEY}",
-            "Accept": "application/json",
-})
\ No newline at end of file
+# In-memory caches (CF_Cache.py); they pay off inside the daemon (CFTools.py daemon start)
+SETTINGS_CACHE_TTL = 600    # allow policies, block senders, domains
+SEARCH_CACHE_TTL = 120      # results of identical search commands
+SEARCH_CACHE_ENTRIES = 16
+SEARCH_CACHE_MAX_RECORDS = 50000   # records held across all cached searches; larger results are not cached
+# Settings snapshot (CF_Settings.py): lookups answer from debug/settings.sqlite, synced when older than this
+SETTINGS_MAX_AGE = float(os.getenv("CF_SETTINGS_MAX_AGE", "900"))
+SETTINGS_FULL_SYNC_AGE = float(os.getenv("CF_SETTINGS_FULL_SYNC_AGE", "3600"))   # deletions are only seen by a full sync
+SETTINGS_WORKERS = 4        # settings pages fetched at once on a full sync
+DAEMON_HOST = "127.0.0.1"
+DAEMON_PORT = 0             # 0 = any free port; the chosen port is written to debug/daemon.json
+
+# ---------------------------
+# Lazy initialisation
+# ---------------------------
+_init_lock = threading.RLock()
+
+def _load_credentials():
+    if env_path.exists():
+        from dotenv import load_dotenv
+        load_dotenv(dotenv_path=env_path)
+
+    account_id = os.getenv("CF_ACCOUNT_ID")
+    auth_email = os.getenv("CLOUDFLARE_EMAIL")
+    auth_key = os.getenv("CLOUDFLARE_API_KEY")
+
+    if not all((account_id, auth_email, auth_key)):
+        raise EnvironmentError("Missing CF_ACCOUNT_ID or CLOUDFLARE_EMAIL or CLOUDFLARE_API_KEY in environment or .env")
+
+    # CF_API_BASE_URL points the whole toolkit somewhere else, e.g. the local emulator (CF_Emulator.py)
+    api_base_url = os.getenv("CF_API_BASE_URL") or f"https://api.cloudflare.com/client/v4/accounts/{account_id}/email-security"
+
+    # whoever asks for credentials or the API URL is about to make requests: record latency /
+    # status / bytes of every HTTP request the toolkit makes from here on (CF_Metrics.py)
+    import CF_Metrics as CFMetrics
+    CFMetrics.install()
+    return {"ACCOUNT_ID": account_id, "AUTH_EMAIL": auth_email, "AUTH_KEY": auth_key, "API_BASE_URL": api_base_url}
+
+def _build_session():
+    # HTTP session: pooled, paced, instrumented, same auth everywhere
+    import CF_Transport as CFTransport
+    return {"session": CFTransport.build_session()}
+
+def _make_debug_dir():
+    _DEBUG_PATH.mkdir(exist_ok=True)
+    return {
+        "DEBUG_DIR": _DEBUG_PATH,
+        "MSGID_PROGRESS": _DEBUG_PATH / "msgid_progress.json",
+        "LOCAL_INDEX_PATH": _DEBUG_PATH / "local_index.sqlite",
+        "JOURNAL_PATH": _DEBUG_PATH / "jobs.sqlite",
+        "RECLASSIFY_REJECTIONS": _DEBUG_PATH / "reclassify_rejections.json",
+        "SETTINGS_SNAPSHOT_PATH": _DEBUG_PATH / "settings.sqlite",
+    }
+
+_LAZY = {
+    "ACCOUNT_ID": _load_credentials,
+    "AUTH_EMAIL": _load_credentials,
+    "AUTH_KEY": _load_credentials,
+    "API_BASE_URL": _load_credentials,
+    "session": _build_session,
+    "DEBUG_DIR": _make_debug_dir,
+    "MSGID_PROGRESS": _make_debug_dir,
+    "LOCAL_INDEX_PATH": _make_debug_dir,
+    "JOURNAL_PATH": _make_debug_dir,
+    "RECLASSIFY_REJECTIONS": _make_debug_dir,
+    "SETTINGS_SNAPSHOT_PATH": _make_debug_dir,
+}
+
+def __getattr__(name):
+    init = _LAZY.get(name)
+    if init is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _init_lock:
+        if name not in globals():
+            globals().update(init())
+    return globals()[name]
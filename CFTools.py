@@ -4,12 +4,55 @@
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
 import argparse
+import importlib.util
+import os
+import sys
+import time
 
-import CFFullSearch as CFSearch
-import CF_BlockSender as CFBlock
-import CFScriptConfig as CFG
-import CF_RECLASS as CFReclass
-import CF_BULKMOVE as CFBulkMove
+# ---------------------------
+# Lazy imports
+# ---------------------------
+def _lazy_import(name):
+    """Bind a module now but execute it on first attribute access, so '--help' and the quick
+    single-ID commands only pay for the modules (and requests) they actually use."""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+CFSearch = _lazy_import("CFFullSearch")
+CFBlock = _lazy_import("CF_BlockSender")
+CFG = _lazy_import("CFScriptConfig")
+CFReclass = _lazy_import("CF_RECLASS")
+CFBulkMove = _lazy_import("CF_BULKMOVE")
+CFWatchlist = _lazy_import("CF_Watchlist")
+CFLocalIndex = _lazy_import("CF_LocalIndex")
+CFAggregate = _lazy_import("CF_Aggregate")
+CFPlanner = _lazy_import("CF_Planner")
+CFMetrics = _lazy_import("CF_Metrics")
+CFProfile = _lazy_import("CF_Profile")
+CFCache = _lazy_import("CF_Cache")
+CFDaemon = _lazy_import("CF_Daemon")
+CFAllow = _lazy_import("CF_AllowPolicy2")
+CFDomain = _lazy_import("CF_DomainCheck")
+CFPurge = _lazy_import("CF_Purge")
+CFJournal = _lazy_import("CF_Journal")
+CFRelease = _lazy_import("CF_QuarantineRelease")
+CFRaw = _lazy_import("CF_RAWMESSAGE")
+CFIOC = _lazy_import("CF_IOC")
+CFPreview = _lazy_import("CF_EmailPreview")
+CFTrace = _lazy_import("CF_Messagetrace")
+CFSettings = _lazy_import("CF_Settings")
+
+# argparse dests holding file/directory paths; made absolute against the caller's working
+# directory, so a command forwarded to the daemon writes where the caller expects
+PATH_ARGS = ("out", "filtered_out_path", "input_file", "output_file", "watchlist_file", "out_dir", "aggregate", "metrics_out", "db", "summary")
+ID_FILE_HELP = 'The path of the input CSV (postfix_id column, e.g. a search export) or text file (one postfix ID per line).'
 
 # ---------------------------
 # Search for emails using arguments
@@ -18,11 +61,19 @@ def arg_search(args):
     if not any((args.sender, args.id, args.subject, args.domain, args.query, args.recipient)):
         print("[error] no search criteria specified. Run \'CFTools.py search -h\' for help. ")
         return
+    search_cache = CFCache.get_cache("search", ttl=CFG.SEARCH_CACHE_TTL, max_entries=CFG.SEARCH_CACHE_ENTRIES,
+                                     max_weight=CFG.SEARCH_CACHE_MAX_RECORDS, weigh=lambda hit: len(hit[0]))
     # search off message ID
     if args.id != None:
         print(args.id)
-        items, meta = CFSearch.fetch_by_message_id(args.id, per_page=CFG.PER_PAGE, preserve_duplicates=True)
-        print(f"[done] message-id fetch collected {len(items)} items; meta={meta}")
+        hit = None if args.fresh else search_cache.get(("id", args.id))
+        if hit:
+            (items, meta), age = hit
+            print(f"[done] answered from the daemon's search cache ({age:.0f}s old, --fresh to refetch); {len(items)} items")
+        else:
+            items, meta = CFSearch.fetch_by_message_id(args.id, per_page=CFG.PER_PAGE, preserve_duplicates=True)
+            search_cache.put(("id", args.id), (items, meta))
+            print(f"[done] message-id fetch collected {len(items)} items; meta={meta}")
     
     # search off sender, recipient, or domain
     else:
@@ -31,15 +82,67 @@ def arg_search(args):
         start_iso = CFSearch._iso(start_dt)
         end_iso = CFSearch._iso(end_dt)
 
-        print(f"[search] start={start_iso} end={end_iso} per_page={CFG.PER_PAGE}")
-        items, meta = CFSearch.fetch_all_by_time_divide_and_conquer(start_iso, end_iso, subject=args.subject, sender=args.sender, recipient=args.recipient, domain=args.domain, query=args.query, per_page=CFG.PER_PAGE)
+        filters = {"subject": args.subject, "sender": args.sender, "recipient": args.recipient, "domain": args.domain, "query": args.query}
+
+        if args.plan:
+            est = CFPlanner.estimate(start_dt, end_dt, filters, per_page=CFG.PER_PAGE, probes=int(args.probes))
+            CFPlanner.print_plan(est)
+            return
+
+        fkey = CFSearch.filter_key(**filters)
+        hit = None if args.fresh else search_cache.get((fkey, str(args.days)))
+        if hit:
+            (items, meta), age = hit
+            print(f"[done] answered from the daemon's search cache ({age:.0f}s old, --fresh to refetch); {len(items)} items")
+            if args.aggregate:
+                aggregator = CFAggregate.SearchAggregator(top_k=int(args.top_k))
+                aggregator.add(items)
+                _write_aggregate_output(args, aggregator)
+                return
+            _write_search_outputs(args, items)
+            return
+
+        # pre-split the range from the learned density profile, and keep learning from this run
+        slices = CFPlanner.plan_slices(start_dt, end_dt, fkey, per_page=CFG.PER_PAGE)
+        recorder = CFPlanner.DensityRecorder(fkey, per_page=CFG.PER_PAGE)
+
+        print(f"[search] start={start_iso} end={end_iso} per_page={CFG.PER_PAGE} initial_slices={len(slices) + 1}")
+        if args.aggregate:
+            # stream pages straight into the aggregator; records are never kept, nor written to the local index
+            aggregator = CFAggregate.SearchAggregator(top_k=int(args.top_k))
+            items, meta = CFSearch.fetch_all_by_time_divide_and_conquer(start_iso, end_iso, per_page=CFG.PER_PAGE, on_records=aggregator.add, keep_records=False, initial_slices=slices, on_chunk=recorder.on_chunk, feed_index=False, **filters)
+            recorder.save()
+            print(f"[done] aggregated {meta['records_seen']} items; meta={meta}")
+            _write_aggregate_output(args, aggregator)
+            return
+        items, meta = CFSearch.fetch_all_by_time_divide_and_conquer(start_iso, end_iso, per_page=CFG.PER_PAGE, initial_slices=slices, on_chunk=recorder.on_chunk, **filters)
+        recorder.save()
+        if meta.get("completed"):
+            search_cache.put((fkey, str(args.days)), (items, meta))
         print(f"[done] collected {len(items)} items; meta={meta}")
 
+    if args.aggregate:
+        aggregator = CFAggregate.SearchAggregator(top_k=int(args.top_k))
+        aggregator.add(items)
+        _write_aggregate_output(args, aggregator)
+        return
+    _write_search_outputs(args, items)
+
+def _write_aggregate_output(args, aggregator):
+    summary = aggregator.summary()
+    CFAggregate.print_summary(summary)
+    out = args.aggregate if args.aggregate is not True else str(Path(args.cwd) / f"cf_summary_{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}.json")
+    written = CFAggregate.write_summary(out, summary)
+    print(f"\n[success] summary of {summary['records']} records written to {written}")
 
+# ---------------------------
+# Write search results (and optionally the delivered-only subset) to CSV
+# ---------------------------
+def _write_search_outputs(args, items):
     # items returned by search
     if len(items) > 0:
         # parse output path cf_investigate_timestamp.csv
-        default_csv = Path.cwd() / f"cf_investigate_{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}.csv"
+        default_csv = Path(args.cwd) / f"cf_investigate_{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}.csv"
         if not args.out:
             out_csv = str(default_csv)
         else:
@@ -56,7 +159,7 @@ def arg_search(args):
             print(f"\n[warning] CSV exported to {out_csv} with {written} rows (MAY NOT MATCH collected count {len(items)}). See debug/ for diagnostics.")
 
         if args.filter_output:
-            default_filtered_out_path = Path.cwd() / f"cf_delivered_{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}.csv"
+            default_filtered_out_path = Path(args.cwd) / f"cf_delivered_{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}.csv"
             if not args.filtered_out_path:
                 filtered_out_csv = str(default_filtered_out_path)
             else:
@@ -88,6 +191,9 @@ def arg_block(args):
 # Submit a reclassification using arguments
 # ---------------------------
 def arg_reclassify(args):
+    if args.resume:
+        CFReclass.bulk_reclassify(None, None, None, resume=args.resume, workers=args.workers, use_cache=not args.retry_rejected)
+        return
     #reclassify a message
     if(not args.disposition):
         print("\n[error] postifx and disposition are required to reclassify a message. Run \'CFTools.py reclassify -h\' for help.")
@@ -99,29 +205,215 @@ def arg_reclassify(args):
     if args.postfix:
         CFReclass.reclassify_message(args.postfix, args.disposition.upper())
     elif args.input_file:
-        CFReclass.bulk_reclassify(args.input_file, args.number_of_successes, args.disposition)
+        CFReclass.bulk_reclassify(args.input_file, args.number_of_successes, args.disposition, workers=args.workers,
+                                  rank=not args.no_rank, use_cache=not args.retry_rejected)
     
     
 
 def arg_move(args):
+    if args.resume:
+        failures = CFBulkMove.bulk_move(None, None, None, workers=args.workers, resume=args.resume)
+        return 1 if failures else 0
     if not any((args.postfix, args.input_file)):
         print("[error] either a postifx id or input csv is required.")
         return
+    if not args.destination:
+        print("[error] a destination is required. Run \'CFTools.py move -h\' for help.")
+        return
     
     if args.input_file:
-        CFBulkMove.bulk_move(args.destination, args.input_file, args.output_file)
+        failures = CFBulkMove.bulk_move(args.destination, args.input_file, args.output_file, workers=args.workers)
+        return 1 if failures else 0
     elif args.postfix:
         response = CFBulkMove.single_move(args.postfix, args.destination)
         if response.status_code == 200:
             print(f"[success] moved {args.postfix} to {args.destination}")
         else:
             print(f"[error] failed to move message with error {response.status_code}")
+            return 1
 
+# ---------------------------
+# Release quarantined messages from a file of postfix IDs
+# ---------------------------
+def arg_release(args):
+    if not any((args.input_file, args.resume)):
+        print("[error] an input file of postfix IDs is required. Run \'CFTools.py release -h\' for help.")
+        return
+    out = args.output_file or str(Path(args.cwd) / f"release_results_{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}.csv")
+    return CFRelease.release_file(args.input_file, out, workers=args.workers, resume=args.resume)
 
+# ---------------------------
+# Download raw EML into the local content-addressed store
+# ---------------------------
+def arg_raw(args):
+    if not any((args.input_file, args.postfix)):
+        print("[error] a postfix ID or an input file of postfix IDs is required. Run \'CFTools.py raw -h\' for help.")
+        return
+    store = args.out_dir or str(Path(args.cwd) / "raw_store")
+    ids = CFRelease.iter_postfix_ids(args.input_file) if args.input_file else args.postfix
+    counts = CFRaw.download_raw(ids, store, workers=args.workers)
+    return 1 if counts["failed"] else 0
 
-if __name__ == "__main__":
+# ---------------------------
+# Save preview screenshots of a list of messages
+# ---------------------------
+def arg_preview(args):
+    if not any((args.input_file, args.postfix)):
+        print("[error] a postfix ID or an input file of postfix IDs is required. Run \'CFTools.py preview -h\' for help.")
+        return
+    out_dir = args.out_dir or str(Path(args.cwd) / "previews")
+    ids = CFRelease.iter_postfix_ids(args.input_file) if args.input_file else args.postfix
+    counts = CFPreview.export_previews(ids, out_dir, workers=args.workers, contact_sheet=args.contact_sheet)
+    return 1 if counts["failed"] else 0
+
+# ---------------------------
+# Collect message traces and summarise delivery latency
+# ---------------------------
+def arg_trace(args):
+    if not any((args.input_file, args.postfix)):
+        print("[error] a postfix ID or an input file of postfix IDs is required. Run \'CFTools.py trace -h\' for help.")
+        return
+    events = args.output_file or str(Path(args.cwd) / f"trace_events_{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}.jsonl")
+    summary = args.summary or str(Path(events).with_name(f"{Path(events).stem}_summary.csv"))
+    ids = CFRelease.iter_postfix_ids(args.input_file) if args.input_file else args.postfix
+    _, failures = CFTrace.collect_traces(ids, events, summary, workers=args.workers)
+    return 1 if failures else 0
+
+# ---------------------------
+# Parse raw EML into the IOC table, or pivot on an IOC
+# ---------------------------
+def arg_ioc(args):
+    store = args.out_dir or str(Path(args.cwd) / "raw_store")
+    db_path = args.db or str(Path(store) / "iocs.sqlite")
+    if args.pivot:
+        CFIOC.print_pivot(CFIOC.pivot(db_path, args.pivot, kind=args.kind), args.pivot)
+        return
+    if args.eml_files:
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        entries = CFIOC.file_entries([Path(args.cwd, f) for f in args.eml_files])
+    elif args.input_file:
+        postfix_ids = list(dict.fromkeys(CFRelease.iter_postfix_ids(args.input_file)))
+        CFRaw.download_raw(postfix_ids, store, workers=args.workers)
+        entries = CFIOC.manifest_entries(store, postfix_ids)
+    else:
+        entries = CFIOC.manifest_entries(store)
+    counts = CFIOC.index_messages(entries, db_path, workers=args.processes, reparse=args.reparse)
+    CFIOC.print_shared(CFIOC.shared(db_path, limit=int(args.top_k)))
+    return 1 if counts["failed"] else 0
+
+# ---------------------------
+# List journalled bulk jobs (for --resume)
+# ---------------------------
+def arg_jobs(args):
+    CFJournal.print_jobs(CFJournal.list_jobs(limit=int(args.limit)))
+
+# ---------------------------
+# Search and move delivered matches in one streaming pass
+# ---------------------------
+def arg_purge(args):
+    if not any((args.sender, args.subject, args.domain, args.query, args.recipient)):
+        print("[error] no search criteria specified. Run \'CFTools.py purge -h\' for help. ")
+        return
+    end_dt = datetime.now(timezone.utc)
+    start_dt = end_dt - timedelta(days=int(args.days))
+    filters = {"subject": args.subject, "sender": args.sender, "recipient": args.recipient, "domain": args.domain, "query": args.query}
+    fkey = CFSearch.filter_key(**filters)
+    slices = CFPlanner.plan_slices(start_dt, end_dt, fkey, per_page=CFG.PER_PAGE)
+    recorder = CFPlanner.DensityRecorder(fkey, per_page=CFG.PER_PAGE)
+    out = args.output_file or str(Path(args.cwd) / f"cf_purge_{'dryrun_' if args.dry_run else ''}{end_dt.strftime('%Y%m%dT%H%M%SZ')}.csv")
+
+    print(f"[purge] start={CFSearch._iso(start_dt)} end={CFSearch._iso(end_dt)} destination={args.destination}{' (dry run)' if args.dry_run else ''}")
+    meta, failures = CFPurge.purge(CFSearch._iso(start_dt), CFSearch._iso(end_dt), filters, args.destination, out,
+                                   dry_run=args.dry_run, workers=args.workers, initial_slices=slices, on_chunk=recorder.on_chunk)
+    recorder.save()
+    if not meta.get("completed"):
+        print(f"[error] the search did not finish ({meta.get('reason')}); messages in the rest of the range were not purged.")
+        return 1
+    return 1 if failures else 0
+
+# ---------------------------
+# Search the local index of previously fetched messages
+# ---------------------------
+def arg_local_search(args):
+    if not any((args.sender, args.id, args.subject, args.domain, args.query, args.recipient)):
+        print("[error] no search criteria specified. Run \'CFTools.py local-search -h\' for help. ")
+        return
+    start = time.perf_counter()
+    items, meta = CFLocalIndex.local_search(days=args.days, subject=args.subject, sender=args.sender, recipient=args.recipient, domain=args.domain, query=args.query, message_id=args.id, fallback=args.fallback)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    print(f"[done] local index returned {len(items)} items in {elapsed_ms:.1f} ms; meta={meta}")
+    if meta.get("gaps") and not args.fallback:
+        print(f"[warning] the index does not cover {len(meta['gaps'])} window(s) of this search. Re-run with --fallback to fetch them from the API.")
+    _write_search_outputs(args, items)
+
+# ---------------------------
+# Run a file of saved searches as fused crawls
+# ---------------------------
+def arg_watchlist(args):
+    try:
+        CFWatchlist.run_watchlist(args.watchlist_file, args.out_dir)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"[error] could not load watchlist: {e}")
+
+# ---------------------------
+# Check the allow list / configured domains (answered from the settings cache in the daemon)
+# ---------------------------
+def arg_allow_check(args):
+    if sum(map(bool, (args.email, args.domain, args.input_file))) != 1:
+        print("[error] exactly one of --email, --domain or --input_file is required. Run \'CFTools.py allow-check -h\' for help.")
+        return
+    index = CFAllow.get_policy_index()
+    print(f"[info] checking {len(index.policies)} allow policies")
+    if args.input_file:
+        out = args.output_file or str(Path(args.cwd) / f"allow_check_{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}.csv")
+        checked, matched = CFAllow.check_file(args.input_file, out, index)
+        print(f"[result] {matched} of {checked} senders / domains match an allow policy; results saved to {out}")
+        return
+    CFAllow.print_matches(index.find_matches(email=args.email, domain=args.domain))
+
+def arg_domain_check(args):
+    sd = args.domain.strip().lower()
+    domains = CFDomain.get_domains()
+    print(f"[info] checking {len(domains)} configured domain entries")
+    CFDomain.print_matches(sd, CFDomain.find_matches(sd, domains))
+
+# ---------------------------
+# Sync / inspect the local settings snapshot
+# ---------------------------
+def arg_settings(args):
+    if args.action == "sync":
+        CFSettings.sync_all(full=args.full)
+        for name in CFSettings.LISTS:
+            CFCache.get_cache(name).invalidate()
+        CFCache.get_cache("allow_policy_index").invalidate()
+    CFSettings.print_status(CFSettings.status())
+
+# ---------------------------
+# Start / stop / inspect the local daemon
+# ---------------------------
+def arg_daemon(args):
+    if args.action == "start":
+        return CFDaemon.serve(args.host, int(args.port), warm=not args.no_warm)
+    if args.action == "stop":
+        CFDaemon.stop()
+    else:
+        CFDaemon.status()
+
+def _resolve_paths(args, cwd):
+    args.cwd = cwd
+    for name in PATH_ARGS:
+        value = getattr(args, name, None)
+        if isinstance(value, str) and value:
+            setattr(args, name, str(Path(cwd, value).expanduser()))
+
+def build_parser():
     #parse for command line arguments
     parser = argparse.ArgumentParser(description='Uses the Cloudflare API to search for messages and save the results as a CSV file. Use the subcommands below to specify an action.')
+    parser.add_argument('--metrics-out', action='store', dest='metrics_out', default=None, help='Write per-endpoint API metrics (latency histograms, retries, 429s, bytes, sleep time) to this file when the command finishes. .prom/.txt writes Prometheus text format, anything else JSON.')
+    parser.add_argument('--profile', action='store_true', dest='profile', help='Run the subcommand under cProfile and report per-stage timings (fetch, decode, dedup, flatten, write, ...). Dumps go to debug/.')
+    parser.add_argument('--profile-memory', action='store_true', dest='profile_memory', help='With --profile, also trace memory allocations with tracemalloc (slower).')
+    parser.add_argument('--profile-top', action='store', dest='profile_top', type=int, default=30, help='The number of functions / allocation sites in the profile summary. Default: 30')
+    parser.add_argument('--no-daemon', action='store_true', dest='no_daemon', help='Run in this process even if the local daemon (CFTools.py daemon start) is running.')
     subparser = parser.add_subparsers(dest = 'command')
 
     #define search parser and arguments
@@ -137,7 +429,27 @@ if __name__ == "__main__":
     search_parser.add_argument('-o','--out', action='store', dest='out', default=None, help='The output filepath for the query results.')
     search_parser.add_argument('-f', '--filter_output', action='store_true', dest='filter_output', help='Parse and output an additonal CSV file with only the emails that were delivered to a purgable inbox. True/False flag.')
     search_parser.add_argument('--filter_out', action='store', dest='filtered_out_path', help='The file path to output the filtered query results to.')
+    search_parser.add_argument('--aggregate', action='store', dest='aggregate', nargs='?', const=True, default=None, help='Write grouped counts and top-k (per sender domain, hour, disposition, recipient, delivered vs quarantined) instead of a CSV of every row. Optional output path; .csv writes rows, anything else JSON.')
+    search_parser.add_argument('--plan', action='store_true', dest='plan', help='Dry run: estimate the number of records, API requests and runtime of this search without running it.')
+    search_parser.add_argument('--probes', action='store', dest='probes', default=4, help='The number of sample windows to probe with --plan. Default: 4')
+    search_parser.add_argument('--top_k', action='store', dest='top_k', default=20, help='The number of top senders / domains / recipients to report with --aggregate. Default: 20')
+    search_parser.add_argument('--fresh', action='store_true', dest='fresh', help='Ignore the daemon\'s cache of recent identical searches and query the API.')
+
 
+    #define local-search parser and arguments
+    local_search_parser = subparser.add_parser('local-search', help='Search the local index of previously fetched emails. Takes the same filters as search.')
+    local_search_parser.set_defaults(func=arg_local_search)
+    local_search_parser.add_argument('--id', action='store', dest='id', default=None, help='The message ID of the email in double quotes ("<id>")')
+    local_search_parser.add_argument('--days', action='store', dest='days', default=30, help='The number of days to search back. Defaults to 30 days')
+    local_search_parser.add_argument('--subject', action='store', dest='subject', default=None, help='The subject of the email. Words match at word starts.')
+    local_search_parser.add_argument('-s', '--sender', action='store', dest='sender', default=None, help='The sender of the email.')
+    local_search_parser.add_argument('-r', '--recipient', action='store', dest='recipient', default=None, help='The recipient of the email.')
+    local_search_parser.add_argument('-d', '--domain', action='store', dest='domain', default=None, help='The sender domain.')
+    local_search_parser.add_argument('--query', action='store', dest='query', default=None, help='Keyword search; every term must appear in the sender, recipients, subject or IDs.')
+    local_search_parser.add_argument('--fallback', action='store_true', dest='fallback', help='Fetch the parts of the time range the index does not cover from the API before answering.')
+    local_search_parser.add_argument('-o','--out', action='store', dest='out', default=None, help='The output filepath for the query results.')
+    local_search_parser.add_argument('-f', '--filter_output', action='store_true', dest='filter_output', help='Parse and output an additonal CSV file with only the emails that were delivered to a purgable inbox. True/False flag.')
+    local_search_parser.add_argument('--filter_out', action='store', dest='filtered_out_path', help='The file path to output the filtered query results to.')
 
     #define block parser and arguments
     block_parser = subparser.add_parser('block', help='Add a sender to the Cloudflare block list.')
@@ -153,21 +465,155 @@ if __name__ == "__main__":
     reclassify_parser.add_argument('-p', "--postfix", action='store', dest='postfix', help='The postix ID of the message.')
     reclassify_parser.add_argument('-i', '--input_file', action='store', dest='input_file', help='The path to the input csv file. If used, submission attempts will be made until X successful submissions are made.')
     reclassify_parser.add_argument('-n', '--number_of_successes', action='store', dest='number_of_successes', default=2, help='The number of successful submissions required when bulk processing using an input file. Default: 2')
-    reclassify_parser.add_argument('-d', '--disposition', action='store', dest='disposition', choices=['none', 'bulk', 'malicious', 'spam', 'spoof', 'suspicious'], help='The desired disposition of a message. Options: none | bulk | malicious | spam | spoof | suspicious', required=True)
+    reclassify_parser.add_argument('-d', '--disposition', action='store', dest='disposition', choices=['none', 'bulk', 'malicious', 'spam', 'spoof', 'suspicious'], help='The desired disposition of a message. Options: none | bulk | malicious | spam | spoof | suspicious')
+    reclassify_parser.add_argument('-w', '--workers', action='store', dest='workers', type=int, default=8, help='Submissions in flight when processing an input file; up to this many minus one may be accepted past the target. Default: 8')
+    reclassify_parser.add_argument('--no-rank', action='store_true', dest='no_rank', help='Try the input file\'s IDs in file order instead of newest / most likely accepted first.')
+    reclassify_parser.add_argument('--retry-rejected', action='store_true', dest='retry_rejected', help='Also try IDs the API refused in earlier runs (normally skipped for RECLASSIFY_REJECTION_TTL_DAYS).')
+    reclassify_parser.add_argument('--resume', action='store', dest='resume', default=None, help='Continue an interrupted bulk reclassification job (see CFTools.py jobs).')
 
     #define move parser and add arguments
     move_parser = subparser.add_parser('move', help='Move a list of messages to a different folder.')
     move_parser.set_defaults(func=arg_move)
-    move_parser.add_argument('-d', '--destination', action='store', dest="destination", choices=["Inbox", "JunkEmail", "DeletedItems", "RecoverableItemsDeletions", "RecoverableItemsPurges"], help='The destination folder to move the messages to. Options: Inbox | JunkEmail | DeletedItems | RecoverableItemsDeletions | RecoverableItemsPurges', required=True)
+    move_parser.add_argument('-d', '--destination', action='store', dest="destination", choices=["Inbox", "JunkEmail", "DeletedItems", "RecoverableItemsDeletions", "RecoverableItemsPurges"], help='The destination folder to move the messages to. Options: Inbox | JunkEmail | DeletedItems | RecoverableItemsDeletions | RecoverableItemsPurges')
     move_parser.add_argument('-i', '--input_file', action='store', dest='input_file', help='The path of the input CSV.')
     move_parser.add_argument('-o', '--output_file', action='store', dest='output_file', help="The file path to output the results csv to. Default is move_results.csv", default="move_results.csv")
     move_parser.add_argument('-p', '--postifx', action='store', dest='postfix', help='The postifx ID of a single email to move.')
+    move_parser.add_argument('--resume', action='store', dest='resume', default=None, help='Continue an interrupted bulk move or purge job (see CFTools.py jobs).')
+    move_parser.add_argument('-w', '--workers', action='store', dest='workers', type=int, default=4, help='Maximum number of batches in flight when moving an input file. Default: 4')
+
+    #define purge parser and add arguments
+    purge_parser = subparser.add_parser('purge', help='Search and move every match delivered to a purgable inbox as it is found (search -f + move in one pass).')
+    purge_parser.set_defaults(func=arg_purge)
+    purge_parser.add_argument('--days', action='store', dest='days', default=30, help='The number of days to search back. Defaults to 30 days')
+    purge_parser.add_argument('--subject', action='store', dest='subject', default=None, help='The subject of the email.')
+    purge_parser.add_argument('-s', '--sender', action='store', dest='sender', default=None, help='The sender of the email.')
+    purge_parser.add_argument('-r', '--recipient', action='store', dest='recipient', default=None, help='The recipient of the email.')
+    purge_parser.add_argument('-d', '--domain', action='store', dest='domain', default=None, help='The sender domain.')
+    purge_parser.add_argument('--query', action='store', dest='query', default=None, help='A more advanced query to search for, analogous to the keyword search in the GUI')
+    purge_parser.add_argument('--destination', action='store', dest="destination", choices=["Inbox", "JunkEmail", "DeletedItems", "RecoverableItemsDeletions", "RecoverableItemsPurges"], default="RecoverableItemsDeletions", help='The folder to move the messages to. Default: RecoverableItemsDeletions')
+    purge_parser.add_argument('-o', '--output_file', action='store', dest='output_file', default=None, help='The file path to write every move result to. Default: cf_purge_<timestamp>.csv')
+    purge_parser.add_argument('--dry-run', action='store_true', dest='dry_run', help='Search only: list the messages that would be moved without moving them.')
+    purge_parser.add_argument('-w', '--workers', action='store', dest='workers', type=int, default=4, help='Maximum number of move batches in flight. Default: 4')
+
+    #define release parser and add arguments
+    release_parser = subparser.add_parser('release', help='Release a list of messages from quarantine.')
+    release_parser.set_defaults(func=arg_release)
+    release_parser.add_argument('-i', '--input_file', action='store', dest='input_file', help=ID_FILE_HELP)
+    release_parser.add_argument('-o', '--output_file', action='store', dest='output_file', default=None, help='The file path to write each postfix ID\'s release result to. Default: release_results_<timestamp>.csv')
+    release_parser.add_argument('-w', '--workers', action='store', dest='workers', type=int, default=4, help='Maximum number of release chunks in flight. Default: 4')
+    release_parser.add_argument('--resume', action='store', dest='resume', default=None, help='Continue an interrupted release job (see CFTools.py jobs).')
+
+    #define raw parser and add arguments
+    raw_parser = subparser.add_parser('raw', help='Download the raw EML of a list of messages into a local content-addressed store.')
+    raw_parser.set_defaults(func=arg_raw)
+    raw_parser.add_argument('-i', '--input_file', action='store', dest='input_file', help=ID_FILE_HELP)
+    raw_parser.add_argument('-p', '--postfix', action='store', dest='postfix', nargs='+', help='One or more postfix IDs to download.')
+    raw_parser.add_argument('-o', '--out_dir', action='store', dest='out_dir', default=None, help='The store directory (objects/ and manifest.csv). Default: raw_store')
+    raw_parser.add_argument('-w', '--workers', action='store', dest='workers', type=int, default=8, help='Maximum number of downloads in flight. Default: 8')
+
+    #define preview parser and add arguments
+    preview_parser = subparser.add_parser('preview', help='Save the preview screenshots of a list of messages as PNG files.')
+    preview_parser.set_defaults(func=arg_preview)
+    preview_parser.add_argument('-i', '--input_file', action='store', dest='input_file', help=ID_FILE_HELP)
+    preview_parser.add_argument('-p', '--postfix', action='store', dest='postfix', nargs='+', help='One or more postfix IDs.')
+    preview_parser.add_argument('-o', '--out_dir', action='store', dest='out_dir', default=None, help='The directory to save <postfix_id>_preview.png files to. Default: previews')
+    preview_parser.add_argument('-w', '--workers', action='store', dest='workers', type=int, default=8, help='Maximum number of previews fetched at once. Default: 8')
+    preview_parser.add_argument('--contact-sheet', action='store_true', dest='contact_sheet', help='Also write index.html with a thumbnail of every preview in the directory for fast review.')
+
+    #define trace parser and add arguments
+    trace_parser = subparser.add_parser('trace', help='Collect the message traces of a list of messages and summarise per-hop and end-to-end delivery latency.')
+    trace_parser.set_defaults(func=arg_trace)
+    trace_parser.add_argument('-i', '--input_file', action='store', dest='input_file', help=ID_FILE_HELP)
+    trace_parser.add_argument('-p', '--postfix', action='store', dest='postfix', nargs='+', help='One or more postfix IDs.')
+    trace_parser.add_argument('-o', '--output_file', action='store', dest='output_file', default=None, help='The JSONL file to write one normalized event per trace line to. Default: trace_events_<timestamp>.jsonl')
+    trace_parser.add_argument('--summary', action='store', dest='summary', default=None, help='The CSV file for the latency summary table. Default: <output>_summary.csv')
+    trace_parser.add_argument('-w', '--workers', action='store', dest='workers', type=int, default=8, help='Maximum number of traces fetched at once. Default: 8')
+
+    #define ioc parser and add arguments
+    ioc_parser = subparser.add_parser('ioc', help='Parse raw EML (downloaded with raw, or .eml files) into an IOC table, or find the messages that share an IOC.')
+    ioc_parser.set_defaults(func=arg_ioc)
+    ioc_parser.add_argument('-i', '--input_file', action='store', dest='input_file', help='A CSV (postfix_id column, e.g. a search export) or text file of postfix IDs; missing raw messages are downloaded first.')
+    ioc_parser.add_argument('--files', action='store', dest='eml_files', nargs='+', help='.eml files or directories of them to parse instead (the file name is used as the key).')
+    ioc_parser.add_argument('--store', action='store', dest='out_dir', default=None, help='The raw message store (see raw -o). Default: raw_store')
+    ioc_parser.add_argument('--db', action='store', dest='db', default=None, help='The IOC database. Default: <store>/iocs.sqlite')
+    ioc_parser.add_argument('--pivot', action='store', dest='pivot', default=None, help='List the messages with this URL, domain, IP, address or attachment SHA-256 instead of parsing.')
+    ioc_parser.add_argument('--kind', action='store', dest='kind', choices=['url', 'domain', 'ip', 'email', 'sha256'], default=None, help='Restrict --pivot to one IOC kind.')
+    ioc_parser.add_argument('--reparse', action='store_true', dest='reparse', help='Parse messages again even if they are already in the table.')
+    ioc_parser.add_argument('--processes', action='store', dest='processes', type=int, default=None, help='Parser processes. Default: one per CPU')
+    ioc_parser.add_argument('-w', '--workers', action='store', dest='workers', type=int, default=8, help='Downloads in flight for IDs not in the store yet. Default: 8')
+    ioc_parser.add_argument('--top_k', action='store', dest='top_k', default=20, help='The number of most shared IOCs to report. Default: 20')
+
+    #define watchlist parser and add arguments
+    watchlist_parser = subparser.add_parser('watchlist', help='Run a file of saved searches, fusing them into as few API crawls as possible.')
+    watchlist_parser.set_defaults(func=arg_watchlist)
+    watchlist_parser.add_argument('-w', '--watchlist', action='store', dest='watchlist_file', default='watchlists.json', help='The JSON file of saved watches. Default: watchlists.json')
+    watchlist_parser.add_argument('-o', '--out_dir', action='store', dest='out_dir', default='watchlist_out', help='The directory to write one CSV per watch to. Default: watchlist_out')
+
+    #define allow-check parser and add arguments
+    allow_parser = subparser.add_parser('allow-check', help='Check whether a sender or domain matches an allow policy.')
+    allow_parser.set_defaults(func=arg_allow_check)
+    allow_parser.add_argument('-e', '--email', action='store', dest='email', default=None, help='The sender address to check.')
+    allow_parser.add_argument('-d', '--domain', action='store', dest='domain', default=None, help='The sender domain to check.')
+    allow_parser.add_argument('-i', '--input_file', action='store', dest='input_file', default=None, help='A text file of senders or domains (one per line) or a CSV with a sender / from / email / domain column, to check them all.')
+    allow_parser.add_argument('-o', '--output_file', action='store', dest='output_file', default=None, help='With --input_file, the CSV to write every value\'s matching policies to. Default: allow_check_<timestamp>.csv')
+
+    #define domain-check parser and add arguments
+    domain_parser = subparser.add_parser('domain-check', help='Check whether a domain is configured in Email Security.')
+    domain_parser.set_defaults(func=arg_domain_check)
+    domain_parser.add_argument('-d', '--domain', action='store', dest='domain', help='The domain to check.', required=True)
 
+    #define settings parser and add arguments
+    settings_parser = subparser.add_parser('settings', help='Sync or inspect the local snapshot of the allow policies, block senders and domains.')
+    settings_parser.set_defaults(func=arg_settings)
+    settings_parser.add_argument('action', choices=['sync', 'status'], help='sync (only what changed since the last sync) | status')
+    settings_parser.add_argument('--full', action='store_true', dest='full', help='With sync, fetch every list again in full instead of only the changes.')
+
+    #define jobs parser and add arguments
+    jobs_parser = subparser.add_parser('jobs', help='List recent bulk jobs (move, purge, reclassify, release) and their progress, for --resume.')
+    jobs_parser.set_defaults(func=arg_jobs)
+    jobs_parser.add_argument('-n', '--limit', action='store', dest='limit', default=20, help='The number of jobs to list. Default: 20')
+
+    #define daemon parser and add arguments
+    daemon_parser = subparser.add_parser('daemon', help='Run a local daemon that keeps connections, rate limit state and caches warm; other commands are forwarded to it while it runs.')
+    daemon_parser.set_defaults(func=arg_daemon)
+    daemon_parser.add_argument('action', choices=['start', 'stop', 'status'], help='start (in the foreground) | stop | status')
+    daemon_parser.add_argument('--host', action='store', dest='host', default='127.0.0.1', help='The address to listen on. Default: 127.0.0.1')
+    daemon_parser.add_argument('--port', action='store', dest='port', default=0, help='The port to listen on. Default: any free port (recorded in debug/daemon.json)')
+    daemon_parser.add_argument('--no-warm', action='store_true', dest='no_warm', help='Do not prefetch the allow policies, block senders and domains at startup.')
+
+    return parser
+
+def main(argv=None, cwd=None, forward=True):
+    parser = build_parser()
     #parse arguments and run the correct function
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
-    if args.command:
-        args.func(args)
-    else:
+    if not args.command:
         print("[error] A subcommand is required. Printing help page:\n")
         parser.print_help()
+        return 1
+
+    # hand the command to the daemon if one is running; profiling always runs locally
+    if forward and args.command != "daemon" and not args.no_daemon and not args.profile:
+        code = CFDaemon.forward(sys.argv[1:] if argv is None else argv, cwd or os.getcwd())
+        if code is not None:
+            return code
+
+    _resolve_paths(args, cwd or os.getcwd())
+    # metrics of this command only, also when the daemon runs others next to it
+    with CFMetrics.scope():
+        try:
+            if args.profile:
+                result = CFProfile.run_profiled(args.func, args, args.command, top=args.profile_top, memory=args.profile_memory)
+            else:
+                result = args.func(args)
+        finally:
+            line = CFMetrics.summary_line()
+            if line:
+                print(f"[metrics] {line}")
+            if args.metrics_out:
+                print(f"[metrics] written to {CFMetrics.export(args.metrics_out)}")
+    return result if isinstance(result, int) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
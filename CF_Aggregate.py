@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cloudflare Search Aggregation
+
+Streaming, constant-memory summaries of investigate records for 'CFTools.py search
+--aggregate'. Records are folded into the summary as pages arrive and are never kept:
+low-cardinality dimensions (disposition, hour, delivery state) use exact counters,
+high-cardinality ones (sender, sender domain, recipient) use a Space-Saving heavy-hitter
+sketch with a fixed number of slots.
+"""
+
+import csv
+import heapq
+import json
+from collections import Counter
+from pathlib import Path
+
+import CFFullSearch as CFSearch
+
+# ---------------------------
+# CONFIG / TUNABLES
+# ---------------------------
+SKETCH_CAPACITY = 2000   # slots per heavy-hitter sketch; counts are exact while a dimension has fewer distinct keys
+DEFAULT_TOP_K = 20
+
+# ---------------------------
+# Space-Saving heavy-hitter sketch
+# ---------------------------
+class SpaceSaving:
+    """
+    Top-k counter in O(capacity) memory. Reported counts never under-count; a key's count
+    may over-count by at most its 'error' (the count of the slot it evicted).
+    """
+
+    def __init__(self, capacity=SKETCH_CAPACITY):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self._heap = []   # (count lower bound, key); lazily refreshed on eviction
+        self.total = 0
+
+    def add(self, key, n=1):
+        self.total += n
+        if key in self.counts:
+            self.counts[key] += n
+            return
+        if len(self.counts) < self.capacity:
+            self.counts[key] = n
+            self.errors[key] = 0
+            heapq.heappush(self._heap, (n, key))
+            return
+        # evict the current minimum; stale heap entries are refreshed until the top is exact
+        while True:
+            c, k = heapq.heappop(self._heap)
+            actual = self.counts[k]
+            if c == actual:
+                break
+            heapq.heappush(self._heap, (actual, k))
+        del self.counts[k]
+        del self.errors[k]
+        self.counts[key] = c + n
+        self.errors[key] = c
+        heapq.heappush(self._heap, (c + n, key))
+
+    def top(self, k=DEFAULT_TOP_K):
+        best = heapq.nlargest(k, self.counts.items(), key=lambda kv: kv[1])
+        return [{"key": key, "count": count, "max_overcount": self.errors[key]} for key, count in best]
+
+    @property
+    def exact(self):
+        return all(e == 0 for e in self.errors.values())
+
+# ---------------------------
+# Record stream aggregator
+# ---------------------------
+class SearchAggregator:
+    def __init__(self, top_k=DEFAULT_TOP_K, capacity=SKETCH_CAPACITY):
+        self.top_k = top_k
+        self.records = 0
+        self.first_ts = None
+        self.last_ts = None
+        self.per_hour = Counter()
+        self.per_disposition = Counter()
+        self.delivery = Counter()
+        self.senders = SpaceSaving(capacity)
+        self.sender_domains = SpaceSaving(capacity)
+        self.recipients = SpaceSaving(capacity)
+
+    def add(self, records):
+        for rec in records:
+            if not isinstance(rec, dict):
+                continue
+            self.records += 1
+
+            ts = CFSearch.record_time(rec)
+            if ts is not None:
+                self.per_hour[ts.strftime("%Y-%m-%dT%H:00Z")] += 1
+                if self.first_ts is None or ts < self.first_ts:
+                    self.first_ts = ts
+                if self.last_ts is None or ts > self.last_ts:
+                    self.last_ts = ts
+
+            self.per_disposition[str(rec.get("final_disposition") or "NONE").upper()] += 1
+
+            if rec.get("is_quarantined"):
+                self.delivery["quarantined"] += 1
+            else:
+                self.delivery["delivered"] += 1
+                if CFSearch.is_delivered_to_purgable(rec):
+                    self.delivery["delivered_to_purgable"] += 1
+
+            self.senders.add(CFSearch.record_sender(rec) or "<unknown>")
+            self.sender_domains.add(CFSearch.record_sender_domain(rec) or "<unknown>")
+            for r in CFSearch.record_recipients(rec):
+                self.recipients.add(r)
+
+    def summary(self):
+        return {
+            "records": self.records,
+            "first_ts": CFSearch._iso(self.first_ts) if self.first_ts else None,
+            "last_ts": CFSearch._iso(self.last_ts) if self.last_ts else None,
+            "delivery": dict(self.delivery),
+            "per_disposition": dict(self.per_disposition.most_common()),
+            "per_hour": dict(sorted(self.per_hour.items())),
+            "top_sender_domains": self.sender_domains.top(self.top_k),
+            "top_senders": self.senders.top(self.top_k),
+            "top_recipients": self.recipients.top(self.top_k),
+            "sketches_exact": self.senders.exact and self.sender_domains.exact and self.recipients.exact,
+        }
+
+# ---------------------------
+# Output
+# ---------------------------
+def write_summary(path, summary):
+    """Write the summary as JSON, or as group,key,count rows when the path ends in .csv."""
+    p = Path(path).expanduser()
+    if not p.suffix:
+        p = p.with_suffix(".json")
+    p.parent.mkdir(parents=True, exist_ok=True)
+
+    if p.suffix.lower() != ".csv":
+        p.write_text(json.dumps(summary, indent=2), encoding="utf-8")
+        return str(p)
+
+    with open(p, "w", newline="", encoding="utf-8") as cf:
+        writer = csv.writer(cf)
+        writer.writerow(["group", "key", "count", "max_overcount"])
+        writer.writerow(["total", "records", summary["records"], 0])
+        for group in ("delivery", "per_disposition", "per_hour"):
+            for key, count in summary[group].items():
+                writer.writerow([group, key, count, 0])
+        for group in ("top_sender_domains", "top_senders", "top_recipients"):
+            for row in summary[group]:
+                writer.writerow([group, row["key"], row["count"], row["max_overcount"]])
+    return str(p)
+
+def print_summary(summary, top=5):
+    print(f"[aggregate] {summary['records']} records between {summary['first_ts']} and {summary['last_ts']}")
+    print(f"[aggregate] delivery: {summary['delivery']}")
+    print(f"[aggregate] dispositions: {summary['per_disposition']}")
+    for group in ("top_sender_domains", "top_senders", "top_recipients"):
+        shown = ", ".join(f"{r['key']}={r['count']}" for r in summary[group][:top])
+        print(f"[aggregate] {group}: {shown}")
@@ -3,29 +3,38 @@
 
 """
 Cloudflare Allow Policy Search by Email and Domain
+
+matches_email / matches_domain define what an allow policy matches. For more than a
+handful of checks use PolicyIndex (get_policy_index()), which answers the same question
+without walking every policy per query:
+
+  - EMAIL patterns without '*' are a hash map on the lower-cased address;
+  - DOMAIN patterns (and, for domain checks, the domain part of EMAIL patterns) sit in a
+    trie of reversed domain labels, so "example.com" is found for "a.b.example.com" by
+    walking com -> example;
+  - wildcard patterns are compiled once, and merged into combined regexes of
+    REGEX_GROUP patterns each; a combined regex that does not match rules out its whole
+    group, and only the members of a group that does match are tried one by one;
+  - the remaining patterns (matched as substrings) are screened the same way.
+
+Every query returns the same policies, in the same (policy list) order, as find_matches.
+'CFTools.py allow-check -i senders.txt' checks a whole file of senders or domains.
 """
 
 
+import csv
 import re
-import requests
+from pathlib import Path
 
 import CFScriptConfig as CFG
+import CF_Cache as CFCache
+import CF_Settings as CFSettings
 # -----------------------------------------------------------
 # CONFIG – CHANGE THESE ONLY
 # -----------------------------------------------------------
 SEARCH_EMAIL = None  # set to None to search by domain
 SEARCH_DOMAIN = "universitydesigninstitute.ccsend.com"                # e.g. "example.com"
 
-# -----------------------------------------------------------
-# API BASE + SESSION
-# -----------------------------------------------------------
-url = CFG.API_BASE_URL + "/settings/allow_policies"
-HEADERS = {
-    "X-Auth-Email": CFG.AUTH_EMAIL,
-    "X-Auth-Key": CFG.AUTH_KEY,
-    "Accept": "application/json",
-}
-
 # -----------------------------------------------------------
 # HELPERS
 # -----------------------------------------------------------
@@ -41,24 +50,12 @@ def email_domain(email: str) -> str:
 # FETCH ALL ALLOW POLICIES
 # -----------------------------------------------------------
 def fetch_allow_policies():
-    policies = []
-    page = 1
-    session = requests.Session()
-    session.headers.update(HEADERS)
-
-    while True:
-        r = session.get(url, params={"page": page, "per_page": CFG.PER_PAGE}, timeout=30)
-        r.raise_for_status()
-        data = r.json()
-        results = data.get("result", [])
-        if not results:
-            break
-        policies.extend(results)
-        if len(results) < CFG.PER_PAGE:
-            break
-        page += 1
-
-    return policies
+    """Every allow policy straight from the API (pages fetched concurrently, see CF_Settings.py)."""
+    return CFSettings.fetch_all("allow_policies")[0]
+
+def get_allow_policies():
+    """The allow policies from the local settings snapshot, through the settings cache (warm inside the daemon)."""
+    return CFCache.cached("allow_policies", lambda: CFSettings.entries("allow_policies"))
 
 # -----------------------------------------------------------
 # MATCHING LOGIC
@@ -97,32 +94,181 @@ def matches_domain(policy, domain: str) -> bool:
 
     return wildcard_to_regex(pattern).match(domain) is not None if "*" in pattern else pattern.lower() in domain
 
+def find_matches(policies, email=None, domain=None):
+    if email:
+        return [p for p in policies if matches_email(p, email)]
+    return [p for p in policies if matches_domain(p, domain)]
+
 # -----------------------------------------------------------
-# MAIN
+# POLICY INDEX
 # -----------------------------------------------------------
-def main():
-    if SEARCH_EMAIL and SEARCH_DOMAIN:
-        raise ValueError("Set only one of SEARCH_EMAIL or SEARCH_DOMAIN")
+REGEX_GROUP = 200   # patterns per combined regex
 
-    print("[info] fetching allow policies...")
-    policies = fetch_allow_policies()
-    print(f"[info] fetched {len(policies)} allow policies")
+class _SuffixTrie:
+    """Domain suffixes keyed by reversed labels; lookup(d) gives every entry equal to d or a parent of d."""
 
-    matches = []
-
-    if SEARCH_EMAIL:
-        print(f"[search] email: {SEARCH_EMAIL}")
-        for p in policies:
-            if matches_email(p, SEARCH_EMAIL):
-                matches.append(p)
-    elif SEARCH_DOMAIN:
-        print(f"[search] domain: {SEARCH_DOMAIN}")
-        for p in policies:
-            if matches_domain(p, SEARCH_DOMAIN):
-                matches.append(p)
-    else:
-        raise ValueError("You must set SEARCH_EMAIL or SEARCH_DOMAIN")
+    def __init__(self):
+        self.root = {}
+
+    def add(self, suffix, item):
+        node = self.root
+        for label in reversed(suffix.split(".")):
+            node = node.setdefault(label, {})
+        node.setdefault(None, []).append(item)
+
+    def lookup(self, domain):
+        out = []
+        node = self.root
+        for label in reversed(domain.split(".")):
+            node = node.get(label)
+            if node is None:
+                break
+            out.extend(node.get(None, ()))
+        return out
+
+class _PatternGroups:
+    """Patterns tested as groups: one combined regex per REGEX_GROUP members, then the members of a hit group."""
+
+    def __init__(self, entries, combined, member_test):
+        self.groups = []
+        for i in range(0, len(entries), REGEX_GROUP):
+            chunk = entries[i:i + REGEX_GROUP]
+            self.groups.append((combined(chunk), chunk))
+        self.member_test = member_test
+
+    def lookup(self, value):
+        out = []
+        for screen, chunk in self.groups:
+            if screen.search(value):
+                out.extend(item for test, item in chunk if self.member_test(test, value))
+        return out
+
+def _wildcards(entries):
+    """entries: (pattern, item) -> groups matching like wildcard_to_regex(pattern).match(value)."""
+    compiled = [(wildcard_to_regex(p), item) for p, item in entries]
+    return _PatternGroups(compiled, lambda chunk: re.compile("^(?:" + "|".join(r.pattern[1:-1] for r, _ in chunk) + ")$", re.IGNORECASE),
+                          lambda r, value: r.match(value) is not None)
+
+def _substrings(entries):
+    """entries: (lower-cased pattern, item) -> groups matching like pattern in value."""
+    return _PatternGroups(list(entries), lambda chunk: re.compile("|".join(re.escape(p) for p, _ in chunk)),
+                          lambda p, value: p in value)
+
+class PolicyIndex:
+    def __init__(self, policies):
+        self.policies = policies
+        self.email_exact = {}
+        self.domain_trie = _SuffixTrie()          # DOMAIN patterns (email and domain checks)
+        self.email_domain_trie = _SuffixTrie()    # domain part of EMAIL patterns with '@' (domain checks)
+        email_wild, email_sub, domain_wild, domain_sub = [], [], [], []
+        for i, policy in enumerate(policies):
+            pattern = (policy.get("pattern") or "").strip()
+            ptype = (policy.get("pattern_type") or "").upper()
+            if not pattern:
+                continue
+            p = pattern.lower()
+            if ptype == "EMAIL":
+                if "*" in pattern:
+                    email_wild.append((pattern, i))
+                else:
+                    self.email_exact.setdefault(p, []).append(i)
+                if "@" in pattern:
+                    self.email_domain_trie.add(p.rsplit("@", 1)[1], i)
+                else:
+                    (domain_wild if "*" in pattern else domain_sub).append((pattern if "*" in pattern else p, i))
+            elif ptype == "DOMAIN":
+                self.domain_trie.add(p, i)
+            else:
+                for wild, sub in ((email_wild, email_sub), (domain_wild, domain_sub)):
+                    (wild if "*" in pattern else sub).append((pattern if "*" in pattern else p, i))
+        self.email_wild = _wildcards(email_wild)
+        self.email_sub = _substrings(email_sub)
+        self.domain_wild = _wildcards(domain_wild)
+        self.domain_sub = _substrings(domain_sub)
+
+    def _policies(self, hits):
+        return [self.policies[i] for i in sorted(set(hits))]
 
+    def match_email(self, email):
+        email = email.lower()
+        hits = list(self.email_exact.get(email, ()))
+        hits += self.domain_trie.lookup(email_domain(email))
+        hits += self.email_wild.lookup(email)
+        hits += self.email_sub.lookup(email)
+        return self._policies(hits)
+
+    def match_domain(self, domain):
+        domain = domain.lower()
+        hits = self.domain_trie.lookup(domain) + self.email_domain_trie.lookup(domain)
+        hits += self.domain_wild.lookup(domain)
+        hits += self.domain_sub.lookup(domain)
+        return self._policies(hits)
+
+    def find_matches(self, email=None, domain=None):
+        return self.match_email(email) if email else self.match_domain(domain)
+
+    def check_many(self, values):
+        """(value, kind, matches) per value; values with '@' are checked as senders, the rest as domains."""
+        for value in values:
+            if "@" in value:
+                yield value, "email", self.match_email(value)
+            else:
+                yield value, "domain", self.match_domain(value)
+
+def get_policy_index():
+    """PolicyIndex over get_allow_policies(), rebuilt only when the cached policy list changes."""
+    policies = get_allow_policies()
+    index = CFCache.peek("allow_policy_index")
+    if index is None or index.policies is not policies:
+        index = PolicyIndex(policies)
+        CFCache.get_cache("allow_policy_index").put(None, index)
+    return index
+
+# -----------------------------------------------------------
+# BATCH CHECK
+# -----------------------------------------------------------
+SENDER_COLUMNS = ("sender", "from", "email", "domain", "sender_domain")
+CHECK_FIELDNAMES = ["value", "kind", "matches", "policy_ids", "patterns", "trusted"]
+
+def iter_check_values(path):
+    """Senders / domains from a text file (one per line) or a CSV (first of SENDER_COLUMNS present, else column 1)."""
+    path = Path(path)
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        if path.suffix.lower() != ".csv":
+            for line in f:
+                if line.strip():
+                    yield line.strip()
+            return
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        names = [h.strip().lower() for h in header]
+        col = next((names.index(c) for c in SENDER_COLUMNS if c in names), None)
+        rows = reader if col is not None else [header, *reader]
+        for row in rows:
+            if len(row) > (col or 0) and row[col or 0].strip():
+                yield row[col or 0].strip()
+
+def check_file(input_file, out_file, index):
+    """Check every distinct sender / domain in input_file against index; one CSV row per value. Returns (checked, matched)."""
+    checked = matched = 0
+    with open(out_file, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=CHECK_FIELDNAMES)
+        writer.writeheader()
+        for value, kind, matches in index.check_many(dict.fromkeys(iter_check_values(input_file))):
+            checked += 1
+            matched += bool(matches)
+            writer.writerow({"value": value, "kind": kind, "matches": len(matches),
+                             "policy_ids": ";".join(str(m.get("id")) for m in matches),
+                             "patterns": ";".join(str(m.get("pattern")) for m in matches),
+                             "trusted": any(m.get("is_trusted_sender") for m in matches)})
+    return checked, matched
+
+# -----------------------------------------------------------
+# OUTPUT
+# -----------------------------------------------------------
+def print_matches(matches):
     if not matches:
         print("[result] NOT on allow list")
         return
@@ -136,6 +282,22 @@ def main():
             f"trusted={m.get('is_trusted_sender')}"
         )
 
+# -----------------------------------------------------------
+# MAIN
+# -----------------------------------------------------------
+def main():
+    if SEARCH_EMAIL and SEARCH_DOMAIN:
+        raise ValueError("Set only one of SEARCH_EMAIL or SEARCH_DOMAIN")
+    if not (SEARCH_EMAIL or SEARCH_DOMAIN):
+        raise ValueError("You must set SEARCH_EMAIL or SEARCH_DOMAIN")
+
+    print("[info] fetching allow policies...")
+    policies = get_allow_policies()
+    print(f"[info] fetched {len(policies)} allow policies")
+
+    print(f"[search] email: {SEARCH_EMAIL}" if SEARCH_EMAIL else f"[search] domain: {SEARCH_DOMAIN}")
+    print_matches(find_matches(policies, email=SEARCH_EMAIL, domain=SEARCH_DOMAIN))
+
 # -----------------------------------------------------------
 if __name__ == "__main__":
     main()
@@ -7,9 +7,12 @@ Cloudflare BULK MOVE
 """
 
 import csv
-import time
 from pathlib import Path
 import CFScriptConfig as CFG
+import CF_Decode as CFDecode
+import CF_Journal as CFJournal
+import CF_Pipeline as CFPipeline
+import CF_Profile as CFProfile
 
 
 # -----------------------------
@@ -26,7 +29,7 @@ def single_move(postfix_id, destination):
     url = f"{CFG.API_BASE_URL}/investigate/{postfix_id}/move"
     body = {"destination": destination}
 
-    response = CFG.session.post(url, json=body, timeout=CFG.TIMEOUT)
+    response = CFG.session.post(url, json=body)
     return response
 
 
@@ -73,130 +76,139 @@ def _parse_json_response(response):
         # empty body and not JSON
         return None, f"Empty response body (status {response.status_code})"
     try:
-        return response.json(), None
+        return CFDecode.decode_response(response), None
     except ValueError as e:
         # Could not decode JSON; return text for diagnostics
         return None, f"JSON decode error: {e}; body: {response.text[:1000]}"
 
-def bulk_move(destination, in_file, out_file):
-    url = CFG.API_BASE_URL + "/investigate/move"
-    postfix_ids = read_postfix_id_csv(in_file)
-
-    print(f"Loaded {len(postfix_ids)} postfix IDs")
-
-    batch_size = 50
-    failed_batches = []   # store batch start indices for retries
-    items = []
-
-    for start in range(0, len(postfix_ids), batch_size):
-        batch = postfix_ids[start:start + batch_size]
-        batch_num = (start // batch_size) + 1
-        print(f"Moving batch {batch_num} to {destination}...")
+FIELDNAMES = [
+    "completed_timestamp", "success", "message_id", "postfix_id",
+    "recipient", "operation", "status", "destination", "error"
+]
 
+def _send_batch(url, destination):
+    def send(batch):
         body = {
             "destination": destination,
             "postfix_ids": batch
         }
+        with CFProfile.span("fetch"):
+            response = CFG.session.post(url, json=body)
+        with CFProfile.span("decode"):
+            parsed, error = _parse_json_response(response)
+        return CFPipeline.outcome_from_response(response, parsed, error)
+    return send
+
+def bulk_move(destination, in_file, out_file, workers=CFG.MOVE_WORKERS, resume=None):
+    """Move every postfix ID in in_file; see move_ids. With resume=JOB_ID, continue that journalled
+    job instead: its remaining IDs go to its original destination, appending to its output file.
+    Returns the list of (postfix_id, error) failures."""
+    if resume:
+        job = CFJournal.open_job(resume, kind="move")
+        destination, out_file = job.params["destination"], job.params["out_file"]
+        postfix_ids = job.remaining()
+        print(f"Resuming job {job.id}: {len(postfix_ids)} postfix IDs left to move to {destination}")
+    else:
+        with CFProfile.span("read"):
+            postfix_ids = read_postfix_id_csv(in_file)
+        print(f"Loaded {len(postfix_ids)} postfix IDs")
+        if not postfix_ids:
+            print("No successful moves happened!")
+            return []
+        job = CFJournal.create("move", {"destination": destination, "in_file": str(in_file), "out_file": str(out_file)}, postfix_ids)
+    return move_ids(postfix_ids, destination, out_file, workers=workers, job=job, append=bool(resume))
+
+def move_ids(postfix_ids, destination, out_file, workers=CFG.MOVE_WORKERS, on_first_move=None, job=None, append=False,
+             totals=None):
+    """Move postfix IDs (a list, or a CF_Pipeline.Feed still being filled) with several batches
+    in flight. Result rows are written to out_file as each batch comes back; IDs that could not
+    be moved get a row with status FAILED and the API error, and are also listed on their own
+    in <out_file stem>_failed.csv. on_first_move() is called when the first batch is accepted.
+    job (CF_Journal.Job) records each ID's state as it goes. totals (a dict), if given, receives
+    "moved" (result rows with status OK), "answered" (IDs in accepted batches) and "aborted"
+    (the 401/403 error that stopped the run, or None). Returns the list of (postfix_id, error) failures."""
+    url = CFG.API_BASE_URL + "/investigate/move"
+    feed = postfix_ids if isinstance(postfix_ids, CFPipeline.Feed) else CFPipeline.Feed(postfix_ids)
+    limits = CFPipeline.AdaptiveLimits(CFG.MOVE_INITIAL_BATCH, CFG.MOVE_MAX_BATCH, workers, CFG.MOVE_TARGET_LATENCY)
+    counts = {"rows": 0, "ok": 0, "done": 0, "accepted": 0}
+    failures = []
+    append = append and Path(out_file).exists()
+
+    with open(out_file, "a" if append else "w", newline='', encoding="utf-8") as file:
+        writer = csv.DictWriter(file, fieldnames=FIELDNAMES, extrasaction='ignore')
+        if not append:
+            writer.writeheader()
 
-        try:
-            response = CFG.session.post(url, json=body, timeout=(CFG.TIMEOUT * 2))
-        except Exception as e:
-            print(f"HTTP request failed for batch {batch_num}: {e}")
-            failed_batches.append(start)
-            continue
-
-        parsed, error = _parse_json_response(response)
-        # Debug/log status and body when non-JSON or error
-        if error:
-            print(f"Batch {batch_num} - parse issue: {error}; status_code={response.status_code}")
-            print(f"Response headers: {response.headers}")
-            # treat this as failure unless status indicates success with no content
-            if response.status_code not in (200, 201, 204):
-                failed_batches.append(start)
-                continue
-        else:
-            # parsed is either dict/list or None for 204
-            if response.status_code in (200, 201, 204):
-                print(f"Batch {batch_num} moved! status={response.status_code}")
+        def on_done(batch, outcome):
+            counts["done"] += len(batch)
+            if outcome.ok:
+                counts["accepted"] += 1
+                if on_first_move is not None and counts["accepted"] == 1:
+                    on_first_move()
+                for item in outcome.results:
+                    if not isinstance(item, dict):
+                        continue
+                    row = dict(item)
+                    if len(batch) == 1:
+                        row.setdefault("postfix_id", batch[0])
+                    row.setdefault("destination", destination)
+                    counts["rows"] += 1
+                    counts["ok"] += row.get("status") == "OK"
+                    writer.writerow(row)
+                if job is not None:
+                    _journal_batch(job, batch, outcome)
+                print(f"[info] moved batch of {len(batch)} in {outcome.latency:.1f}s "
+                      f"({counts['done']}/{feed.total} IDs done)")
             else:
-                print(f"Batch {batch_num} returned status {response.status_code}")
-
-        # If we have JSON and it contains "result", gather items
-        result = None
-        if parsed and isinstance(parsed, dict):
-            result = parsed.get("result", None)
-
-        if isinstance(result, list):
-            items.extend(result)
-        elif result is not None:
-            # result exists but is not a list
-            print(f"Batch {batch_num} result field is not a list: {type(result)}; content: {str(result)[:500]}")
+                for pid in batch:
+                    failures.append((pid, outcome.error))
+                    if job is not None:
+                        job.failed(pid, outcome.error)
+                    writer.writerow({"postfix_id": pid, "operation": "MOVE", "status": "FAILED",
+                                     "destination": destination, "success": False, "error": outcome.error})
+                print(f"[error] {', '.join(batch)}: {outcome.error}")
+            file.flush()
+
+        try:
+            with CFProfile.span("move"):
+                stats = CFPipeline.run_batches(feed, _send_batch(url, destination), on_done, limits, url=url, label="move",
+                                               on_submit=job.in_flight if job is not None else None)
+        finally:
+            if job is not None:
+                job.close()
+
+    if totals is not None:
+        totals.update(moved=counts["ok"], answered=counts["done"], aborted=stats["aborted"])
+    print(f"Successfully moved {counts['ok']}/{counts['rows']} messages; "
+          f"{len(failures)} postfix IDs failed.")
+    print(f"[info] {stats['requests']} requests, {stats['retries']} retries, {stats['splits']} split batches; "
+          f"final batch size {stats['batch_size']}, {stats['in_flight']} in flight")
+    print(f"Results saved to {out_file}")
+    # a resumed job lists the failures of its earlier runs too
+    all_failures = job.failures() if job is not None else failures
+    if all_failures:
+        _write_failures(out_file, all_failures)
+    return failures
+
+def _journal_batch(job, batch, outcome):
+    """Each ID's answer: its own result rows when the API tags them with the postfix ID (or the
+    batch is a single ID), otherwise the batch's status."""
+    by_id = {}
+    for item in outcome.results:
+        if isinstance(item, dict) and item.get("postfix_id"):
+            by_id.setdefault(item["postfix_id"], []).append(item)
+    for pid in batch:
+        if len(batch) == 1:
+            job.done(pid, outcome.results)
         else:
-            # No result found in parsed JSON (could be None because of 204 or empty body)
-            if response.status_code not in (200, 201, 204):
-                failed_batches.append(start)
-                print(f"Problem with batch {batch_num} - {response.text[:1000]}")
-            else:
-                # success but no result payload — that's acceptable for some APIs
-                print(f"Batch {batch_num} succeeded with no 'result' payload.")
-
-        time.sleep(2)
-
-    # Retry logic for failed_batches
-    if failed_batches:
-        print("\nRetrying failed batches...")
-        for start in failed_batches:
-            batch_num = (start // batch_size) + 1
-            retry_batch = postfix_ids[start : start + batch_size]
-            print(f"Retrying batch {batch_num} (size {len(retry_batch)})")
-
-            # Retry each postfix_id individually
-            for pid in retry_batch:
-                try:
-                    response = single_move(pid, destination)
-                except Exception as e:
-                    print(f"HTTP request failed for postfix_id {pid}: {e}")
-                    continue
-
-                parsed, error = _parse_json_response(response)
-                if error:
-                    print(f"Retry postfix_id {pid} - parse issue: {error}; status={response.status_code}")
-                    # keep trying next id; don't crash
-                    continue
-
-                if response.status_code in (200, 201, 204):
-                    print(f"Retry postfix_id {pid} moved! status={response.status_code}")
-
-                # Safely extract result list if present
-                result = None
-                if parsed and isinstance(parsed, dict):
-                    result = parsed.get("result", None)
-
-                if isinstance(result, list):
-                    for item in result:
-                        items.append(item)
-                elif result is not None:
-                    print(f"Retry postfix_id {pid} result field unexpected type: {type(result)}; content: {str(result)[:500]}")
-                time.sleep(2)
-
-    # Summarize and write output if any items
-    if items:
-        num_successes = sum(1 for item in items if item.get('status') == 'OK')
-        print(f"Successfully moved {num_successes}/{len(items)} messages.")
-        print(f"Saving move results to {out_file}")
-
-        fieldnames = [
-            "completed_timestamp", "success", "message_id",
-            "recipient", "operation", "status", "destination"
-        ]
-
-        with open(out_file, "w", newline='', encoding="utf-8") as file:
-            writer = csv.DictWriter(file, fieldnames=fieldnames, extrasaction='ignore')
-            writer.writeheader()
-            writer.writerows(items)
-            print(f"Results saved to {out_file}")
-    else:
-        print("No successful moves happened!")
+            job.done(pid, by_id.get(pid) or {"status": outcome.status, "batch_size": len(batch)})
+
+def _write_failures(out_file, failures):
+    print(f"\nPermanently failed postfix IDs ({len(failures)}):")
+    for pid, error in failures:
+        print(f"  {pid}: {error}")
+    failed_file = CFPipeline.write_failures(CFPipeline.failed_path(out_file), failures)
+    print(f"Failed IDs saved to {failed_file}")
 
 if __name__ == "__main__":
     bulk_move(DESTINATION, INPUT_FILE, OUTPUT_FILE)
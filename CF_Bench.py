@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cloudflare Toolkit Benchmarks
+
+CPU micro-benchmarks for the local data paths (no network): flattening, CSV export,
+record-ID dedup, investigate page decoding (CF_Decode backend, stdlib, incremental),
+the delivered filter, the ID CSV readers and the allow-policy / domain matchers.
+Records come from the emulator's synthetic generator (CF_Emulator.generate_records),
+so they have the real nested shape.
+
+The startup benchmarks time whole 'CFTools.py' processes: '--help', and a 'block' call
+against an in-process emulator (CF_Emulator.start_in_thread), i.e. the quick commands
+that are scripted many times a day and are dominated by interpreter + import time.
+
+    python CF_Bench.py                      # 10k and 100k rows, compare to the baseline
+    python CF_Bench.py --full               # adds the 1M-row run (needs several GB of RAM)
+    python CF_Bench.py --save-baseline      # record this machine's numbers as the baseline
+    python CF_Bench.py --only flatten,dedup --threshold 0.1
+
+Each benchmark reports throughput (best of --repeat timed runs) and peak traced memory
+(one extra run under tracemalloc). With a baseline file present, a throughput drop or a
+peak-memory increase beyond --threshold is reported as a regression and the exit code is 1.
+"""
+
+import argparse
+import contextlib
+import csv
+import gc
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+# the local data paths never hit the API, but importing the modules loads the config
+for _var in ("CF_ACCOUNT_ID", "CLOUDFLARE_EMAIL", "CLOUDFLARE_API_KEY"):
+    os.environ.setdefault(_var, "benchmark")
+os.environ.setdefault("CF_LOCAL_INDEX", "0")
+
+import CF_Emulator as CFEmulator
+
+# ---------------------------
+# CONFIG / TUNABLES
+# ---------------------------
+QUICK_SIZES = (10_000, 100_000)
+FULL_SIZES = (10_000, 100_000, 1_000_000)
+POLICY_SIZES = (10_000,)
+POLICY_QUERIES = 50
+POOL_SIZE = 20_000          # unique generated records; larger sizes are clones with fresh IDs
+DEFAULT_REPEAT = 3
+DEFAULT_THRESHOLD = 0.20
+STARTUP_RUNS = 10           # processes started per startup benchmark timing
+CFTOOLS = Path(__file__).resolve().parent / "CFTools.py"
+BASELINE_FILE = Path(__file__).resolve().parent / "bench_baseline.json"
+
+# ---------------------------
+# Synthetic inputs
+# ---------------------------
+def make_records(n, seed=1):
+    pool = CFEmulator.generate_records(min(n, POOL_SIZE), days=30, seed=seed)
+    if n <= len(pool):
+        return pool
+    out = list(pool)
+    i = 0
+    while len(out) < n:
+        rec = dict(pool[i % len(pool)])
+        rec["postfix_id"] = f"B{i:015d}"
+        rec["id"] = f"bench{i:035d}"
+        out.append(rec)
+        i += 1
+    return out
+
+def _write_id_csv(path, records, column):
+    with open(path, "w", newline="", encoding="utf-8") as cf:
+        writer = csv.writer(cf)
+        writer.writerow([column, "subject"])
+        for r in records:
+            writer.writerow([r[column], r["subject"]])
+
+def _policy_queries(n, seed=3):
+    import random
+    rng = random.Random(seed)
+    senders = []
+    for i in range(n):
+        k = rng.randint(0, 10_000)
+        senders.append(rng.choice([f"sender{k}@partner{k % 97}.com", f"someone@mail.partner{k}.com",
+                                   f"list@news{k}.example.org", f"bulk@mailer{k}.net", f"nobody{k}@unknown.example"]))
+    return senders
+
+# ---------------------------
+# Benchmarks: each setup(n, tmp) returns a zero-arg callable that does the work and returns units processed
+# ---------------------------
+def _bench_flatten(n, tmp, records):
+    import CFFullSearch as CFSearch
+
+    def run():
+        for r in records:
+            CFSearch.flatten_record(r)
+        return len(records)
+    return run
+
+def _bench_export_csv(n, tmp, records):
+    import CFFullSearch as CFSearch
+    out = Path(tmp) / "export.csv"
+
+    def run():
+        ok, written = CFSearch.export_csv_and_validate(out, records)
+        return written
+    return run
+
+def _bench_dedup(n, tmp, records):
+    import CFFullSearch as CFSearch
+    # same access pattern as the search loop: each record seen ~1.1x (overlapping slices)
+    stream = records + records[: len(records) // 10]
+
+    def run():
+        seen, kept = set(), []
+        for r in stream:
+            rid = CFSearch._get_record_id(r)
+            if rid not in seen:
+                seen.add(rid)
+                kept.append(r)
+        return len(stream)
+    return run
+
+def _bench_delivered_filter(n, tmp, records):
+    import CFFullSearch as CFSearch
+    out = Path(tmp) / "delivered.csv"
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            CFSearch.filter_for_delivered_emails_and_output(out, records)
+        return len(records)
+    return run
+
+def _pages(records, per_page=1000):
+    """Investigate response bodies (bytes) of per_page records each, as the API sends them."""
+    return [json.dumps({"success": True, "errors": [], "result": records[i:i + per_page],
+                        "result_info": {"count": len(records[i:i + per_page]), "per_page": per_page}}).encode("utf-8")
+            for i in range(0, len(records), per_page)]
+
+def _bench_decode_page(n, tmp, records):
+    import CF_Decode as CFDecode
+    pages = _pages(records)
+
+    def run():
+        count = 0
+        for body in pages:
+            count += len(CFDecode.loads(body)["result"])
+        return count
+    return run
+
+def _bench_decode_page_stdlib(n, tmp, records):
+    pages = _pages(records)
+
+    def run():
+        count = 0
+        for body in pages:
+            count += len(json.loads(body)["result"])
+        return count
+    return run
+
+def _bench_decode_page_stream(n, tmp, records):
+    import CF_Decode as CFDecode
+    pages = _pages(records)
+
+    def run():
+        count = 0
+        for body in pages:
+            for _ in CFDecode.iter_results(body):
+                count += 1
+        return count
+    return run
+
+def _bench_read_message_ids(n, tmp, records):
+    import CFFullSearch as CFSearch
+    path = Path(tmp) / "message_ids.csv"
+    _write_id_csv(path, records, "message_id")
+
+    def run():
+        return len(CFSearch.read_message_id_csv(path))
+    return run
+
+def _bench_read_postfix_ids(n, tmp, records):
+    import CF_BULKMOVE as CFBulkMove
+    path = Path(tmp) / "postfix_ids.csv"
+    _write_id_csv(path, records, "postfix_id")
+
+    def run():
+        return len(CFBulkMove.read_postfix_id_csv(path))
+    return run
+
+def _bench_allow_policy(n, tmp, _records):
+    import CF_AllowPolicy2 as CFAllow
+    policies = CFEmulator.synthetic_allow_policies(n)
+    queries = _policy_queries(POLICY_QUERIES)
+
+    def run():
+        for q in queries:
+            [p for p in policies if CFAllow.matches_email(p, q)]
+            [p for p in policies if CFAllow.matches_domain(p, CFAllow.email_domain(q))]
+        return len(queries) * 2
+    return run
+
+def _bench_domain_check(n, tmp, _records):
+    import CF_DomainCheck as CFDomain
+    domains = CFEmulator.synthetic_domains(n)
+    queries = [f"mail.dept{i * 37 % (n * 2)}.asu.edu" for i in range(POLICY_QUERIES)]
+
+    def run():
+        for q in queries:
+            [d for d in domains if CFDomain.domain_matches_config(q, d)]
+        return len(queries)
+    return run
+
+def _run_cftools(argv, env):
+    subprocess.run([sys.executable, str(CFTOOLS)] + argv, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def _startup_env(base_url=None):
+    env = dict(os.environ)
+    if base_url:
+        env["CF_API_BASE_URL"] = base_url
+    return env
+
+def _bench_startup_help(n, tmp, _records):
+    env = _startup_env()
+
+    def run():
+        for _ in range(STARTUP_RUNS):
+            _run_cftools(["--help"], env)
+        return STARTUP_RUNS
+    return run
+
+def _bench_startup_block(n, tmp, _records):
+    server, base_url = CFEmulator.start_in_thread(messages=10, block_senders=0, allow_policies=0)
+    env = _startup_env(base_url)
+    counter = iter(range(10**9))
+
+    def run():
+        for _ in range(STARTUP_RUNS):
+            # a fresh pattern every time, so each call takes the success path rather than 'already blocked'
+            _run_cftools(["block", "-s", f"bench{next(counter)}@startup.example", "-c", "1"], env)
+        return STARTUP_RUNS
+    return run
+
+# name -> (setup, kind, unit); "records" benchmarks run at the record sizes, "policies" at POLICY_SIZES,
+# "startup" once per suite (their peak memory is the parent's, so it is not reported)
+BENCHMARKS = {
+    "flatten": (_bench_flatten, "records", "rows"),
+    "export_csv": (_bench_export_csv, "records", "rows"),
+    "dedup": (_bench_dedup, "records", "rows"),
+    "delivered_filter": (_bench_delivered_filter, "records", "rows"),
+    "decode_page": (_bench_decode_page, "records", "rows"),
+    "decode_page_stdlib": (_bench_decode_page_stdlib, "records", "rows"),
+    "decode_page_stream": (_bench_decode_page_stream, "records", "rows"),
+    "read_message_id_csv": (_bench_read_message_ids, "records", "rows"),
+    "read_postfix_id_csv": (_bench_read_postfix_ids, "records", "rows"),
+    "allow_policy_match": (_bench_allow_policy, "policies", "queries"),
+    "domain_check_match": (_bench_domain_check, "policies", "queries"),
+    "startup_help": (_bench_startup_help, "startup", "runs"),
+    "startup_block": (_bench_startup_block, "startup", "runs"),
+}
+
+# ---------------------------
+# Runner
+# ---------------------------
+def _measure(run, repeat, memory=True):
+    best = None
+    units = 0
+    for _ in range(repeat):
+        gc.collect()
+        t0 = time.perf_counter()
+        units = run()
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    res = {"seconds": round(best, 6), "units": units, "per_second": round(units / best, 1) if best else None}
+    if not memory:
+        res["peak_mb"] = None
+        return res
+    gc.collect()
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    res["peak_mb"] = round(peak / (1024 * 1024), 2)
+    return res
+
+def run_suite(sizes, only=None, repeat=DEFAULT_REPEAT):
+    names = [n for n in BENCHMARKS if not only or n in only]
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            record_benches = [n for n in names if BENCHMARKS[n][1] == "records"]
+            if not record_benches:
+                break
+            print(f"[bench] generating {size} synthetic records...")
+            records = make_records(size)
+            for name in record_benches:
+                setup, _, unit = BENCHMARKS[name]
+                res = _measure(setup(size, tmp, records), repeat)
+                res["unit"] = unit
+                results[f"{name}@{size}"] = res
+                _print_result(f"{name}@{size}", res)
+            del records
+            gc.collect()
+        for size in POLICY_SIZES:
+            for name in [n for n in names if BENCHMARKS[n][1] == "policies"]:
+                setup, _, unit = BENCHMARKS[name]
+                res = _measure(setup(size, tmp, None), repeat)
+                res["unit"] = unit
+                results[f"{name}@{size}"] = res
+                _print_result(f"{name}@{size}", res)
+        for name in [n for n in names if BENCHMARKS[n][1] == "startup"]:
+            setup, _, unit = BENCHMARKS[name]
+            res = _measure(setup(None, tmp, None), repeat, memory=False)
+            res["unit"] = unit
+            res["ms_per_run"] = round(1000 * res["seconds"] / res["units"], 1)
+            results[name] = res
+            _print_result(name, res)
+    return results
+
+def _print_result(key, res):
+    if res.get("ms_per_run") is not None:
+        print(f"  {key:<32} {res['ms_per_run']:>14.1f} ms/run   best {res['seconds']:.3f}s for {res['units']} runs")
+        return
+    print(f"  {key:<32} {res['per_second']:>14,.0f} {res['unit']}/s   best {res['seconds']:.3f}s   peak {res['peak_mb']:.1f} MB")
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """Return a list of human-readable regressions against the baseline."""
+    regressions = []
+    for key, res in results.items():
+        base = baseline.get(key)
+        if not base:
+            continue
+        if base.get("per_second") and res.get("per_second") is not None and res["per_second"] < base["per_second"] * (1 - threshold):
+            regressions.append(f"{key}: throughput {res['per_second']:,.0f}/s vs baseline {base['per_second']:,.0f}/s")
+        if base.get("peak_mb") and res.get("peak_mb") is not None and res["peak_mb"] > base["peak_mb"] * (1 + threshold) and res["peak_mb"] - base["peak_mb"] > 1:
+            regressions.append(f"{key}: peak memory {res['peak_mb']} MB vs baseline {base['peak_mb']} MB")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='CPU micro-benchmarks for the toolkit\'s local data paths.')
+    parser.add_argument('--sizes', action='store', dest='sizes', default=None, help='Comma separated record counts. Default: 10000,100000')
+    parser.add_argument('--full', action='store_true', dest='full', help='Run at 10k, 100k and 1M records.')
+    parser.add_argument('--only', action='store', dest='only', default=None, help=f'Comma separated benchmarks to run. Options: {", ".join(BENCHMARKS)}')
+    parser.add_argument('--repeat', action='store', dest='repeat', type=int, default=DEFAULT_REPEAT, help='Timed runs per benchmark (best is kept). Default: 3')
+    parser.add_argument('--baseline', action='store', dest='baseline', default=str(BASELINE_FILE), help='Baseline JSON file. Default: bench_baseline.json')
+    parser.add_argument('--save-baseline', action='store_true', dest='save_baseline', help='Store these results as the new baseline instead of comparing.')
+    parser.add_argument('--threshold', action='store', dest='threshold', type=float, default=DEFAULT_THRESHOLD, help='Allowed regression as a fraction. Default: 0.20')
+    parser.add_argument('--json', action='store', dest='json_out', default=None, help='Also write the raw results to this JSON file.')
+    args = parser.parse_args(argv)
+
+    if args.sizes:
+        sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    else:
+        sizes = FULL_SIZES if args.full else QUICK_SIZES
+    only = set(args.only.split(",")) if args.only else None
+
+    results = run_suite(sizes, only=only, repeat=args.repeat)
+    if args.json_out:
+        Path(args.json_out).write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+    baseline_path = Path(args.baseline)
+    if args.save_baseline:
+        merged = json.loads(baseline_path.read_text(encoding="utf-8")) if baseline_path.exists() else {}
+        merged.update(results)
+        baseline_path.write_text(json.dumps(merged, indent=2, sort_keys=True), encoding="utf-8")
+        print(f"[bench] baseline saved to {baseline_path}")
+        return 0
+    if not baseline_path.exists():
+        print(f"[bench] no baseline at {baseline_path}; run with --save-baseline to create one.")
+        return 0
+
+    regressions = compare(results, json.loads(baseline_path.read_text(encoding="utf-8")), args.threshold)
+    if regressions:
+        print(f"[bench] {len(regressions)} regression(s) beyond {args.threshold:.0%}:")
+        for r in regressions:
+            print(f"  - {r}")
+        return 1
+    print(f"[bench] no regressions beyond {args.threshold:.0%} against {baseline_path}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
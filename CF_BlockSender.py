@@ -17,11 +17,23 @@ Prompts user for pattern, pattern_type, and case number.
 import sys
 import requests
 from datetime import datetime
-import time
 
 import CFScriptConfig as CFG
-
-SETTINGS_BASE = CFG.API_BASE_URL + "/settings"
+import CF_Cache as CFCache
+import CF_Decode as CFDecode
+import CF_Metrics as CFMetrics
+import CF_Settings as CFSettings
+
+# -----------------------------------------------------------
+# FETCH THE BLOCK LIST (local snapshot, see CF_Settings.py)
+# -----------------------------------------------------------
+def fetch_block_senders():
+    """Every block list entry straight from the API (pages fetched concurrently)."""
+    return CFSettings.fetch_all("block_senders")[0]
+
+def get_block_senders():
+    """The block list from the local settings snapshot, through the settings cache (warm inside the daemon)."""
+    return CFCache.cached("block_senders", lambda: CFSettings.entries("block_senders"))
 
 def block_sender(pattern, pattern_type, case_number):
     # Cloudflare handles regex internally — NO regex flag needed
@@ -47,30 +59,35 @@ def block_sender(pattern, pattern_type, case_number):
     # SEND API REQUEST
     # -----------------------------------------------------------
 
-    url = f"{SETTINGS_BASE}/block_senders"
+    url = CFG.API_BASE_URL + "/settings/block_senders"
 
     last_exc = None
     for attempt in range(CFG.MAX_RETRIES):
         try:
             print(f"Making request to {url}")
-            resp = CFG.session.post(url, json=body, timeout=CFG.TIMEOUT)
+            resp = CFG.session.post(url, json=body)
             print(resp)
         except requests.RequestException as e:
             last_exc = e
-            time.sleep((2 ** attempt) * 0.5)
+            CFMetrics.sleep((2 ** attempt) * 0.5, "backoff", url=url, method="POST")
             continue
 
         if resp.status_code == 201:
             try:
-                data = resp.json()
+                data = CFDecode.decode_response(resp)
             except Exception:
                 data = {}
             result = data.get("result")
+            if result:
+                CFSettings.upsert("block_senders", [result])
+                entries = CFCache.peek("block_senders")
+                if entries is not None:
+                    entries.append(result)
             print(f"\n[success] added {result['pattern']} to block list with comment {result['comments']}.")
             return
         elif resp.status_code == 400:
             try:
-                data = resp.json()
+                data = CFDecode.decode_response(resp)
             except Exception:
                 data = {}
             if data["errors"][0]["code"] == 4102:
@@ -78,7 +95,7 @@ def block_sender(pattern, pattern_type, case_number):
                 return
 
         if resp.status_code in (429, 500, 502, 503, 504):
-            time.sleep((2 ** attempt) * 0.5 + CFG.RATE_LIMIT_SLEEP)
+            CFMetrics.sleep((2 ** attempt) * 0.5 + CFG.RATE_LIMIT_SLEEP, "backoff", url=url, method="POST")
             last_exc = Exception(f"Transient HTTP {resp.status_code}")
             continue
 
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cloudflare Toolkit Caches
+
+Named in-memory TTL caches for answers that are expensive to fetch and change slowly:
+the settings lists (allow policies, block senders, domains) and the results of recent
+identical searches. A one-shot CLI run starts empty and exits, so this only pays off in
+the daemon (CF_Daemon.py), where the same process answers many commands.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+import CFScriptConfig as CFG
+
+DEFAULT_MAX_ENTRIES = 64
+
+class TTLCache:
+    """max_weight, with weigh(value) -> number, bounds the cache by size as well as by entry count:
+    the oldest entries are evicted until the total weight fits, and a value that alone weighs
+    more than max_weight is not stored."""
+
+    def __init__(self, ttl, max_entries=DEFAULT_MAX_ENTRIES, max_weight=None, weigh=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_weight = max_weight
+        self.weigh = weigh
+        self.entries = OrderedDict()   # key -> (stored_at, value, weight), oldest first
+        self.weight = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return (value, age_seconds), or None if missing or expired."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                age = time.time() - entry[0]
+                if age <= self.ttl:
+                    self.hits += 1
+                    return entry[1], age
+                self._drop(key)
+            self.misses += 1
+            return None
+
+    def _drop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.weight -= entry[2]
+
+    def put(self, key, value):
+        weight = self.weigh(value) if self.weigh is not None else 0
+        with self.lock:
+            self._drop(key)
+            if self.max_weight is not None and weight > self.max_weight:
+                return
+            self.entries[key] = (time.time(), value, weight)
+            self.weight += weight
+            while len(self.entries) > self.max_entries or (self.max_weight is not None and self.weight > self.max_weight):
+                self._drop(next(iter(self.entries)))
+
+    def invalidate(self, key=None):
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+                self.weight = 0
+            else:
+                self._drop(key)
+
+    def stats(self):
+        with self.lock:
+            out = {"entries": len(self.entries), "ttl": self.ttl, "hits": self.hits, "misses": self.misses}
+            if self.max_weight is not None:
+                out.update({"weight": self.weight, "max_weight": self.max_weight})
+            return out
+
+_lock = threading.Lock()
+_caches = {}
+
+def get_cache(name, ttl=None, max_entries=DEFAULT_MAX_ENTRIES, max_weight=None, weigh=None):
+    with _lock:
+        cache = _caches.get(name)
+        if cache is None:
+            cache = _caches[name] = TTLCache(CFG.SETTINGS_CACHE_TTL if ttl is None else ttl, max_entries, max_weight, weigh)
+        return cache
+
+def cached(name, loader, key=None, ttl=None):
+    """Return loader() through the named cache; concurrent misses may both call the loader."""
+    cache = get_cache(name, ttl)
+    hit = cache.get(key)
+    if hit is not None:
+        return hit[0]
+    value = loader()
+    cache.put(key, value)
+    return value
+
+def peek(name, key=None):
+    """The cached value if present and fresh, without loading it."""
+    with _lock:
+        cache = _caches.get(name)
+    hit = cache.get(key) if cache is not None else None
+    return hit[0] if hit is not None else None
+
+def stats():
+    with _lock:
+        return {name: cache.stats() for name, cache in sorted(_caches.items())}
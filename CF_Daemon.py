@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cloudflare Toolkit Daemon
+
+A long-running local process that executes CFTools.py commands warm: modules are already
+imported, CFG.session keeps its keep-alive connections, the CF_RateLimit bucket carries
+over between commands, and CF_Cache holds the settings lists (allow policies, block
+senders, domains) and recent search results.
+
+    python CFTools.py daemon start      # foreground; run it under a service manager or with &
+    python CFTools.py daemon status
+    python CFTools.py daemon stop
+
+While it runs, CFTools.py forwards each command line (argv + working directory) to it over
+localhost HTTP and prints the output it sends back; when it is not running, commands run
+in-process as before ('--no-daemon' forces that). The port and a random token are written
+to debug/daemon.json with owner-only permissions; requests without the token are refused.
+
+Each command's stdout/stderr is captured per command, so concurrent commands do not
+interleave; the worker threads a command starts write to the same capture (they are
+started through CFMetrics.in_scope, which carries it). The output is streamed back while
+the command runs, as JSON lines: {"output": ...} chunks, then {"exit_code": ...}. When the
+client goes away (Ctrl-C), the command is cancelled: its next API request raises Cancelled.
+
+The daemon's configuration comes from its own environment, read when it started. The
+client sends a fingerprint (hashes, never the values) of the variables in ENV_VARS; when
+any differs from the daemon's, the daemon refuses the command and the client runs it
+in-process instead, so e.g. a CF_API_BASE_URL pointing at the emulator is never ignored.
+"""
+
+import hashlib
+import hmac
+import http.client
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+
+import CFScriptConfig as CFG
+
+TOKEN_HEADER = "X-CF-Daemon-Token"
+PING_TIMEOUT = 0.5
+STREAM_INTERVAL = 1.0   # seconds between output chunks; an empty one checks the client is still there
+# environment variables the configuration is read from (CFScriptConfig.py)
+ENV_VARS = ("CF_ACCOUNT_ID", "CLOUDFLARE_EMAIL", "CLOUDFLARE_API_KEY", "CF_API_BASE_URL", "CF_AUTH_MODE",
+            "CF_RATE_LIMIT_RPS", "CF_RATE_LIMIT_WINDOW_MAX", "CF_LOCAL_INDEX", "CF_SETTINGS_MAX_AGE", "CF_SETTINGS_FULL_SYNC_AGE",
+            "CF_RECLASSIFY_RAW_RETENTION_HOURS")
+
+class EnvMismatch(RuntimeError):
+    """The daemon was started with a different configuration environment than the client's."""
+
+    def __init__(self, names):
+        super().__init__(", ".join(names))
+        self.names = names
+
+class Cancelled(BaseException):
+    """The client of a forwarded command went away. A BaseException, so retry loops do not swallow it."""
+
+def env_fingerprint():
+    """ENV_VARS -> sha256 of the value (None when unset). Unset variables fall back to the same .env on both sides."""
+    out = {}
+    for name in ENV_VARS:
+        value = os.environ.get(name)
+        out[name] = hashlib.sha256(value.encode("utf-8")).hexdigest() if value is not None else None
+    return out
+
+def _state_path():
+    return CFG.DEBUG_DIR / "daemon.json"
+
+# ---------------------------
+# Client side (used by CFTools.py before running a command in-process)
+# ---------------------------
+def _read_state():
+    try:
+        return json.loads(_state_path().read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+def _open(conn, state, method, path, body=None):
+    """Send a request; the response when it is a 200, else raises (EnvMismatch on a 409 for the environment)."""
+    payload = json.dumps(body).encode("utf-8") if body is not None else None
+    headers = {TOKEN_HEADER: state["token"], "Content-Type": "application/json"}
+    conn.request(method, path, body=payload, headers=headers)
+    resp = conn.getresponse()
+    if resp.status != 200:
+        data = json.loads(resp.read() or b"{}")
+        if resp.status == 409 and data.get("env_mismatch"):
+            raise EnvMismatch(data["env_mismatch"])
+        raise RuntimeError(data.get("error") or f"daemon returned HTTP {resp.status}")
+    return resp
+
+def _request(state, method, path, body=None, timeout=None):
+    conn = http.client.HTTPConnection(state["host"], state["port"], timeout=timeout)
+    try:
+        return json.loads(_open(conn, state, method, path, body).read() or b"{}")
+    finally:
+        conn.close()
+
+def running():
+    """The daemon's state dict if one answers on the recorded port, else None."""
+    state = _read_state()
+    if not state:
+        return None
+    try:
+        _request(state, "GET", "/status", timeout=PING_TIMEOUT)
+    except (OSError, RuntimeError, ValueError):
+        return None
+    return state
+
+def forward(argv, cwd=None):
+    """Run a CFTools.py command line in the daemon and print its output.
+    Returns the exit code, or None when no daemon is running (the caller then runs it locally)."""
+    state = running()
+    if state is None:
+        return None
+    # from here on the command may already be executing: never fall back and run it twice
+    # (except when the daemon refused it for its environment, before running anything)
+    conn = http.client.HTTPConnection(state["host"], state["port"])
+    try:
+        resp = _open(conn, state, "POST", "/run", {"argv": list(argv), "cwd": cwd or os.getcwd(), "env": env_fingerprint()})
+        for line in resp:
+            data = json.loads(line)
+            if "exit_code" in data:
+                return data["exit_code"]
+            sys.stdout.write(data.get("output", ""))
+            sys.stdout.flush()
+        print("[error] the daemon closed the connection before the command finished")
+        return 1
+    except EnvMismatch as e:
+        print(f"[info] the daemon was started with a different {e}; running this command in-process")
+        return None
+    except (OSError, RuntimeError, ValueError) as e:
+        print(f"[error] daemon request failed: {e}")
+        return 1
+    except KeyboardInterrupt:
+        print("\n[info] interrupted; the daemon stops the command at its next API request")
+        return 130
+    finally:
+        conn.close()
+
+def status():
+    state = running()
+    if state is None:
+        print("[info] daemon is not running.")
+        return None
+    data = _request(state, "GET", "/status", timeout=PING_TIMEOUT)
+    print(f"[info] daemon pid={data['pid']} on {state['host']}:{state['port']} up {data['uptime_seconds']:.0f}s; "
+          f"{data['commands']} command(s) served, {data['active']} running")
+    print(f"[info] rate limiter: {data['rate_limit']}")
+    for name, c in data["caches"].items():
+        size = f" ({c['weight']}/{c['max_weight']})" if "max_weight" in c else ""
+        print(f"[info] cache {name}: {c['entries']} entries{size}, ttl {c['ttl']}s, {c['hits']} hits / {c['misses']} misses")
+    return data
+
+def stop():
+    state = running()
+    if state is None:
+        print("[info] daemon is not running.")
+        return False
+    _request(state, "POST", "/shutdown", timeout=PING_TIMEOUT * 4)
+    print(f"[success] daemon pid={state['pid']} stopped.")
+    return True
+
+# ---------------------------
+# Per-thread output capture
+# ---------------------------
+_capture = threading.local()
+
+class _Command:
+    """One forwarded command: the output not yet sent to the client, its exit code once done,
+    and whether the client went away."""
+
+    def __init__(self, argv):
+        self.argv = argv
+        self._cond = threading.Condition()
+        self._chunks = []
+        self.exit_code = None
+        self.cancelled = threading.Event()
+
+    def write(self, s):
+        with self._cond:
+            self._chunks.append(s)
+            self._cond.notify()
+        return len(s)
+
+    def flush(self):
+        pass
+
+    def finish(self, code):
+        with self._cond:
+            self.exit_code = code
+            self._cond.notify()
+
+    def take(self, timeout):
+        """(output written since the last call, exit code or None); waits up to timeout for either."""
+        with self._cond:
+            if not self._chunks and self.exit_code is None:
+                self._cond.wait(timeout)
+            text, self._chunks = "".join(self._chunks), []
+            return text, self.exit_code
+
+def check_cancelled():
+    """Raise Cancelled when this thread works for a forwarded command whose client went away."""
+    cmd = getattr(_capture, "cmd", None)
+    if cmd is not None and cmd.cancelled.is_set():
+        raise Cancelled()
+
+class _ThreadLocalStream:
+    """Stands in for sys.stdout/sys.stderr: writes go to the current command's capture, or the real stream."""
+
+    def __init__(self, real):
+        self._real = real
+
+    def _target(self):
+        return getattr(_capture, "cmd", None) or self._real
+
+    def write(self, s):
+        return self._target().write(s)
+
+    def flush(self):
+        self._target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self._real, name)
+
+def _install_capture():
+    import CF_Metrics as CFMetrics
+    CFMetrics.carry(lambda: getattr(_capture, "cmd", None), lambda cmd: setattr(_capture, "cmd", cmd))
+    if not isinstance(sys.stdout, _ThreadLocalStream):
+        sys.stdout = _ThreadLocalStream(sys.stdout)
+    if not isinstance(sys.stderr, _ThreadLocalStream):
+        sys.stderr = _ThreadLocalStream(sys.stderr)
+
+# ---------------------------
+# Server side
+# ---------------------------
+_stats = {"started": time.time(), "commands": 0, "active": 0}
+_stats_lock = threading.Lock()
+_env = {}   # env_fingerprint() of the daemon, taken before .env is loaded
+
+def execute(argv, cwd, cmd):
+    """Run one CFTools.py command line in this process, its output going to cmd; ends with cmd.finish(exit_code)."""
+    import CFTools
+
+    _capture.cmd = cmd
+    with _stats_lock:
+        _stats["active"] += 1
+    try:
+        code = CFTools.main(argv, cwd=cwd, forward=False)
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except Cancelled:
+        code = 130
+    except Exception:
+        traceback.print_exc()
+        code = 1
+    finally:
+        _capture.cmd = None
+        with _stats_lock:
+            _stats["active"] -= 1
+            _stats["commands"] += 1
+    cmd.finish(code or 0)
+
+def _status():
+    import CF_Cache as CFCache
+    import CF_RateLimit as CFRateLimit
+    with _stats_lock:
+        return {"pid": os.getpid(), "uptime_seconds": round(time.time() - _stats["started"], 1),
+                "commands": _stats["commands"], "active": _stats["active"],
+                "caches": CFCache.stats(), "rate_limit": CFRateLimit.status()}
+
+def warm_caches():
+    """Fetch the settings lists once at startup so the first check is already a cache hit."""
+    import CF_AllowPolicy2 as CFAllow
+    import CF_BlockSender as CFBlock
+    import CF_DomainCheck as CFDomain
+    for name, loader in (("allow_policies", CFAllow.get_allow_policies), ("block_senders", CFBlock.get_block_senders),
+                         ("domains", CFDomain.get_domains)):
+        try:
+            print(f"[info] daemon: warmed {name} ({len(loader())} entries)")
+        except Exception as e:
+            print(f"[error] daemon: could not warm {name}: {e}")
+
+def _make_handler(token):
+    from http.server import BaseHTTPRequestHandler
+
+    class DaemonHandler(BaseHTTPRequestHandler):
+        server_version = "CFToolsDaemon/1"
+
+        def log_message(self, fmt, *args):
+            pass
+
+        def _reply(self, code, obj):
+            data = json.dumps(obj).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _stream(self, cmd):
+            """Send cmd's output as JSON lines while it runs, then its exit code; cancel it if the client goes away."""
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+            while True:
+                text, code = cmd.take(STREAM_INTERVAL)
+                lines = [{"output": text}] if text or code is None else []
+                if code is not None:
+                    lines.append({"exit_code": code})
+                try:
+                    self.wfile.write("".join(json.dumps(obj) + "\n" for obj in lines).encode("utf-8"))
+                    self.wfile.flush()
+                except OSError:
+                    cmd.cancelled.set()
+                    print(f"[info] daemon: client went away; cancelling {cmd.argv}")
+                    return
+                if code is not None:
+                    return
+
+        def _authorized(self):
+            if hmac.compare_digest(self.headers.get(TOKEN_HEADER, ""), token):
+                return True
+            self._reply(403, {"error": "bad or missing daemon token"})
+            return False
+
+        def do_GET(self):
+            if not self._authorized():
+                return
+            if self.path == "/status":
+                return self._reply(200, _status())
+            self._reply(404, {"error": f"unknown path {self.path}"})
+
+        def do_POST(self):
+            if not self._authorized():
+                return
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                body = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                return self._reply(400, {"error": "body is not JSON"})
+            if self.path == "/run":
+                theirs = body.get("env")
+                if theirs is not None:
+                    differ = [name for name in ENV_VARS if theirs.get(name) != _env.get(name)]
+                    if differ:
+                        return self._reply(409, {"error": f"environment differs: {', '.join(differ)}", "env_mismatch": differ})
+                cmd = _Command(body.get("argv") or [])
+                threading.Thread(target=execute, args=(cmd.argv, body.get("cwd") or os.getcwd(), cmd),
+                                 name="daemon-command", daemon=True).start()
+                return self._stream(cmd)
+            if self.path == "/shutdown":
+                self._reply(200, {"stopping": True})
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+                return
+            self._reply(404, {"error": f"unknown path {self.path}"})
+
+    return DaemonHandler
+
+def _write_state(state):
+    path = _state_path()
+    fd = os.open(str(path), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+
+def serve(host=CFG.DAEMON_HOST, port=CFG.DAEMON_PORT, warm=True):
+    import secrets
+    from http.server import ThreadingHTTPServer
+
+    _env.update(env_fingerprint())
+    if running():
+        print("[error] a daemon is already running. Use 'CFTools.py daemon stop' first.")
+        return 1
+
+    token = secrets.token_urlsafe(32)
+    server = ThreadingHTTPServer((host, port), _make_handler(token))
+    server.daemon_threads = True
+    state = {"host": host, "port": server.server_address[1], "token": token, "pid": os.getpid(), "started": time.time()}
+    _write_state(state)
+    _install_capture()
+
+    # build the session (and validate credentials) now rather than on the first command
+    CFG.session
+    if warm:
+        threading.Thread(target=warm_caches, daemon=True).start()
+
+    print(f"[info] daemon pid={os.getpid()} listening on {host}:{state['port']}; state in {_state_path()}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if (_read_state() or {}).get("pid") == os.getpid():
+            _state_path().unlink(missing_ok=True)
+        print(f"[info] daemon stopped after {_stats['commands']} command(s).")
+    return 0
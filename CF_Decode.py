@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cloudflare Response Decoding
+
+One place that turns API response bodies into Python objects, so each body is parsed at
+most once and the parser can be swapped:
+
+  - loads() / decode_response() use the fastest JSON backend installed (orjson, then
+    ujson, then the standard library); CF_JSON_BACKEND=json|orjson|ujson forces one.
+    decode_response() keeps the result on the response object, so a second caller
+    (e.g. the debug dump and the page handler) gets the same object back.
+  - iter_results() is the incremental mode: it walks the body and yields the records of
+    the top-level "result" array one at a time, decoding each with the standard library's
+    raw_decode, without building the whole list. Other top-level fields (result_info,
+    success, errors) are collected in .meta as they are passed. The bytes are decoded to
+    text STREAM_CHUNK at a time and parsed text is dropped, so besides the body itself only
+    about one chunk (or the record being parsed, if larger) is held as a str. The body is
+    still downloaded whole (the search also writes it to its debug dump): what this saves is
+    the decoded list, not the download.
+
+Decoding failures raise ValueError, as resp.json() does; a ResultStream given on_error hands
+the error to it instead and ends as if the body stopped there.
+"""
+
+import codecs
+import json
+import os
+import re
+
+_WS = re.compile(r"[ \t\n\r]*")
+_std_decoder = json.JSONDecoder()
+
+STREAM_CHUNK = 1 << 16   # bytes decoded to text at a time by ResultStream
+
+# ---------------------------
+# Backends
+# ---------------------------
+def _orjson():
+    import orjson
+    return orjson.loads, orjson.JSONDecodeError
+
+def _ujson():
+    import ujson
+    return ujson.loads, ValueError
+
+def _stdlib():
+    return json.loads, ValueError
+
+_BACKENDS = {"orjson": _orjson, "ujson": _ujson, "json": _stdlib}
+
+def _pick_backend():
+    wanted = os.getenv("CF_JSON_BACKEND", "auto").lower()
+    order = [wanted] if wanted in _BACKENDS else ["orjson", "ujson", "json"]
+    for name in order:
+        try:
+            return (name,) + _BACKENDS[name]()
+        except ImportError:
+            continue
+    return ("json",) + _stdlib()
+
+BACKEND, _loads, _decode_error = _pick_backend()
+
+def loads(data):
+    """Parse bytes or str with the active backend; raises ValueError on bad JSON."""
+    try:
+        return _loads(data)
+    except _decode_error as e:
+        raise ValueError(f"JSON decode error ({BACKEND}): {e}") from None
+
+# ---------------------------
+# Whole responses, parsed once
+# ---------------------------
+def decode_response(resp):
+    """resp's body as a Python object, parsed on first call and cached on the response."""
+    cached = getattr(resp, "_cf_decoded", None)
+    if cached is not None:
+        return cached
+    decoded = loads(resp.content)
+    resp._cf_decoded = decoded
+    return decoded
+
+def is_decoded(resp):
+    return getattr(resp, "_cf_decoded", None) is not None
+
+# ---------------------------
+# Incremental mode
+# ---------------------------
+class ResultStream:
+    """Iterate the records of a page body's "result" array one at a time.
+
+    meta holds the other top-level fields once iteration has passed them (all of them after
+    the loop ends); count is the number of records yielded. on_done(count) is called once
+    the whole body has been walked. With on_error, a body that is not valid JSON ends the
+    iteration after the records decoded so far; the error is passed to on_error(exc) and
+    kept in .error, and on_done is still called.
+    """
+
+    def __init__(self, body, on_done=None, on_error=None):
+        if isinstance(body, str):
+            self.buf, self._src = body, b""
+        else:
+            self.buf, self._src = "", memoryview(body)
+        self._pos = 0
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self.i = 0
+        self.meta = {}
+        self.count = 0
+        self.error = None
+        self.on_done = on_done
+        self.on_error = on_error
+
+    def _fill(self):
+        """Decode the next chunk of the body onto the buffer; False once it is exhausted."""
+        if self._pos >= len(self._src):
+            return False
+        if self.i > STREAM_CHUNK:
+            self.buf, self.i = self.buf[self.i:], 0
+        end = self._pos + STREAM_CHUNK
+        self.buf += self._decoder.decode(self._src[self._pos:end], end >= len(self._src))
+        self._pos = end
+        return True
+
+    def _peek(self):
+        """The next non-whitespace character ("" at the end of the body), left unconsumed."""
+        while True:
+            self.i = _WS.match(self.buf, self.i).end()
+            if self.i < len(self.buf) or not self._fill():
+                return self.buf[self.i:self.i + 1]
+
+    def _expect(self, chars):
+        ch = self._peek()
+        if not ch or ch not in chars:
+            raise ValueError(f"JSON decode error (stream): expected {chars!r} at offset {self._pos - len(self.buf) + self.i}")
+        self.i += 1
+        return ch
+
+    def _value(self):
+        """Decode the value at the cursor, pulling in more of the body until it is complete."""
+        self._peek()
+        while True:
+            try:
+                value, end = _std_decoder.raw_decode(self.buf, self.i)
+            except ValueError:
+                if self._fill():
+                    continue
+                raise
+            # a number that ends the buffer may continue in the next chunk
+            if end < len(self.buf) or not self._fill():
+                self.i = end
+                return value
+
+    def _records(self):
+        if self._peek() == "]":
+            self.i += 1
+            return
+        while True:
+            rec = self._value()
+            self.count += 1
+            yield rec
+            if self._expect(",]") == "]":
+                return
+
+    def _walk(self):
+        self._expect("{")
+        if self._peek() == "}":
+            self.i += 1
+            return
+        while True:
+            key = self._value()
+            self._expect(":")
+            if key == "result" and self._peek() == "[":
+                self.i += 1
+                yield from self._records()
+            else:
+                value = self._value()
+                if key == "result":
+                    # some endpoints wrap the list: {"result": {"items": [...]}}
+                    for k in ("items", "results", "data"):
+                        if isinstance(value, dict) and isinstance(value.get(k), list):
+                            for rec in value[k]:
+                                self.count += 1
+                                yield rec
+                            break
+                else:
+                    self.meta[key] = value
+            if self._expect(",}") == "}":
+                return
+
+    def __iter__(self):
+        try:
+            yield from self._walk()
+        except ValueError as e:
+            if self.on_error is None:
+                raise
+            self.error = e
+            self.on_error(e)
+        if self.on_done is not None:
+            self.on_done(self.count)
+
+def iter_results(resp_or_body, on_done=None, on_error=None):
+    body = resp_or_body.content if hasattr(resp_or_body, "content") else resp_or_body
+    return ResultStream(body, on_done=on_done, on_error=on_error)
+
+# ---------------------------
+# Debug dumps
+# ---------------------------
+def raw_json_or_string(resp, keep=True):
+    """The body as JSON text to embed verbatim in a debug dump (not re-encoded), or a JSON string
+    literal when it is not valid JSON. The check parses the body: with keep the result is cached
+    for decode_response(), keep=False drops it (when the caller walks the body with iter_results)."""
+    try:
+        text = resp.content.decode("utf-8")
+    except Exception:
+        return json.dumps(resp.text)
+    if text.lstrip()[:1] in ("{", "["):
+        try:
+            if keep:
+                decode_response(resp)
+            else:
+                loads(resp.content)
+            return text
+        except ValueError:
+            pass
+    return json.dumps(text, ensure_ascii=False)
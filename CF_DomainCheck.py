@@ -5,47 +5,27 @@
 Cloudflare Domain Check
 """
 
-import requests
 from typing import List, Dict, Any
 
-import CFSearchConfig as CFG
+import CFScriptConfig as CFG
+import CF_Cache as CFCache
+import CF_Settings as CFSettings
 
 # ---------------------------
 # CONFIG — edit this (IDE)
 # ---------------------------
 SEARCH_DOMAIN = "azte.com"   # set to domain you want to check (e.g. "example.com")
 
-url = CFG.API_BASE_URL + f"/settings/domains"
-HEADERS = {
-    "X-Auth-Email": CFG.AUTH_EMAIL,
-    "X-Auth-Key": CFG.AUTH_KEY,
-    "Accept": "application/json",
-}
-
 # ---------------------------
 # Fetch all domains (paged)
 # ---------------------------
-def fetch_all_domains(per_page: int = CFG.PER_PAGE) -> List[Dict[str, Any]]:
-    session = requests.Session()
-    session.headers.update(HEADERS)
-    page = 1
-    all_items: List[Dict[str, Any]] = []
-
-    while True:
-        resp = session.get(url, params={"per_page": per_page, "page": page}, timeout=30)
-        resp.raise_for_status()
-        data = resp.json()
-        items = data.get("result") or []
-        if not isinstance(items, list):
-            items = list(items) if items else []
-        if not items:
-            break
-        all_items.extend(items)
-        if len(items) < per_page:
-            break
-        page += 1
+def fetch_all_domains() -> List[Dict[str, Any]]:
+    """Every domain straight from the API (pages fetched concurrently, see CF_Settings.py)."""
+    return CFSettings.fetch_all("domains")[0]
 
-    return all_items
+def get_domains() -> List[Dict[str, Any]]:
+    """The domains from the local settings snapshot, through the settings cache (warm inside the daemon)."""
+    return CFCache.cached("domains", lambda: CFSettings.entries("domains"))
 
 # ---------------------------
 # Matching helpers
@@ -70,30 +50,17 @@ def domain_matches_config(search_domain: str, config_domain_entry: Dict[str, Any
         return False
     return _is_subdomain_of(search_domain, cfg) or _is_subdomain_of(cfg, search_domain)
 
-# ---------------------------
-# Main (IDE)
-# ---------------------------
-def main():
-    if not SEARCH_DOMAIN or not SEARCH_DOMAIN.strip():
-        raise ValueError("Set SEARCH_DOMAIN at top of script to the domain you want to check (e.g. 'example.com').")
-
-    sd = SEARCH_DOMAIN.strip().lower()
-    print(f"[info] fetching configured domains for account {CFG.ACCOUNT_ID} ...")
-    try:
-        domains = fetch_all_domains()
-    except Exception as e:
-        print("[error] failed to fetch domains:", e)
-        return
-
-    print(f"[info] fetched {len(domains)} domain entries")
+def find_matches(search_domain: str, domains: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     matches = []
     for d in domains:
         try:
-            if domain_matches_config(sd, d):
+            if domain_matches_config(search_domain, d):
                 matches.append(d)
         except Exception:
             continue
+    return matches
 
+def print_matches(sd: str, matches: List[Dict[str, Any]]):
     if not matches:
         print(f"[result] {sd} is NOT configured in Email Security domains.")
         return
@@ -109,5 +76,23 @@ def main():
         print(f"    drop_dispositions: {m.get('drop_dispositions')}")
         print()
 
+# ---------------------------
+# Main (IDE)
+# ---------------------------
+def main():
+    if not SEARCH_DOMAIN or not SEARCH_DOMAIN.strip():
+        raise ValueError("Set SEARCH_DOMAIN at top of script to the domain you want to check (e.g. 'example.com').")
+
+    sd = SEARCH_DOMAIN.strip().lower()
+    print(f"[info] fetching configured domains for account {CFG.ACCOUNT_ID} ...")
+    try:
+        domains = get_domains()
+    except Exception as e:
+        print("[error] failed to fetch domains:", e)
+        return
+
+    print(f"[info] fetched {len(domains)} domain entries")
+    print_matches(sd, find_matches(sd, domains))
+
 if __name__ == "__main__":
     main()
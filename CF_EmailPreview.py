@@ -4,61 +4,195 @@ Created on Thu Dec  4 11:22:12 2025
 
 Cloudflare - Email Preview
 
+Saves the preview screenshot of postfix IDs as PNG files. For a list of IDs
+('CFTools.py preview -i ids.csv', or export_previews()), previews are fetched with
+CF_Pipeline.run_per_id. The response is streamed: the "screenshot" string is found in the JSON as it arrives and its
+base64 is decoded to the PNG file piece by piece, so neither the base64 text nor the whole
+body is ever held in memory or printed. IDs whose PNG is already in the output directory
+are skipped. With contact_sheet=True an index.html grid of every preview is written too.
+
 @author: rasmit10
 """
 
-import sys
-import json
 import base64
-import requests
+import binascii
+import html
+import os
+import sys
+import tempfile
+from pathlib import Path
 
 import CFScriptConfig as CFG
-
-
-POSTFIX_ID = input("Enter postfix_id: ").strip()
-if not POSTFIX_ID:
-    print("No postfix_id provided.")
-    sys.exit(1)
-
-url = CFG.API_BASE_URL + f"/investigate/{POSTFIX_ID}/preview"
-
-headers = {
-    "X-Auth-Email": CFG.AUTH_EMAIL,
-    "X-Auth-Key": CFG.AUTH_KEY,
-    "Accept": "application/json",
-}
-
-resp = requests.get(url, headers=headers)
-
-try:
-    data = resp.json()
-except:
-    print("Non-JSON response:")
-    print(resp.text)
-    sys.exit(1)
-
-print("\n=== FULL JSON RESPONSE ===")
-print(json.dumps(data, indent=2))
-
-# FIX: screenshot is inside data["result"]
-result = data.get("result", {})
-screenshot_b64 = result.get("screenshot")
-
-if not screenshot_b64:
-    print("\nNo screenshot field found inside result.")
-    sys.exit(0)
-
-print("\nScreenshot found! Base64 length:", len(screenshot_b64))
-print("\n===== BASE64 START =====")
-print(screenshot_b64[:200] + "... (truncated)")  # keep IDE clean
-print("===== BASE64 END =====\n")
-
-# Optional: save to file
-save = input("Save PNG file? (y/n): ").strip().lower()
-if save == "y":
-    png_bytes = base64.b64decode(screenshot_b64)
-    out_file = f"{POSTFIX_ID}_preview.png"
-    with open(out_file, "wb") as f:
-        f.write(png_bytes)
-    print(f"Saved PNG to {out_file}")
-
+import CF_Pipeline as CFPipeline
+import CF_Profile as CFProfile
+
+SCREENSHOT_KEY = b'"screenshot"'
+
+# -----------------------------------------------------------
+# STREAMING BASE64 DECODE
+# -----------------------------------------------------------
+# JSON escapes that may appear inside the base64 value: "\/" is "/", escaped line breaks
+# and tabs (wrapped base64) carry nothing. Anything else cannot be part of base64.
+_ESCAPES = {b"/": b"/", b"n": b"", b"r": b"", b"t": b""}
+
+class ScreenshotDecoder:
+    """Feed response chunks; writes the decoded "screenshot" value to out as it arrives.
+    found is True once the value has started, done once its closing quote was seen."""
+
+    def __init__(self, out):
+        self.out = out
+        self.found = False
+        self.done = False
+        self.bytes = 0
+        self._buf = b""      # undecided bytes while looking for the key / the opening quote
+        self._carry = b""    # base64 characters left over from the last chunk (< 4)
+        self._escape = b""   # a backslash that ended the last chunk; its escape continues in this one
+
+    def feed(self, chunk):
+        if self.done or not chunk:
+            return
+        if not self.found:
+            self._buf += chunk
+            i = self._buf.find(SCREENSHOT_KEY)
+            if i < 0:
+                self._buf = self._buf[-len(SCREENSHOT_KEY):]
+                return
+            rest = self._buf[i + len(SCREENSHOT_KEY):].lstrip()
+            if not rest or (rest[:1] == b":" and not rest[1:].lstrip()):
+                self._buf = self._buf[i:]       # the value has not started yet; wait for more
+                return
+            value = rest[1:].lstrip() if rest[:1] == b":" else rest
+            if value[:1] != b'"':
+                self.done = True                # null or not a string: no screenshot
+                return
+            self.found = True
+            self._buf = b""
+            chunk = value[1:]
+        data = self._carry + self._unescape(self._escape + chunk)
+        n = len(data) if self.done else len(data) - len(data) % 4
+        if n:
+            decoded = base64.b64decode(data[:n])
+            self.out.write(decoded)
+            self.bytes += len(decoded)
+        self._carry = data[n:]
+
+    def _unescape(self, chunk):
+        """The value's characters in chunk with JSON escapes resolved, up to the closing quote (sets done)."""
+        out, i = [], 0
+        self._escape = b""
+        while True:
+            quote, backslash = chunk.find(b'"', i), chunk.find(b"\\", i)
+            if backslash < 0 or 0 <= quote < backslash:
+                out.append(chunk[i:] if quote < 0 else chunk[i:quote])
+                self.done = quote >= 0
+                return b"".join(out)
+            out.append(chunk[i:backslash])
+            if backslash + 1 == len(chunk):
+                self._escape = b"\\"
+                return b"".join(out)
+            esc = chunk[backslash + 1:backslash + 2]
+            if esc not in _ESCAPES:
+                raise ValueError(f"unexpected escape \\{esc.decode('latin-1')} in the screenshot value")
+            out.append(_ESCAPES[esc])
+            i = backslash + 2
+
+# -----------------------------------------------------------
+# API REQUEST
+# -----------------------------------------------------------
+def preview_path(out_dir, postfix_id):
+    return Path(out_dir) / f"{postfix_id}_preview.png"
+
+def _save_screenshot(out_dir):
+    def handle(pid, resp):
+        fd, tmp = tempfile.mkstemp(dir=out_dir, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f, CFProfile.span("decode"):
+                decoder = ScreenshotDecoder(f)
+                for chunk in resp.iter_content(chunk_size=CFG.RAW_CHUNK_BYTES):
+                    decoder.feed(chunk)
+                    if decoder.done:
+                        break
+            if not decoder.found or (decoder.done and not decoder.bytes):
+                os.remove(tmp)
+                return CFPipeline.BatchOutcome(False, error="no screenshot in the preview response", status=200)
+            if not decoder.done:
+                raise ValueError("response ended inside the screenshot value")
+            os.replace(tmp, preview_path(out_dir, pid))
+        except binascii.Error as e:
+            os.remove(tmp)
+            return CFPipeline.BatchOutcome(False, error=f"screenshot is not valid base64: {e}", status=200)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return CFPipeline.BatchOutcome(True, results=[{"postfix_id": pid, "bytes": decoder.bytes}], status=200)
+    return CFPipeline.get_one("/investigate/{pid}/preview", handle, stream=True)
+
+# -----------------------------------------------------------
+# BULK EXPORT
+# -----------------------------------------------------------
+def export_previews(postfix_ids, out_dir, workers=CFG.PREVIEW_WORKERS, contact_sheet=False):
+    """Save the preview PNG of every postfix ID to out_dir. Returns {"saved", "skipped", "failed"} counts."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    ids = list(dict.fromkeys(postfix_ids))
+    todo = [pid for pid in ids if not preview_path(out_dir, pid).exists()]
+    counts = {"saved": 0, "skipped": len(ids) - len(todo), "failed": 0}
+    print(f"[info] {len(ids)} postfix IDs; {counts['skipped']} previews already in {out_dir}, fetching {len(todo)}")
+
+    def on_result(pid, outcome):
+        counts["saved"] += 1
+        if counts["saved"] % 100 == 0:
+            print(f"[info] {counts['saved']}/{len(todo)} previews saved")
+
+    if todo:
+        with CFProfile.span("preview"):
+            failures = CFPipeline.run_per_id(todo, _save_screenshot(out_dir), on_result, workers, "preview",
+                                             failed_file=out_dir / "previews_failed.csv")
+        counts["failed"] = len(failures)
+    if contact_sheet:
+        sheet = write_contact_sheet([pid for pid in ids if preview_path(out_dir, pid).exists()], out_dir)
+        print(f"[info] contact sheet written to {sheet}")
+    print(f"[success] {counts['saved']} previews saved, {counts['skipped']} already on disk, in {out_dir}")
+    return counts
+
+# -----------------------------------------------------------
+# CONTACT SHEET
+# -----------------------------------------------------------
+def write_contact_sheet(postfix_ids, out_dir):
+    """index.html in out_dir: one captioned thumbnail per preview (sender and subject from the local index when known)."""
+    known = {}
+    if CFG.LOCAL_INDEX_ENABLED:
+        try:
+            import CF_LocalIndex
+            known = CF_LocalIndex.records_by_postfix_id(postfix_ids)
+        except Exception as e:
+            print("[debug] local index lookup failed:", e)
+
+    path = Path(out_dir) / "index.html"
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>Email previews</title><style>\n"
+                "body{font-family:sans-serif;margin:1em}\n"
+                ".grid{display:grid;grid-template-columns:repeat(auto-fill,minmax(260px,1fr));gap:12px}\n"
+                "figure{margin:0;border:1px solid #ccc;padding:6px}\n"
+                "img{width:100%;height:200px;object-fit:cover;object-position:top}\n"
+                "figcaption{font-size:12px;word-break:break-all}\n"
+                "</style></head><body>\n")
+        f.write(f"<h1>{len(postfix_ids)} email previews</h1>\n<div class=\"grid\">\n")
+        for pid in postfix_ids:
+            rec = known.get(pid) or {}
+            name = preview_path(out_dir, pid).name
+            caption = " &middot; ".join(html.escape(str(v)) for v in (pid, rec.get("from"), rec.get("subject")) if v)
+            f.write(f"<figure><a href=\"{html.escape(name)}\"><img loading=\"lazy\" src=\"{html.escape(name)}\" "
+                    f"alt=\"{html.escape(pid)}\"></a><figcaption>{caption}</figcaption></figure>\n")
+        f.write("</div>\n</body></html>\n")
+    return path
+
+if __name__ == "__main__":
+    POSTFIX_ID = input("Enter postfix_id: ").strip()
+    if not POSTFIX_ID:
+        print("No postfix_id provided.")
+        sys.exit(1)
+    counts = export_previews([POSTFIX_ID], ".")
+    if counts["saved"] or counts["skipped"]:
+        print(f"Saved PNG to {preview_path('.', POSTFIX_ID)}")
@@ -0,0 +1,525 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cloudflare Email Security API Emulator
+
+Local stand-in for the endpoints this toolkit uses, for load and performance testing
+without touching production. Generates a synthetic mailbox and serves:
+
+    GET  /investigate                      time/field/query filters, cursor paging, 1000-row page cap
+    POST /investigate/move                 bulk move (batch size capped)
+    POST /investigate/{id}/move
+    POST /investigate/{id}/reclassify
+    POST /investigate/release
+    GET  /investigate/{id}/raw             JSON {"result": {"raw": ...}} or message/rfc822 when asked
+    GET  /investigate/{id}/preview
+    GET  /investigate/{id}/trace
+    GET  /settings/allow_policies          paged; order=<field>&direction=asc|desc, ETag / If-None-Match
+    GET  /settings/block_senders           same; POST adds an entry (duplicate -> 400 code 4102)
+    GET  /settings/domains                 same
+
+Any path prefix is accepted, so the toolkit's normal URL layout works. Point every script
+at it with:
+
+    python CF_Emulator.py --port 8787 --messages 50000 --days 30 --latency-ms 40 --p429 0.01
+    set CF_API_BASE_URL=http://127.0.0.1:8787/client/v4/accounts/emulator/email-security
+
+(the credential variables must still be set, to any value). Faults: fixed + jittered
+latency, random 429 and 5xx responses, and a token-bucket rate limit that answers 429.
+"""
+
+import argparse
+import base64
+import bisect
+import hashlib
+import json
+import random
+import re
+import string
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# ---------------------------
+# CONFIG / TUNABLES
+# ---------------------------
+DEFAULT_PORT = 8787
+DEFAULT_MESSAGES = 50000
+DEFAULT_DAYS = 30
+INVESTIGATE_MAX_PER_PAGE = 1000
+MOVE_MAX_BATCH = 100
+BASE_PATH = "/client/v4/accounts/emulator/email-security"
+
+DISPOSITIONS = [("NONE", 0.80), ("BULK", 0.08), ("SPAM", 0.06), ("SUSPICIOUS", 0.03), ("SPOOF", 0.015), ("MALICIOUS", 0.015)]
+DESTINATIONS = {"Inbox", "JunkEmail", "DeletedItems", "RecoverableItemsDeletions", "RecoverableItemsPurges"}
+RECIPIENT_DOMAINS = ["exchange.asu.edu", "email.asu.edu", "mainex1.asu.edu", "asu.edu"]
+SUBJECT_WORDS = ["invoice", "payment", "urgent", "meeting", "update", "password", "reset", "account", "shared",
+                 "document", "review", "overdue", "newsletter", "order", "shipping", "security", "alert", "benefits"]
+
+# ---------------------------
+# Synthetic data (also used by CF_Bench)
+# ---------------------------
+def _postfix_id(rng):
+    return "".join(rng.choice(string.ascii_letters + string.digits) for _ in range(16))
+
+def _zipf_weights(n, s=1.1):
+    return [1.0 / (k ** s) for k in range(1, n + 1)]
+
+def _pick_disposition(rng):
+    x, acc = rng.random(), 0.0
+    for d, p in DISPOSITIONS:
+        acc += p
+        if x < acc:
+            return d
+    return "NONE"
+
+def synthetic_record(rng, ts, sender_domain, recipients):
+    """One investigate record shaped like the API's, with nested detections and recipients."""
+    disposition = _pick_disposition(rng)
+    user = rng.choice(["no-reply", "billing", "it", "hr", "info", "alerts"]) + str(rng.randint(1, 40))
+    sender = f"{user}@{sender_domain}"
+    pid = _postfix_id(rng)
+    quarantined = disposition in ("MALICIOUS", "SPOOF") or (disposition == "SPAM" and rng.random() < 0.5)
+    subject = " ".join(rng.choice(SUBJECT_WORDS) for _ in range(rng.randint(2, 6))).capitalize()
+    return {
+        "id": hashlib.sha1(pid.encode()).hexdigest(),
+        "postfix_id": pid,
+        "message_id": f"<{_postfix_id(rng).lower()}@{sender_domain}>",
+        "ts": ts.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+        "sent_date": (ts - timedelta(seconds=rng.randint(1, 120))).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "from": sender,
+        "from_name": user.title(),
+        "envelope_from": sender,
+        "to": list(recipients),
+        "to_name": [r.split("@")[0] for r in recipients],
+        "client_recipients": [r.split("@")[0] + "@" + rng.choice(RECIPIENT_DOMAINS[:3]) for r in recipients],
+        "envelope_to": list(recipients),
+        "subject": subject,
+        "final_disposition": disposition,
+        "is_quarantined": quarantined,
+        "is_phish_submission": False,
+        "delivery_mode": rng.choice(["DIRECT", "BCC", "API"]),
+        "threat_categories": [] if disposition == "NONE" else [disposition.lower()],
+        "detection_reasons": [] if disposition == "NONE" else [f"{disposition.title()} content detected", "Sender reputation"],
+        "findings": [] if disposition == "NONE" else [
+            {"name": "url", "value": f"https://{sender_domain}/{_postfix_id(rng).lower()}", "detection": disposition, "score": round(rng.random(), 3)},
+        ],
+        "validation": {"dkim": rng.choice(["pass", "fail", "none"]), "spf": rng.choice(["pass", "softfail", "none"]),
+                       "dmarc": rng.choice(["pass", "fail", "none"]), "comment": None},
+        "properties": {"allowlisted_pattern_type": None, "whitelisted_pattern_type": None,
+                       "scanned_at": ts.strftime("%Y-%m-%dT%H:%M:%SZ")},
+        "action_log": [],
+        "alert_id": None,
+        "edf_hash": None,
+        "htmltext_structure_hash": hashlib.md5(subject.encode()).hexdigest(),
+    }
+
+def generate_records(n=DEFAULT_MESSAGES, days=DEFAULT_DAYS, seed=1, distribution="diurnal", sender_domains=500,
+                     recipients=2000, end_dt=None):
+    """Sorted (oldest first) list of synthetic records spread over the last `days` days."""
+    rng = random.Random(seed)
+    end_dt = end_dt or datetime.now(timezone.utc)
+    span = days * 86400
+    domains = [f"sender{i}.example{'' if i % 3 else '-mail'}.com" for i in range(sender_domains)]
+    domain_weights = _zipf_weights(sender_domains)
+    mailboxes = [f"user{i}@asu.edu" for i in range(recipients)]
+    hour_weights = [0.2] * 7 + [1.0] * 11 + [0.5] * 6 if distribution == "diurnal" else [1.0] * 24
+
+    out = []
+    while len(out) < n:
+        ts = end_dt - timedelta(seconds=rng.random() * span)
+        if rng.random() > hour_weights[ts.hour]:
+            continue
+        dom = rng.choices(domains, domain_weights)[0]
+        rcpts = rng.sample(mailboxes, rng.choice([1, 1, 1, 2, 3]))
+        out.append(synthetic_record(rng, ts, dom, rcpts))
+    out.sort(key=lambda r: r["ts"])
+    return out
+
+def synthetic_allow_policies(n, seed=1):
+    """Allow policies mixing exact emails, domains, wildcard emails and bare wildcard patterns."""
+    rng = random.Random(seed + 7)
+    out = []
+    for i in range(n):
+        kind = rng.random()
+        if kind < 0.4:
+            p = {"pattern": f"sender{i}@partner{i % 97}.com", "pattern_type": "EMAIL"}
+        elif kind < 0.8:
+            p = {"pattern": f"partner{i}.com", "pattern_type": "DOMAIN"}
+        elif kind < 0.95:
+            p = {"pattern": f"*@news{i}.example.org", "pattern_type": "EMAIL"}
+        else:
+            p = {"pattern": f"*mailer{i}*", "pattern_type": "UNKNOWN"}
+        p.update({"id": i + 1, "is_regex": False, "is_trusted_sender": rng.random() < 0.3, "is_exempt_recipient": False,
+                  "comments": "seed", "last_modified": "2025-01-01T00:00:00Z"})
+        out.append(p)
+    return out
+
+def synthetic_domains(n):
+    return [{"id": i + 1, "domain": f"dept{i}.asu.edu" if i else "asu.edu", "allowed_delivery_modes": ["DIRECT"],
+             "transport": "smtp", "inbox_provider": "Microsoft", "dmarc_status": "good", "spf_status": "good",
+             "drop_dispositions": ["MALICIOUS"], "last_modified": "2025-01-01T00:00:00Z"} for i in range(n)]
+
+def _png(width=320, height=240, seed=0):
+    """A small valid grey PNG, used for preview screenshots."""
+    shade = 96 + seed % 128
+    raw = b"".join(b"\x00" + bytes([shade]) * width for _ in range(height))
+
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw)) + chunk(b"IEND", b""))
+
+def _raw_eml(rec):
+    url = rec["findings"][0]["value"] if rec["findings"] else f"https://{rec['from'].split('@')[1]}/news"
+    attachment = base64.b64encode(("attachment for " + rec["postfix_id"]).encode()).decode()
+    return (
+        f"Received: from mx.{rec['from'].split('@')[1]} (mx [192.0.2.10]) by mx.cloudflare.net; {rec['sent_date']}\r\n"
+        f"Received: from internal (internal [10.0.0.1]) by mx.{rec['from'].split('@')[1]}; {rec['sent_date']}\r\n"
+        f"Authentication-Results: mx.cloudflare.net; dkim={rec['validation']['dkim']}; spf={rec['validation']['spf']}; dmarc={rec['validation']['dmarc']}\r\n"
+        f"From: {rec['from_name']} <{rec['from']}>\r\n"
+        f"To: {', '.join(rec['to'])}\r\n"
+        f"Subject: {rec['subject']}\r\n"
+        f"Message-ID: {rec['message_id']}\r\n"
+        f"Date: {rec['sent_date']}\r\n"
+        "MIME-Version: 1.0\r\n"
+        "Content-Type: multipart/mixed; boundary=\"b1\"\r\n\r\n"
+        "--b1\r\nContent-Type: text/html; charset=utf-8\r\n\r\n"
+        f"<html><body><p>{rec['subject']}</p><a href=\"{url}\">Open</a></body></html>\r\n"
+        "--b1\r\nContent-Type: application/pdf; name=\"doc.pdf\"\r\nContent-Disposition: attachment; filename=\"doc.pdf\"\r\n"
+        f"Content-Transfer-Encoding: base64\r\n\r\n{attachment}\r\n--b1--\r\n"
+    )
+
+# ---------------------------
+# Emulator state
+# ---------------------------
+class EmulatorState:
+    def __init__(self, messages=DEFAULT_MESSAGES, days=DEFAULT_DAYS, seed=1, distribution="diurnal",
+                 latency_ms=0.0, jitter_ms=0.0, p429=0.0, p5xx=0.0, rps=0.0, reclassify_accept=0.3,
+                 raw_retention_hours=0.0, allow_policies=2000, block_senders=500, domains=50, screenshot_px=320):
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.records = generate_records(messages, days, seed, distribution)
+        self.ts_keys = [r["ts"] for r in self.records]
+        self.by_postfix = {r["postfix_id"]: r for r in self.records}
+        self.latency_ms, self.jitter_ms = latency_ms, jitter_ms
+        self.p429, self.p5xx = p429, p5xx
+        self.rps = rps
+        self._tokens, self._last = rps, time.monotonic()
+        self.reclassify_accept = reclassify_accept
+        self.raw_retention_hours = raw_retention_hours
+        self.screenshot_px = screenshot_px
+        self.moves = {}
+        self.released = set()
+        self.allow_policies = synthetic_allow_policies(allow_policies, seed)
+        self.block_senders = [{"id": i + 1, "pattern": f"blocked{i}.example.net", "pattern_type": "DOMAIN", "is_regex": False,
+                               "comments": "seed", "created_at": "2025-01-01T00:00:00Z", "last_modified": "2025-01-01T00:00:00Z"}
+                              for i in range(block_senders)]
+        self.domains = synthetic_domains(domains)
+        self.stats = {"requests": 0, "injected_429": 0, "injected_5xx": 0, "rate_limited": 0}
+
+    # ---- faults ----
+    def admit(self):
+        """Return an injected (status, body) or None to serve the request normally."""
+        with self.lock:
+            self.stats["requests"] += 1
+            if self.rps > 0:
+                now = time.monotonic()
+                self._tokens = min(self.rps, self._tokens + (now - self._last) * self.rps)
+                self._last = now
+                if self._tokens < 1:
+                    self.stats["rate_limited"] += 1
+                    return 429, {"success": False, "errors": [{"code": 10000, "message": "rate limited"}]}
+                self._tokens -= 1
+            roll = self.rng.random()
+        delay = self.latency_ms + (random.random() * self.jitter_ms if self.jitter_ms else 0)
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+        if roll < self.p429:
+            self.stats["injected_429"] += 1
+            return 429, {"success": False, "errors": [{"code": 10000, "message": "injected 429"}]}
+        if roll < self.p429 + self.p5xx:
+            self.stats["injected_5xx"] += 1
+            return 503, {"success": False, "errors": [{"code": 10001, "message": "injected 5xx"}]}
+        return None
+
+    # ---- investigate ----
+    def investigate(self, qs):
+        per_page = min(int(qs.get("per_page", INVESTIGATE_MAX_PER_PAGE)), INVESTIGATE_MAX_PER_PAGE)
+        lo = bisect.bisect_left(self.ts_keys, _norm_ts(qs.get("start"))) if qs.get("start") else 0
+        hi = bisect.bisect_left(self.ts_keys, _norm_ts(qs.get("end"))) if qs.get("end") else len(self.ts_keys)
+        match = _matcher(qs)
+        hits = [r for r in self.records[lo:hi] if match(r)]
+        offset = int(qs.get("cursor") or 0)
+        page = hits[offset:offset + per_page]
+        nxt = str(offset + per_page) if offset + per_page < len(hits) else None
+        return {"success": True, "errors": [], "result": page,
+                "result_info": {"count": len(page), "per_page": per_page, "total_count": len(hits), "next": nxt}}
+
+    def move(self, postfix_ids, destination):
+        if destination not in DESTINATIONS:
+            return 400, {"success": False, "errors": [{"code": 1003, "message": f"invalid destination {destination}"}]}
+        if len(postfix_ids) > MOVE_MAX_BATCH:
+            return 400, {"success": False, "errors": [{"code": 1004, "message": f"at most {MOVE_MAX_BATCH} postfix_ids per request"}]}
+        bad = [p for p in postfix_ids if p not in self.by_postfix]
+        if bad:
+            return 400, {"success": False, "errors": [{"code": 1002, "message": f"unknown postfix_id {bad[0]}"}]}
+        now = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        result = []
+        for pid in postfix_ids:
+            rec = self.by_postfix[pid]
+            self.moves[pid] = destination
+            for rcpt in rec["client_recipients"]:
+                result.append({"completed_timestamp": now, "success": True, "message_id": rec["message_id"], "recipient": rcpt,
+                               "operation": "MOVE", "status": "OK", "destination": destination, "item_count": 1})
+        return 200, {"success": True, "errors": [], "result": result}
+
+    def reclassify(self, pid, body):
+        if pid not in self.by_postfix:
+            return 404, {"success": False, "errors": [{"code": 1002, "message": "message not found"}]}
+        if self.raw_retention_hours:
+            age = datetime.now(timezone.utc) - datetime.fromisoformat(self.by_postfix[pid]["ts"].replace("Z", "+00:00"))
+            if age > timedelta(hours=self.raw_retention_hours):
+                return 400, {"success": False, "errors": [{"code": 1100, "message": "raw message no longer retained"}]}
+        # deterministic per message, so repeated runs see the same rejections
+        h = int(hashlib.sha1(pid.encode()).hexdigest()[:8], 16) / 0xffffffff
+        if h < self.reclassify_accept:
+            return 202, {"success": True, "errors": [], "result": {}}
+        # with a retention window, 1100 means only that: the message aged out of it
+        code = 1100 if h < 0.7 and not self.raw_retention_hours else 1101
+        msg = "raw message no longer retained" if code == 1100 else "message not eligible for reclassification"
+        return 400, {"success": False, "errors": [{"code": code, "message": msg}]}
+
+    def release(self, postfix_ids):
+        if len(postfix_ids) > MOVE_MAX_BATCH:
+            return 413, {"success": False, "errors": [{"code": 1004, "message": f"at most {MOVE_MAX_BATCH} postfix_ids per request"}]}
+        result = []
+        for pid in postfix_ids:
+            rec = self.by_postfix.get(pid)
+            if rec is None:
+                result.append({"postfix_id": pid, "id": None, "delivered": [], "failed": [pid], "undelivered": []})
+                continue
+            self.released.add(pid)
+            result.append({"postfix_id": pid, "id": rec["id"], "delivered": list(rec["to"]), "failed": [], "undelivered": []})
+        return 200, {"success": True, "errors": [], "result": result}
+
+    def trace(self, pid):
+        rec = self.by_postfix.get(pid)
+        if rec is None:
+            return 404, {"success": False, "errors": [{"code": 1002, "message": "message not found"}]}
+        rng = random.Random(pid)
+        t = datetime.strptime(rec["ts"], "%Y-%m-%dT%H:%M:%S.%fZ")
+        lines = []
+        for i, step in enumerate(["connection accepted", "message received", "scan complete", "queued for delivery", "delivered to mailbox"], start=1):
+            lines.append({"lineno": i, "message": f"{step} ({rec['postfix_id']})", "ts": t.strftime("%Y-%m-%dT%H:%M:%S.%fZ")})
+            t += timedelta(milliseconds=rng.expovariate(1 / (200 if i != 3 else 1500)))
+        return 200, {"success": True, "errors": [], "result": {"inbound": {"lines": lines, "pending": False},
+                                                               "outbound": {"lines": [], "pending": False}}}
+
+    def paged(self, items, qs):
+        page = max(1, int(qs.get("page", 1)))
+        per_page = max(1, min(int(qs.get("per_page", 20)), INVESTIGATE_MAX_PER_PAGE))
+        chunk = items[(page - 1) * per_page: page * per_page]
+        return 200, {"success": True, "errors": [], "result": chunk,
+                     "result_info": {"page": page, "per_page": per_page, "count": len(chunk), "total_count": len(items)}}
+
+    def settings(self, name, qs, if_none_match=None):
+        """(status, body, headers) for a settings list page; 304 when the list is unchanged since the client's ETag."""
+        with self.lock:
+            items = list(getattr(self, name))
+        etag = f'W/"{len(items)}-{max((i.get("last_modified") or "" for i in items), default="")}"'
+        if if_none_match and if_none_match == etag:
+            return 304, b"", {"ETag": etag}
+        order = qs.get("order")
+        if order:
+            items.sort(key=lambda i: str(i.get(order) or ""), reverse=qs.get("direction") == "desc")
+        status, body = self.paged(items, qs)
+        return status, body, {"ETag": etag}
+
+def _norm_ts(s):
+    # record ts strings compare lexically; normalize the request's ISO format to the same shape
+    try:
+        dt = datetime.fromisoformat(s.replace("Z", "+00:00")).astimezone(timezone.utc)
+        return dt.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    except Exception:
+        return s
+
+def _matcher(qs):
+    if qs.get("query"):
+        terms = qs["query"].lower().split()
+        return lambda r: all(t in " ".join([r["from"], r["from_name"], " ".join(r["to"]), r["subject"], r["message_id"], r["postfix_id"]]).lower() for t in terms)
+    checks = []
+    if qs.get("sender"):
+        s = qs["sender"].lower()
+        checks.append(lambda r: s in r["from"].lower())
+    if qs.get("recipient"):
+        rc = qs["recipient"].lower()
+        checks.append(lambda r: any(rc in x.lower() for x in r["to"] + r["client_recipients"]))
+    if qs.get("domain"):
+        d = qs["domain"].lower()
+        checks.append(lambda r: r["from"].lower().split("@")[-1] == d or r["from"].lower().endswith("." + d))
+    if qs.get("subject"):
+        sub = qs["subject"].lower()
+        checks.append(lambda r: sub in r["subject"].lower())
+    return lambda r: all(c(r) for c in checks)
+
+# ---------------------------
+# HTTP layer
+# ---------------------------
+_ROUTES = [
+    ("GET", re.compile(r"/investigate/?$"), "investigate"),
+    ("POST", re.compile(r"/investigate/move/?$"), "bulk_move"),
+    ("POST", re.compile(r"/investigate/release/?$"), "release"),
+    ("POST", re.compile(r"/investigate/([^/]+)/move/?$"), "single_move"),
+    ("POST", re.compile(r"/investigate/([^/]+)/reclassify/?$"), "reclassify"),
+    ("GET", re.compile(r"/investigate/([^/]+)/raw/?$"), "raw"),
+    ("GET", re.compile(r"/investigate/([^/]+)/preview/?$"), "preview"),
+    ("GET", re.compile(r"/investigate/([^/]+)/trace/?$"), "trace"),
+    ("GET", re.compile(r"/settings/(allow_policies|block_senders|domains)/?$"), "settings"),
+    ("POST", re.compile(r"/settings/block_senders/?$"), "add_block"),
+]
+
+class EmulatorHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None   # set by make_server
+    quiet = True
+
+    def log_message(self, fmt, *args):
+        if not self.quiet:
+            super().log_message(fmt, *args)
+
+    def _send(self, status, body, content_type="application/json", headers=None):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+        if "gzip" in (self.headers.get("Accept-Encoding") or "") and len(data) > 1024:
+            import gzip
+            data = gzip.compress(data, compresslevel=1)
+            self.send_response(status)
+            self.send_header("Content-Encoding", "gzip")
+        else:
+            self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        if status == 429:
+            self.send_header("Retry-After", "1")
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        n = int(self.headers.get("Content-Length") or 0)
+        if not n:
+            return None
+        try:
+            return json.loads(self.rfile.read(n))
+        except ValueError:
+            return None
+
+    def _dispatch(self, method):
+        parsed = urlparse(self.path)
+        qs = {k: v[-1] for k, v in parse_qs(parsed.query).items()}
+        body = self._body() if method == "POST" else None
+        for m, rx, name in _ROUTES:
+            if m != method:
+                continue
+            hit = rx.search(parsed.path)
+            if hit:
+                break
+        else:
+            return self._send(404, {"success": False, "errors": [{"code": 7003, "message": "no route"}]})
+
+        fault = self.state.admit()
+        if fault:
+            return self._send(*fault)
+
+        st = self.state
+        if name == "investigate":
+            return self._send(200, st.investigate(qs))
+        if name == "bulk_move":
+            body = body or {}
+            return self._send(*st.move(list(body.get("postfix_ids") or []), body.get("destination")))
+        if name == "single_move":
+            return self._send(*st.move([hit.group(1)], (body or {}).get("destination")))
+        if name == "reclassify":
+            return self._send(*st.reclassify(hit.group(1), body))
+        if name == "release":
+            ids = body if isinstance(body, list) else (body or {}).get("postfix_ids") or []
+            return self._send(*st.release(ids))
+        if name in ("raw", "preview", "trace"):
+            rec = st.by_postfix.get(hit.group(1))
+            if rec is None:
+                return self._send(404, {"success": False, "errors": [{"code": 1002, "message": "message not found"}]})
+            if name == "raw":
+                eml = _raw_eml(rec)
+                if "message/rfc822" in (self.headers.get("Accept") or ""):
+                    return self._send(200, eml.encode("utf-8"), "message/rfc822")
+                return self._send(200, {"success": True, "errors": [], "result": {"raw": eml}})
+            if name == "preview":
+                png = _png(st.screenshot_px, st.screenshot_px * 3 // 4, seed=len(rec["postfix_id"]) + ord(rec["postfix_id"][0]))
+                return self._send(200, {"success": True, "errors": [], "result": {"screenshot": base64.b64encode(png).decode()}})
+            return self._send(*st.trace(hit.group(1)))
+        if name == "settings":
+            status, body, headers = st.settings(hit.group(1), qs, self.headers.get("If-None-Match"))
+            return self._send(status, body, headers=headers)
+        if name == "add_block":
+            body = body or {}
+            with st.lock:
+                if any(b["pattern"] == body.get("pattern") for b in st.block_senders):
+                    return self._send(400, {"success": False, "errors": [{"code": 4102, "message": "pattern already exists"}]})
+                entry = dict(body, id=len(st.block_senders) + 1,
+                             created_at=datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"))
+                entry["last_modified"] = entry["created_at"]
+                st.block_senders.append(entry)
+            return self._send(201, {"success": True, "errors": [], "result": entry})
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+def make_server(host="127.0.0.1", port=DEFAULT_PORT, quiet=True, **state_opts):
+    handler = type("BoundEmulatorHandler", (EmulatorHandler,), {"state": EmulatorState(**state_opts), "quiet": quiet})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+def start_in_thread(host="127.0.0.1", port=0, **state_opts):
+    """Start an emulator on a background thread. Returns (server, base_url); call server.shutdown() to stop."""
+    server = make_server(host, port, **state_opts)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}{BASE_PATH}"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Local emulator of the Cloudflare Email Security API for load and performance testing.')
+    parser.add_argument('--host', action='store', dest='host', default='127.0.0.1', help='Address to listen on. Default: 127.0.0.1')
+    parser.add_argument('--port', action='store', dest='port', type=int, default=DEFAULT_PORT, help='Port to listen on. Default: 8787')
+    parser.add_argument('--messages', action='store', dest='messages', type=int, default=DEFAULT_MESSAGES, help='Number of synthetic messages. Default: 50000')
+    parser.add_argument('--days', action='store', dest='days', type=int, default=DEFAULT_DAYS, help='Days of history to spread them over. Default: 30')
+    parser.add_argument('--distribution', action='store', dest='distribution', choices=['diurnal', 'uniform'], default='diurnal', help='Time-of-day distribution of messages.')
+    parser.add_argument('--seed', action='store', dest='seed', type=int, default=1, help='Random seed for the synthetic data.')
+    parser.add_argument('--latency-ms', action='store', dest='latency_ms', type=float, default=0.0, help='Fixed latency added to every response.')
+    parser.add_argument('--jitter-ms', action='store', dest='jitter_ms', type=float, default=0.0, help='Random extra latency, uniform in [0, jitter].')
+    parser.add_argument('--p429', action='store', dest='p429', type=float, default=0.0, help='Probability of an injected 429 response.')
+    parser.add_argument('--p5xx', action='store', dest='p5xx', type=float, default=0.0, help='Probability of an injected 503 response.')
+    parser.add_argument('--rps', action='store', dest='rps', type=float, default=0.0, help='Rate limit in requests per second (0 = unlimited); excess requests get 429.')
+    parser.add_argument('--reclassify-accept', action='store', dest='reclassify_accept', type=float, default=0.3, help='Fraction of messages that accept reclassification.')
+    parser.add_argument('--raw-retention-hours', action='store', dest='raw_retention_hours', type=float, default=0.0, help='Reject reclassification of messages older than this with code 1100 (0 = by hash only).')
+    parser.add_argument('--allow-policies', action='store', dest='allow_policies', type=int, default=2000, help='Number of synthetic allow policies.')
+    parser.add_argument('-v', '--verbose', action='store_true', dest='verbose', help='Log every request.')
+    args = parser.parse_args()
+
+    print(f"[emulator] generating {args.messages} messages over {args.days} days...")
+    server = make_server(args.host, args.port, quiet=not args.verbose, messages=args.messages, days=args.days, seed=args.seed,
+                         distribution=args.distribution, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, p429=args.p429,
+                         p5xx=args.p5xx, rps=args.rps, reclassify_accept=args.reclassify_accept,
+                         raw_retention_hours=args.raw_retention_hours, allow_policies=args.allow_policies)
+    print(f"[emulator] listening. Point the toolkit at it with:\n    CF_API_BASE_URL=http://{args.host}:{args.port}{BASE_PATH}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n[emulator] stopped. stats={server.RequestHandlerClass.state.stats}")
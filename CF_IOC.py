@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cloudflare EML Parsing and IOC Table
+
+Parses raw messages (the store 'CFTools.py raw' fills, see CF_RAWMESSAGE.py, or loose .eml
+files) across a process pool and writes what analysts pull out by hand to a SQLite table:
+
+    messages  postfix_id, file sha256, Message-ID, sender, subject, date, Received hops,
+              SPF / DKIM / DMARC results
+    iocs      (kind, value, postfix_id, detail) for kind in
+              url       every http(s) URL in the text and HTML parts
+              domain    URL hosts, the From / Reply-To / Return-Path domains
+              ip        addresses in the Received headers
+              email     From, Reply-To and Return-Path addresses
+              sha256    attachment hashes (detail: filename)
+
+The iocs primary key starts with (kind, value), so "which other messages share this URL /
+hash" is one index range scan: pivot(). Each distinct file is parsed once, in a worker
+process (parse_eml_file), and only the small result dict comes back to the parent, which
+writes it in batched transactions. Messages already in the table with the same file hash
+are skipped on later runs. The pool forks, except when other threads are running (inside
+the daemon): forking a multi-threaded process can copy a lock another thread holds, so the
+workers are spawned then.
+
+Domains, addresses and IPs are stored lower-cased; URLs (paths and queries are
+case-sensitive) and hashes as they are.
+"""
+
+import email
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from email import policy
+from email.utils import getaddresses, parseaddr
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import CFScriptConfig as CFG
+import CF_RAWMESSAGE as CFRaw
+
+_URL_RE = re.compile(r"""https?://[^\s"'<>()\[\]{}]+""", re.IGNORECASE)
+_IP_RE = re.compile(r"\[(\d{1,3}(?:\.\d{1,3}){3}|[0-9a-fA-F:]*:[0-9a-fA-F:]+)\]")
+_RECEIVED_RE = re.compile(r"from\s+(?P<from>\S+).*?\bby\s+(?P<by>[^\s;]+)(?:.*;\s*(?P<date>.+))?", re.IGNORECASE | re.DOTALL)
+_AUTH_RE = re.compile(r"\b(spf|dkim|dmarc)=(\w+)", re.IGNORECASE)
+WRITE_BATCH = 500   # parsed messages per database transaction
+LOWERED_KINDS = frozenset({"domain", "email", "ip"})   # stored lower-cased; pivot() lower-cases these only
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    postfix_id TEXT PRIMARY KEY,
+    sha256 TEXT,
+    message_id TEXT,
+    sender TEXT,
+    subject TEXT,
+    date TEXT,
+    received TEXT,
+    spf TEXT,
+    dkim TEXT,
+    dmarc TEXT
+);
+CREATE TABLE IF NOT EXISTS iocs (
+    kind TEXT,
+    value TEXT,
+    postfix_id TEXT,
+    detail TEXT,
+    PRIMARY KEY (kind, value, postfix_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_iocs_postfix_id ON iocs(postfix_id);
+CREATE INDEX IF NOT EXISTS idx_messages_sha256 ON messages(sha256);
+"""
+
+# ---------------------------
+# Parsing (runs in the worker processes)
+# ---------------------------
+def _domain(address):
+    return address.rsplit("@", 1)[1].lower() if "@" in address else ""
+
+def _urls(text):
+    for m in _URL_RE.finditer(text):
+        yield m.group(0).rstrip(".,;:!?'\"")
+
+def parse_eml_file(path):
+    """Headers, Received hops, auth results and IOCs of one .eml file, as a plain dict."""
+    with open(path, "rb") as f:
+        msg = email.message_from_binary_file(f, policy=policy.default)
+
+    def header(name):
+        try:
+            return str(msg.get(name) or "")
+        except Exception:      # a header too malformed for the policy to parse
+            return ""
+
+    iocs = set()
+    sender = parseaddr(header("From"))[1].lower()
+    for name in ("From", "Reply-To", "Return-Path"):
+        for _, addr in getaddresses([header(name)]):
+            addr = addr.lower().strip("<>")
+            if "@" in addr:
+                iocs.add(("email", addr, name.lower()))
+                iocs.add(("domain", _domain(addr), name.lower()))
+
+    hops = []
+    for value in msg.get_all("Received") or []:
+        value = " ".join(str(value).split())
+        m = _RECEIVED_RE.search(value)
+        hops.append({"from": m.group("from") if m else None, "by": m.group("by") if m else None,
+                     "date": (m.group("date") or "").strip() if m else None})
+        for ip in _IP_RE.findall(value):
+            iocs.add(("ip", ip.lower(), "received"))
+
+    auth = {}
+    for value in msg.get_all("Authentication-Results") or []:
+        for key, result in _AUTH_RE.findall(str(value)):
+            auth.setdefault(key.lower(), result.lower())
+
+    for part in msg.walk():
+        if part.is_multipart():
+            continue
+        filename = part.get_filename()
+        if filename or part.get_content_disposition() == "attachment":
+            payload = part.get_payload(decode=True) or b""
+            iocs.add(("sha256", hashlib.sha256(payload).hexdigest(), filename or part.get_content_type()))
+        elif part.get_content_maintype() == "text":
+            try:
+                text = part.get_content()
+            except Exception:
+                text = (part.get_payload(decode=True) or b"").decode("utf-8", errors="replace")
+            for url in _urls(text):
+                iocs.add(("url", url, part.get_content_subtype()))
+                host = (urlsplit(url).hostname or "").lower()
+                if host:
+                    iocs.add(("domain", host, "url"))
+
+    return {"message_id": header("Message-ID").strip(), "sender": sender, "subject": header("Subject"),
+            "date": header("Date"), "received": hops, "spf": auth.get("spf"), "dkim": auth.get("dkim"),
+            "dmarc": auth.get("dmarc"), "iocs": sorted(iocs)}
+
+def _parse_job(item):
+    sha256, path = item
+    try:
+        return sha256, parse_eml_file(path), None
+    except Exception as e:
+        return sha256, None, f"{type(e).__name__}: {e}"
+
+# ---------------------------
+# IOC database
+# ---------------------------
+def connect(db_path):
+    db = sqlite3.connect(str(db_path))
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.executescript(_SCHEMA)
+    return db
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CFG.RAW_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def manifest_entries(store_dir, postfix_ids=None):
+    """(postfix_id, sha256, path) for the messages in a CF_RAWMESSAGE store, optionally only postfix_ids."""
+    store = CFRaw.RawStore(store_dir)
+    wanted = set(postfix_ids) if postfix_ids is not None else None
+    return [(pid, sha256, store.object_path(sha256)) for pid, sha256 in store.stored_ids().items()
+            if wanted is None or pid in wanted]
+
+def file_entries(paths):
+    """(postfix_id, sha256, path) for loose .eml files (or directories of them); the file name is the key."""
+    out = []
+    for p in map(Path, paths):
+        for f in (sorted(p.rglob("*.eml")) if p.is_dir() else [p]):
+            out.append((f.stem, _file_sha256(f), f))
+    return out
+
+def index_messages(entries, db_path, workers=CFG.IOC_WORKERS, reparse=False):
+    """Parse the (postfix_id, sha256, path) entries across a process pool into the IOC database.
+    Returns {"parsed", "messages", "skipped", "failed"} counts."""
+    db = connect(db_path)
+    known = {} if reparse else dict(db.execute("SELECT postfix_id, sha256 FROM messages").fetchall())
+    todo = [(pid, sha, path) for pid, sha, path in entries if known.get(pid) != sha]
+    by_sha = {}
+    for pid, sha, path in todo:
+        by_sha.setdefault(sha, (path, []))[1].append(pid)
+    counts = {"parsed": 0, "messages": 0, "skipped": len(entries) - len(todo), "failed": 0}
+    print(f"[info] {len(entries)} messages; {counts['skipped']} already indexed, parsing {len(by_sha)} distinct files")
+    if not by_sha:
+        db.close()
+        return counts
+
+    workers = workers or os.cpu_count() or 1
+    jobs = [(sha, str(path)) for sha, (path, _) in by_sha.items()]
+    chunksize = max(1, min(CFG.IOC_CHUNKSIZE, len(jobs) // (workers * 4) or 1))
+    pending_msgs, pending_iocs = [], []
+
+    def flush():
+        with db:
+            pids = [(row[0],) for row in pending_msgs]
+            db.executemany("DELETE FROM iocs WHERE postfix_id = ?", pids)
+            db.executemany("INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", pending_msgs)
+            db.executemany("INSERT OR IGNORE INTO iocs VALUES (?, ?, ?, ?)", pending_iocs)
+        pending_msgs.clear()
+        pending_iocs.clear()
+
+    context = multiprocessing.get_context("spawn" if threading.active_count() > 1 else None)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        for sha, parsed, error in pool.map(_parse_job, jobs, chunksize=chunksize):
+            path, pids = by_sha[sha]
+            if parsed is None:
+                counts["failed"] += len(pids)
+                print(f"[error] could not parse {path}: {error}")
+                continue
+            counts["parsed"] += 1
+            for pid in pids:
+                pending_msgs.append((pid, sha, parsed["message_id"], parsed["sender"], parsed["subject"], parsed["date"],
+                                     json.dumps(parsed["received"]), parsed["spf"], parsed["dkim"], parsed["dmarc"]))
+                pending_iocs.extend((kind, value, pid, detail) for kind, value, detail in parsed["iocs"])
+                counts["messages"] += 1
+            if len(pending_msgs) >= WRITE_BATCH:
+                flush()
+    flush()
+    db.close()
+    print(f"[success] {counts['messages']} messages indexed from {counts['parsed']} files into {db_path}")
+    return counts
+
+# ---------------------------
+# Pivots
+# ---------------------------
+def pivot(db_path, value, kind=None):
+    """Every (kind, value, postfix_id, detail) whose IOC value is value (lower-cased for LOWERED_KINDS)."""
+    db = connect(db_path)
+    try:
+        q = "SELECT kind, value, postfix_id, detail FROM iocs WHERE kind = ? AND value = ?"
+        kinds = [kind] if kind else [k for (k,) in db.execute("SELECT DISTINCT kind FROM iocs")]
+        return [row for k in kinds for row in db.execute(q, (k, value.lower() if k in LOWERED_KINDS else value))]
+    finally:
+        db.close()
+
+def shared(db_path, limit=20):
+    """The IOCs seen in the most messages: (kind, value, message count)."""
+    db = connect(db_path)
+    try:
+        return db.execute("SELECT kind, value, COUNT(*) AS n FROM iocs GROUP BY kind, value HAVING n > 1 "
+                          "ORDER BY n DESC LIMIT ?", (limit,)).fetchall()
+    finally:
+        db.close()
+
+def print_pivot(rows, value):
+    if not rows:
+        print(f"[info] no message in the IOC table has {value!r}")
+        return
+    print(f"[info] {len({r[2] for r in rows})} messages share {value!r}:")
+    for kind, val, pid, detail in rows:
+        print(f"  {pid}  {kind:<7} {detail or ''}")
+
+def print_shared(rows):
+    if not rows:
+        print("[info] no IOC is shared by more than one message.")
+        return
+    print("\nMost shared IOCs:")
+    for kind, value, n in rows:
+        print(f"  {n:>6}  {kind:<7} {value}")
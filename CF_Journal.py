@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cloudflare Bulk Job Journal
+
+SQLite (WAL) record of every bulk action (move, purge, reclassify, release): one row per
+job with its parameters, one row per postfix ID with its state and the API's answer.
+
+    pending    not sent yet
+    in_flight  sent, no answer recorded (the run stopped while it was out)
+    done       accepted; response holds what the API returned for it
+    failed     rejected for good; error holds the API error
+
+A run that stops part way is picked up with '--resume JOB_ID' on the same command: only
+pending and in_flight items are sent again, with the job's original parameters.
+'CFTools.py jobs' lists recent jobs and their counts.
+
+State changes are buffered and written in one transaction every JOURNAL_FLUSH_ITEMS
+changes or JOURNAL_FLUSH_SECONDS, and on close(), so the journal stays off the hot loop.
+A hard crash can lose at most that last window of updates; those items are simply sent
+again on resume (moves and releases are idempotent).
+"""
+
+import json
+import secrets
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+import CFScriptConfig as CFG
+
+PENDING, IN_FLIGHT, DONE, FAILED = "pending", "in_flight", "done", "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    kind TEXT,
+    params TEXT,
+    status TEXT,
+    created REAL,
+    updated REAL
+);
+CREATE TABLE IF NOT EXISTS items (
+    job_id TEXT,
+    item TEXT,
+    seq INTEGER,
+    state TEXT,
+    attempts INTEGER DEFAULT 0,
+    response TEXT,
+    error TEXT,
+    updated REAL,
+    PRIMARY KEY (job_id, item)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_items_state ON items(job_id, state, seq);
+"""
+
+_lock = threading.RLock()
+_conn = None
+
+# ---------------------------
+# Connection
+# ---------------------------
+def _db():
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(str(CFG.JOURNAL_PATH), check_same_thread=False)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("PRAGMA synchronous=NORMAL")
+        _conn.executescript(_SCHEMA)
+    return _conn
+
+def _json(value):
+    return None if value is None else json.dumps(value, ensure_ascii=False, default=str)
+
+# ---------------------------
+# Jobs
+# ---------------------------
+class Job:
+    def __init__(self, job_id, kind, params, status="running"):
+        self.id = job_id
+        self.kind = kind
+        self.params = params
+        self.status = status
+        self._buffer = {}          # item -> (state, response, error, attempts_delta)
+        self._new = []             # items added since the last flush
+        self._seq = 0
+        self._last_flush = time.monotonic()
+        self._buf_lock = threading.Lock()
+        self._flush_lock = threading.Lock()    # one flush at a time, so updates land in order
+
+    # -- recording --------------------------------------------------------
+    def add(self, items):
+        """Register more items as pending (e.g. IDs a purge's search is still finding)."""
+        with self._buf_lock:
+            self._new.extend(items)
+        self._maybe_flush()
+
+    def in_flight(self, items):
+        self._set(items, IN_FLIGHT, attempt=1)
+
+    def done(self, item, response=None):
+        self._set([item], DONE, response=_json(response))
+
+    def failed(self, item, error):
+        self._set([item], FAILED, error=str(error))
+
+    def _set(self, items, state, response=None, error=None, attempt=0):
+        with self._buf_lock:
+            for item in items:
+                prev = self._buffer.get(item)
+                self._buffer[item] = (state, response, error, attempt + (prev[3] if prev else 0))
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if (len(self._buffer) + len(self._new) >= CFG.JOURNAL_FLUSH_ITEMS
+                or time.monotonic() - self._last_flush >= CFG.JOURNAL_FLUSH_SECONDS):
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._buf_lock:
+                buffer, self._buffer = self._buffer, {}
+                new, self._new = self._new, []
+                self._last_flush = time.monotonic()
+            if buffer or new:
+                self._write(buffer, new)
+
+    def _write(self, buffer, new):
+        now = time.time()
+        with _lock:
+            db = _db()
+            with db:
+                if new:
+                    start = self._next_seq(db, len(new))
+                    db.executemany("INSERT OR IGNORE INTO items (job_id, item, seq, state, updated) VALUES (?, ?, ?, ?, ?)",
+                                   [(self.id, item, start + i, PENDING, now) for i, item in enumerate(new)])
+                db.executemany("UPDATE items SET state = ?, response = COALESCE(?, response), error = ?, "
+                               "attempts = attempts + ?, updated = ? WHERE job_id = ? AND item = ?",
+                               [(state, response, error, attempts, now, self.id, item)
+                                for item, (state, response, error, attempts) in buffer.items()])
+                db.execute("UPDATE jobs SET updated = ? WHERE job_id = ?", (now, self.id))
+
+    def _next_seq(self, db, n):
+        if not self._seq:
+            self._seq = db.execute("SELECT COALESCE(MAX(seq), -1) + 1 FROM items WHERE job_id = ?", (self.id,)).fetchone()[0]
+        seq = self._seq
+        self._seq += n
+        return seq
+
+    def close(self, status=None):
+        """Flush, and set the job's final status: 'done' when nothing is left pending unless given."""
+        self.flush()
+        counts = self.counts()
+        self.status = status or ("done" if not counts.get(PENDING) and not counts.get(IN_FLIGHT) else "incomplete")
+        with _lock:
+            db = _db()
+            with db:
+                db.execute("UPDATE jobs SET status = ?, updated = ? WHERE job_id = ?", (self.status, time.time(), self.id))
+        return counts
+
+    # -- reading ----------------------------------------------------------
+    def remaining(self):
+        """Items still to send, in their original order (pending and in_flight)."""
+        self.flush()
+        with _lock:
+            rows = _db().execute("SELECT item, state FROM items WHERE job_id = ? AND state IN (?, ?) ORDER BY seq",
+                                 (self.id, PENDING, IN_FLIGHT)).fetchall()
+        interrupted = sum(1 for _, state in rows if state == IN_FLIGHT)
+        if interrupted:
+            print(f"[info] job {self.id}: {interrupted} item(s) were in flight when it stopped; sending them again")
+        return [item for item, _ in rows]
+
+    def counts(self):
+        with _lock:
+            rows = _db().execute("SELECT state, COUNT(*) FROM items WHERE job_id = ? GROUP BY state", (self.id,)).fetchall()
+        return dict(rows)
+
+    def failures(self):
+        with _lock:
+            return _db().execute("SELECT item, error FROM items WHERE job_id = ? AND state = ? ORDER BY seq",
+                                 (self.id, FAILED)).fetchall()
+
+def create(kind, params, items=()):
+    job_id = f"{kind}-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}-{secrets.token_hex(2)}"
+    now = time.time()
+    with _lock:
+        db = _db()
+        with db:
+            db.execute("INSERT INTO jobs (job_id, kind, params, status, created, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                       (job_id, kind, _json(params), "running", now, now))
+    job = Job(job_id, kind, params)
+    if items:
+        job.add(list(items))
+        job.flush()
+    print(f"[info] job {job_id} started; resume it with --resume {job_id}")
+    return job
+
+def open_job(job_id, kind=None):
+    """The journalled job; raises ValueError if it does not exist or is of another kind."""
+    with _lock:
+        row = _db().execute("SELECT kind, params, status FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+    if row is None:
+        raise ValueError(f"no job {job_id!r} in {CFG.JOURNAL_PATH}")
+    if kind is not None and row[0] != kind:
+        raise ValueError(f"job {job_id} is a {row[0]} job, not {kind}")
+    with _lock:
+        db = _db()
+        with db:
+            db.execute("UPDATE jobs SET status = 'running', updated = ? WHERE job_id = ?", (time.time(), job_id))
+    return Job(job_id, row[0], json.loads(row[1]) if row[1] else {}, "running")
+
+def list_jobs(limit=20):
+    with _lock:
+        db = _db()
+        jobs = db.execute("SELECT job_id, kind, status, created, updated FROM jobs ORDER BY created DESC LIMIT ?", (limit,)).fetchall()
+        out = []
+        for job_id, kind, status, created, updated in jobs:
+            counts = dict(db.execute("SELECT state, COUNT(*) FROM items WHERE job_id = ? GROUP BY state", (job_id,)).fetchall())
+            out.append({"job_id": job_id, "kind": kind, "status": status, "created": created, "updated": updated, "counts": counts})
+    return out
+
+def print_jobs(jobs):
+    if not jobs:
+        print("[info] no bulk jobs journalled yet.")
+        return
+    for j in jobs:
+        created = datetime.fromtimestamp(j["created"], timezone.utc).strftime("%Y-%m-%d %H:%M:%SZ")
+        c = j["counts"]
+        print(f"{j['job_id']:<40} {j['status']:<11} {created}  done={c.get(DONE, 0)} failed={c.get(FAILED, 0)} "
+              f"pending={c.get(PENDING, 0) + c.get(IN_FLIGHT, 0)}")
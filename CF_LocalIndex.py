@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cloudflare Local Message Index
+
+SQLite store fed by everything the search functions download (see
+CFFullSearch._feed_local_index). Keeps inverted indexes on sender, sender domain,
+recipients, subject tokens, message ID and time, plus the time windows that are
+known to be completely fetched for a given set of filters. 'CFTools.py local-search'
+answers the same filters as 'search' from here, and can fall back to the API for the
+parts of the window the index does not cover.
+"""
+
+import json
+import re
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+
+import CFFullSearch as CFSearch
+import CFScriptConfig as CFG
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    rid TEXT PRIMARY KEY,
+    postfix_id TEXT,
+    message_id TEXT,
+    ts REAL,
+    sender TEXT,
+    sender_domain_rev TEXT,
+    subject TEXT,
+    body TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_messages_ts ON messages(ts);
+CREATE INDEX IF NOT EXISTS idx_messages_sender ON messages(sender);
+CREATE INDEX IF NOT EXISTS idx_messages_domain ON messages(sender_domain_rev);
+CREATE INDEX IF NOT EXISTS idx_messages_message_id ON messages(message_id);
+CREATE INDEX IF NOT EXISTS idx_messages_postfix_id ON messages(postfix_id);
+CREATE TABLE IF NOT EXISTS recipients (
+    recipient TEXT,
+    rid TEXT,
+    PRIMARY KEY (recipient, rid)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS subject_tokens (
+    token TEXT,
+    rid TEXT,
+    PRIMARY KEY (token, rid)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS coverage (
+    filter_key TEXT,
+    start REAL,
+    end REAL
+);
+CREATE INDEX IF NOT EXISTS idx_coverage_key ON coverage(filter_key, start);
+"""
+
+_lock = threading.RLock()
+_conn = None
+
+# ---------------------------
+# Connection
+# ---------------------------
+def _db():
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(str(CFG.LOCAL_INDEX_PATH), check_same_thread=False)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("PRAGMA synchronous=NORMAL")
+        _conn.executescript(_SCHEMA)
+    return _conn
+
+def _reverse_domain(domain):
+    return ".".join(reversed(domain.lower().split("."))) if domain else ""
+
+def _normalize_message_id(mid):
+    return str(mid or "").strip().strip("<>").lower()
+
+def subject_tokens(subject):
+    return set(t.lower() for t in _TOKEN_RE.findall(subject or ""))
+
+# ---------------------------
+# Feeding the index
+# ---------------------------
+def add_records(records):
+    rows, rcpt_rows, token_rows = [], [], []
+    for rec in records:
+        if not isinstance(rec, dict):
+            continue
+        rid = CFSearch._get_record_id(rec)
+        ts = CFSearch.record_time(rec)
+        subject = CFSearch.record_subject(rec)
+        rows.append((
+            rid,
+            str(rec.get("postfix_id") or ""),
+            _normalize_message_id(rec.get("message_id")),
+            ts.timestamp() if ts else None,
+            CFSearch.record_sender(rec),
+            _reverse_domain(CFSearch.record_sender_domain(rec)),
+            subject,
+            json.dumps(rec, ensure_ascii=False, default=str),
+        ))
+        rcpt_rows.extend((r, rid) for r in CFSearch.record_recipients(rec))
+        token_rows.extend((t, rid) for t in subject_tokens(subject))
+    if not rows:
+        return 0
+    with _lock:
+        db = _db()
+        with db:
+            db.executemany("INSERT OR REPLACE INTO messages VALUES (?,?,?,?,?,?,?,?)", rows)
+            db.executemany("INSERT OR IGNORE INTO recipients VALUES (?,?)", rcpt_rows)
+            db.executemany("INSERT OR IGNORE INTO subject_tokens VALUES (?,?)", token_rows)
+    return len(rows)
+
+def mark_covered(fkey, start_dt, end_dt):
+    """Record that every message matching fkey in [start_dt, end_dt) is in the index; merges adjacent windows."""
+    s, e = start_dt.timestamp(), end_dt.timestamp()
+    with _lock:
+        db = _db()
+        with db:
+            overlapping = db.execute(
+                "SELECT rowid, start, end FROM coverage WHERE filter_key = ? AND start <= ? AND end >= ?",
+                (fkey, e, s)).fetchall()
+            for rowid, os_, oe in overlapping:
+                s, e = min(s, os_), max(e, oe)
+            db.executemany("DELETE FROM coverage WHERE rowid = ?", [(r[0],) for r in overlapping])
+            db.execute("INSERT INTO coverage VALUES (?,?,?)", (fkey, s, e))
+
+def _filters_subsume(stored_key, wanted):
+    # records fetched with fewer (or equal) filters are a superset of what a narrower search needs
+    stored = json.loads(stored_key)
+    return all(wanted.get(k) == v for k, v in stored.items())
+
+def uncovered_gaps(start_dt, end_dt, **filters):
+    """Return [(start_dt, end_dt), ...] inside the window that no stored coverage can answer for these filters."""
+    wanted = json.loads(CFSearch.filter_key(**filters))
+    s, e = start_dt.timestamp(), end_dt.timestamp()
+    with _lock:
+        keys = [r[0] for r in _db().execute("SELECT DISTINCT filter_key FROM coverage")]
+        usable = [k for k in keys if _filters_subsume(k, wanted)]
+        intervals = []
+        for k in usable:
+            intervals.extend(_db().execute(
+                "SELECT start, end FROM coverage WHERE filter_key = ? AND start < ? AND end > ?", (k, e, s)).fetchall())
+
+    gaps = []
+    cursor = s
+    for a, b in sorted(intervals):
+        if a > cursor:
+            gaps.append((cursor, a))
+        cursor = max(cursor, b)
+        if cursor >= e:
+            break
+    if cursor < e:
+        gaps.append((cursor, e))
+
+    tol = CFG.LOCAL_INDEX_GAP_TOLERANCE
+    return [(datetime.fromtimestamp(a, timezone.utc), datetime.fromtimestamp(b, timezone.utc))
+            for a, b in gaps if (b - a) > tol]
+
+# ---------------------------
+# Querying the index
+# ---------------------------
+def search(start_dt=None, end_dt=None, subject=None, sender=None, recipient=None, domain=None, query=None, message_id=None):
+    """
+    Answer a search from the index. Candidate rows come from the inverted indexes; every
+    candidate is then checked with CFFullSearch.compile_record_matcher, so results follow
+    the same rules as the watchlist/local filters. Subject words match at word starts.
+    """
+    where, params = [], []
+    if start_dt is not None:
+        where.append("m.ts >= ?")
+        params.append(start_dt.timestamp())
+    if end_dt is not None:
+        where.append("m.ts < ?")
+        params.append(end_dt.timestamp())
+
+    if message_id:
+        where.append("m.message_id = ?")
+        params.append(_normalize_message_id(message_id))
+        matcher = lambda rec: True
+    else:
+        matcher = CFSearch.compile_record_matcher(subject=subject, sender=sender, recipient=recipient, domain=domain, query=query)
+        if not query:
+            if sender:
+                snd = CFSearch._address_only(sender)
+                if CFSearch.is_full_address(snd):
+                    where.append("m.sender = ?")
+                    params.append(snd)
+            if domain:
+                rev = _reverse_domain(domain.lstrip("@"))
+                where.append("(m.sender_domain_rev = ? OR (m.sender_domain_rev >= ? AND m.sender_domain_rev < ?))")
+                params.extend([rev, rev + ".", rev + "/"])
+            if recipient:
+                rcp = CFSearch._address_only(recipient)
+                if CFSearch.is_full_address(rcp):
+                    where.append("m.rid IN (SELECT rid FROM recipients WHERE recipient = ?)")
+                    params.append(rcp)
+            if subject:
+                for tok in subject_tokens(subject):
+                    where.append("m.rid IN (SELECT rid FROM subject_tokens WHERE token >= ? AND token < ?)")
+                    params.extend([tok, tok + "\U0010ffff"])
+
+    sql = "SELECT m.body FROM messages m"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY m.ts"
+
+    out = []
+    with _lock:
+        rows = _db().execute(sql, params).fetchall()
+    for (body,) in rows:
+        rec = json.loads(body)
+        if matcher(rec):
+            out.append(rec)
+    return out
+
+def records_by_postfix_id(postfix_ids, chunk=500):
+    """{postfix_id: record} for the IDs the index has seen (one record per ID)."""
+    ids = [str(p) for p in postfix_ids if p]
+    out = {}
+    with _lock:
+        db = _db()
+        for i in range(0, len(ids), chunk):
+            part = ids[i:i + chunk]
+            rows = db.execute(f"SELECT postfix_id, body FROM messages WHERE postfix_id IN ({','.join('?' * len(part))})", part).fetchall()
+            for pid, body in rows:
+                out.setdefault(pid, json.loads(body))
+    return out
+
+def local_search(days=30, subject=None, sender=None, recipient=None, domain=None, query=None, message_id=None, fallback=False):
+    """
+    Search the index over the last `days` days. With fallback=True, windows the index does
+    not cover are fetched from the API first (which feeds the index), then the index answers.
+    Returns (items, meta).
+    """
+    filters = {"subject": subject, "sender": sender, "recipient": recipient, "domain": domain, "query": query}
+    meta = {"source": "local", "api_requests": 0, "gaps": []}
+
+    if message_id:
+        items = search(message_id=message_id)
+        if not items and fallback:
+            _, fmeta = CFSearch.fetch_by_message_id(message_id, per_page=CFG.PER_PAGE, preserve_duplicates=True)
+            meta["api_requests"] += fmeta.get("requests_made", 0)
+            meta["source"] = "local+api"
+            items = search(message_id=message_id)
+        return items, meta
+
+    end_dt = datetime.now(timezone.utc)
+    start_dt = end_dt - timedelta(days=int(days))
+    gaps = uncovered_gaps(start_dt, end_dt, **filters)
+
+    if gaps and fallback:
+        print(f"[local-search] index is missing {len(gaps)} window(s); fetching them from the API")
+        for a, b in gaps:
+            _, fmeta = CFSearch.fetch_all_by_time_divide_and_conquer(CFSearch._iso(a), CFSearch._iso(b), per_page=CFG.PER_PAGE, **filters)
+            meta["api_requests"] += fmeta.get("requests_made", 0)
+        meta["source"] = "local+api"
+        gaps = uncovered_gaps(start_dt, end_dt, **filters)
+
+    meta["gaps"] = [(CFSearch._iso(a), CFSearch._iso(b)) for a, b in gaps]
+    meta["complete"] = not gaps
+    return search(start_dt, end_dt, **filters), meta
+
+def stats():
+    with _lock:
+        db = _db()
+        return {
+            "messages": db.execute("SELECT COUNT(*) FROM messages").fetchone()[0],
+            "covered_windows": db.execute("SELECT COUNT(*) FROM coverage").fetchone()[0],
+        }
@@ -2,51 +2,221 @@
 """
 Created on Thu Dec  4 11:18:04 2025
 
+Cloudflare - Message Trace
+
+Run on its own it asks for one postfix_id and prints its trace. For a list of IDs
+('CFTools.py trace -i ids.csv', or collect_traces()), traces are fetched with
+CF_Pipeline.run_per_id. Each trace line becomes one normalized event in a JSONL file as its trace arrives:
+
+    {"postfix_id", "direction", "lineno", "ts", "step", "message", "from_step", "delta_s"}
+
+step is the line's text with IDs, numbers and parenthesised details removed, so the same
+stage of every message gets the same name. delta_s is the time since the last earlier line
+that had a timestamp, whose step is from_step (both None when there is none, or the line
+has no timestamp itself). In the same pass each delta goes into one CF_Metrics.Histogram
+per hop ("message received -> scan complete", from_step -> step) and the first-to-last time
+of each trace into an end-to-end histogram per direction; nothing else is kept. The summary table (count, mean, p50, p90, p99, max per hop) is printed and
+written to CSV.
+
 @author: rasmit10
 """
 
-import sys
+import csv
 import json
+import re
+import sys
+from datetime import datetime
+
 import requests
 
 import CFScriptConfig as CFG
+import CF_Decode as CFDecode
+import CF_Metrics as CFMetrics
+import CF_Pipeline as CFPipeline
+import CF_Profile as CFProfile
 
+# seconds; delivery stages range from sub-second scans to messages held for hours
+TRACE_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0, 7200.0, 21600.0, 86400.0)
+SUMMARY_FIELDS = ["scope", "direction", "step", "count", "mean_s", "p50_s", "p90_s", "p99_s", "max_s"]
 
-POSTFIX_ID = input("Enter postfix_id: ").strip()
-if not POSTFIX_ID:
-    print("No postfix_id entered. Exiting.")
-    sys.exit(0)
+_PAREN_RE = re.compile(r"\([^)]*\)|\[[^\]]*\]|<[^>]*>")
+_ID_RE = re.compile(r"\b(?=[0-9A-Za-z]*\d)[0-9A-Za-z]{10,}\b")
+_NUM_RE = re.compile(r"\d+")
 
-url = CFG.API_BASE_URL + f"/investigate/{POSTFIX_ID}/trace"
-headers = {
-    "X-Auth-Email": CFG.AUTH_EMAIL,
-    "X-Auth-Key": CFG.AUTH_KEY,
-    "Accept": "application/json",
-}
+# -----------------------------------------------------------
+# NORMALIZATION
+# -----------------------------------------------------------
+def step_name(message):
+    """A trace line's text without the per-message parts, e.g. 'delivered to mailbox (x1Y2...)' -> 'delivered to mailbox'."""
+    text = _PAREN_RE.sub(" ", str(message or ""))
+    text = _ID_RE.sub("<id>", text)
+    text = _NUM_RE.sub("#", text)
+    return " ".join(text.split()).lower()[:80] or "(empty)"
 
-print(f"\nRequesting trace for {POSTFIX_ID}...\n")
+def _parse_ts(value):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
 
-try:
-    resp = requests.get(url, headers=headers, timeout=CFG.TIMEOUT)
-except requests.RequestException as e:
-    print("Request error:", e)
-    sys.exit(1)
+def trace_events(postfix_id, result):
+    """(direction, pending, events) for each direction of a /trace result, in line order."""
+    for direction in ("inbound", "outbound"):
+        part = (result or {}).get(direction) or {}
+        lines = sorted(part.get("lines") or [], key=lambda l: (l.get("lineno") is None, l.get("lineno") or 0))
+        events, prev, prev_step = [], None, None   # the last line with a timestamp
+        for line in lines:
+            ts = _parse_ts(line.get("ts"))
+            step = step_name(line.get("message"))
+            timed = ts is not None and prev is not None
+            events.append({"postfix_id": postfix_id, "direction": direction, "lineno": line.get("lineno"),
+                           "ts": line.get("ts"), "step": step, "message": line.get("message"),
+                           "from_step": prev_step if timed else None,
+                           "delta_s": round((ts - prev).total_seconds(), 6) if timed else None})
+            if ts is not None:
+                prev, prev_step = ts, step
+        yield direction, bool(part.get("pending")), events
+
+# -----------------------------------------------------------
+# STREAMING AGGREGATION
+# -----------------------------------------------------------
+class TraceStats:
+    """Per-hop and end-to-end latency histograms, updated one trace at a time."""
+
+    def __init__(self):
+        self.hops = {}          # (direction, "a -> b") -> Histogram
+        self.end_to_end = {}    # direction -> Histogram
+        self.messages = 0       # postfix IDs with trace lines
+        self.directions = 0     # inbound / outbound traces with lines (up to two per message)
+        self.pending = 0
+        self.empty = 0          # postfix IDs without any trace line
+
+    def _hist(self, table, key):
+        if key not in table:
+            table[key] = CFMetrics.Histogram(TRACE_BUCKETS)
+        return table[key]
+
+    def add(self, direction, pending, events):
+        if not events:
+            return
+        self.directions += 1
+        self.pending += pending
+        for ev in events:
+            if ev["delta_s"] is not None:
+                self._hist(self.hops, (direction, f"{ev['from_step']} -> {ev['step']}")).observe(max(0.0, ev["delta_s"]))
+        stamps = [ts for ts in (_parse_ts(ev["ts"]) for ev in events) if ts]
+        if len(stamps) > 1:
+            self._hist(self.end_to_end, direction).observe(max(0.0, (stamps[-1] - stamps[0]).total_seconds()))
+
+    def rows(self):
+        def row(scope, direction, step, h):
+            q = {p: h.quantile(p) for p in (0.5, 0.9, 0.99)}
+            return {"scope": scope, "direction": direction, "step": step, "count": h.n,
+                    "mean_s": round(h.total / h.n, 3) if h.n else None, "p50_s": q[0.5], "p90_s": q[0.9],
+                    "p99_s": q[0.99], "max_s": round(h.max, 3)}
+        out = [row("end_to_end", d, "first -> last line", h) for d, h in sorted(self.end_to_end.items())]
+        out += [row("hop", d, step, h) for (d, step), h in sorted(self.hops.items(), key=lambda kv: -kv[1].total)]
+        return out
+
+def print_summary(stats, rows):
+    print(f"\n=== TRACE SUMMARY ({stats.messages} messages, {stats.directions} inbound/outbound traces, "
+          f"{stats.pending} still pending) ===")
+    print("Latency quantiles are histogram bucket upper bounds, in seconds.\n")
+    print(f"{'scope':<11} {'dir':<8} {'count':>6} {'mean':>9} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>9}  step")
+    for r in rows:
+        print(f"{r['scope']:<11} {r['direction']:<8} {r['count']:>6} {r['mean_s']:>9} {r['p50_s']:>8} {r['p90_s']:>8} "
+              f"{r['p99_s']:>8} {r['max_s']:>9}  {r['step']}")
+
+# -----------------------------------------------------------
+# BULK COLLECTION
+# -----------------------------------------------------------
+def _decode_trace(pid, resp):
+    with CFProfile.span("decode"):
+        try:
+            parsed = CFDecode.decode_response(resp)
+        except ValueError as e:
+            return CFPipeline.BatchOutcome(False, error=f"JSON decode error: {e}; body: {resp.text[:300]}", status=200)
+    return CFPipeline.outcome_from_response(resp, parsed)
+
+def collect_traces(postfix_ids, events_file, summary_file=None, workers=CFG.TRACE_WORKERS):
+    """Fetch the trace of every postfix ID, writing events to events_file (JSONL) and the latency
+    summary to summary_file (CSV); IDs that failed go to <events_file stem>_failed.csv.
+    Returns (TraceStats, failures)."""
+    ids = list(dict.fromkeys(postfix_ids))
+    stats = TraceStats()
+    print(f"[info] fetching traces for {len(ids)} postfix IDs")
+
+    with open(events_file, "w", encoding="utf-8") as out:
+        def on_result(pid, outcome):
+            result = outcome.results[0] if outcome.results else {}
+            got = False
+            for direction, pending, events in trace_events(pid, result):
+                for ev in events:
+                    out.write(json.dumps(ev, ensure_ascii=False) + "\n")
+                stats.add(direction, pending, events)
+                got = got or bool(events)
+            stats.messages += got
+            stats.empty += not got
+            done = stats.messages + stats.empty
+            if done % 100 == 0:
+                print(f"[info] {done}/{len(ids)} traces collected")
+
+        with CFProfile.span("trace"):
+            failures = CFPipeline.run_per_id(ids, CFPipeline.get_one("/investigate/{pid}/trace", _decode_trace),
+                                             on_result, workers, "trace", failed_file=CFPipeline.failed_path(events_file))
+
+    rows = stats.rows()
+    print_summary(stats, rows)
+    if summary_file:
+        with open(summary_file, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"\nSummary saved to {summary_file}")
+    print(f"Events saved to {events_file}")
+    if stats.empty:
+        print(f"[info] {stats.empty} messages had no trace lines")
+    return stats, failures
+
+# -----------------------------------------------------------
+# USER INPUT — one postfix ID
+# -----------------------------------------------------------
+def print_trace(postfix_id):
+    url = CFG.API_BASE_URL + f"/investigate/{postfix_id}/trace"
+
+    print(f"\nRequesting trace for {postfix_id}...\n")
 
-if resp.status_code == 200:
-    try:
-        data = resp.json()
-    except Exception:
-        print("Received 200 but response is not valid JSON. Raw body:\n")
-        print(resp.text)
-        sys.exit(1)
-
-    # Pretty-print the trace JSON (inbound/outbound etc.)
-    print(json.dumps(data, indent=2, ensure_ascii=False))
-else:
-    # try to show JSON error if present
-    print(f"HTTP {resp.status_code} error")
     try:
-        err = resp.json()
-        print(json.dumps(err, indent=2, ensure_ascii=False))
-    except Exception:
-        print(resp.text)
+        resp = CFG.session.get(url)
+    except requests.RequestException as e:
+        print("Request error:", e)
+        return 1
+
+    if resp.status_code == 200:
+        try:
+            data = resp.json()
+        except Exception:
+            print("Received 200 but response is not valid JSON. Raw body:\n")
+            print(resp.text)
+            return 1
+
+        # Pretty-print the trace JSON (inbound/outbound etc.)
+        print(json.dumps(data, indent=2, ensure_ascii=False))
+    else:
+        # try to show JSON error if present
+        print(f"HTTP {resp.status_code} error")
+        try:
+            err = resp.json()
+            print(json.dumps(err, indent=2, ensure_ascii=False))
+        except Exception:
+            print(resp.text)
+    return 0
+
+if __name__ == "__main__":
+    POSTFIX_ID = input("Enter postfix_id: ").strip()
+    if not POSTFIX_ID:
+        print("No postfix_id entered. Exiting.")
+        sys.exit(0)
+    sys.exit(print_trace(POSTFIX_ID))
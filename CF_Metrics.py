@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cloudflare API Metrics
+
+Process-wide instrumentation for every HTTP call the toolkit makes. install() wraps
+requests.Session.send once, so plain requests.get/post calls and every Session are
+measured the same way. Per endpoint (method + path template, e.g.
+"POST investigate/{id}/move") it keeps a latency histogram, status counts, response
+bytes and retry counts; search pages also report records per page, and the retry and
+pacing loops report the time they spend sleeping through sleep().
+
+summary() is the compact per-endpoint form and summary_line() one line of it, printed after
+every command that made requests; export_json() and export_prometheus() write the full data
+for dashboards ('CFTools.py --metrics-out').
+
+Inside scope() the calling thread also records into a fresh Registry, and the reports
+describe only that: CFTools.main runs every command in one, so a command the daemon runs
+next to others reports its own requests. Worker threads a command starts join its scope
+through in_scope(fn), which also hands them any other per-thread state registered with
+carry() (the daemon's output capture).
+"""
+
+import json
+import re
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+PAGE_BUCKETS = (0, 1, 10, 50, 100, 250, 500, 750, 999, 1000)
+
+_ACTION_SEGMENTS = {"move", "release", "raw", "preview", "trace", "reclassify"}
+_lock = threading.Lock()
+_installed = False
+
+# ---------------------------
+# Histogram
+# ---------------------------
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # last slot is +Inf
+        self.total = 0.0
+        self.n = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.total += value
+        self.n += 1
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (the usual histogram estimate)."""
+        if not self.n:
+            return None
+        target = q * self.n
+        acc = 0
+        for i, c in enumerate(self.counts):
+            acc += c
+            if acc >= target:
+                return self.buckets[i] if i < len(self.buckets) else self.max
+        return self.max
+
+    def to_dict(self):
+        return {"count": self.n, "sum": round(self.total, 6), "max": round(self.max, 6),
+                "buckets": {str(b): c for b, c in zip(list(self.buckets) + ["+Inf"], self.counts)}}
+
+# ---------------------------
+# Registry
+# ---------------------------
+class _Endpoint:
+    def __init__(self):
+        self.latency = Histogram()
+        self.status = {}
+        self.bytes = 0
+        self.exceptions = 0
+        self.retries = 0
+        self.pages = Histogram(PAGE_BUCKETS)
+        self.records = 0
+
+class Registry:
+    """Endpoint stats and sleep totals: the process-wide set, or one scope()'s."""
+
+    def __init__(self):
+        self.endpoints = {}
+        self.sleep = {"backoff": 0.0, "pacing": 0.0}
+        self.started = time.time()
+
+    def ep(self, name):
+        ep = self.endpoints.get(name)
+        if ep is None:
+            ep = self.endpoints[name] = _Endpoint()
+        return ep
+
+_global = Registry()
+_local = threading.local()
+
+def _registries():
+    scope = getattr(_local, "scope", None)
+    return (_global,) if scope is None else (_global, scope)
+
+def _current():
+    return getattr(_local, "scope", None) or _global
+
+@contextmanager
+def scope():
+    """Record this thread's requests into a fresh Registry as well; reports inside cover only it."""
+    prev = getattr(_local, "scope", None)
+    _local.scope = Registry()
+    try:
+        yield _local.scope
+    finally:
+        _local.scope = prev
+
+_carried = []   # (get, put) pairs of other per-thread state in_scope hands to worker threads
+
+def carry(get, put):
+    """Have in_scope(fn) also run fn with put(get()) as taken on the calling thread."""
+    _carried.append((get, put))
+
+def in_scope(fn):
+    """fn, recording into the calling thread's scope (and carried state) when it runs on a worker thread."""
+    scope = getattr(_local, "scope", None)
+    state = [(get, put, get()) for get, put in _carried]
+    if scope is None and all(value is None for _, _, value in state):
+        return fn
+
+    def run(*args, **kwargs):
+        prev = getattr(_local, "scope", None)
+        prev_state = [(put, get()) for get, put, _ in state]
+        _local.scope = scope
+        for _, put, value in state:
+            put(value)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.scope = prev
+            for put, value in prev_state:
+                put(value)
+    return run
+
+def endpoint_name(method, url):
+    """'GET https://.../email-security/investigate/abc/raw?x=1' -> 'GET investigate/{id}/raw'."""
+    path = re.sub(r"^[a-z]+://[^/]+", "", url or "").split("?", 1)[0]
+    if "/email-security/" in path:
+        path = path.split("/email-security/", 1)[1]
+    parts = [p for p in path.split("/") if p]
+    if parts and parts[0] == "investigate":
+        parts = [p if i == 0 or p in _ACTION_SEGMENTS else "{id}" for i, p in enumerate(parts)]
+    return f"{(method or 'GET').upper()} {'/'.join(parts) or '/'}"
+
+def record_request(method, url, seconds, status=None, nbytes=0, exc=None):
+    name = endpoint_name(method, url)
+    with _lock:
+        for reg in _registries():
+            ep = reg.ep(name)
+            ep.latency.observe(seconds)
+            if exc is not None:
+                ep.exceptions += 1
+            else:
+                ep.status[status] = ep.status.get(status, 0) + 1
+                ep.bytes += nbytes or 0
+
+def record_page(url, records, method="GET"):
+    name = endpoint_name(method, url)
+    with _lock:
+        for reg in _registries():
+            ep = reg.ep(name)
+            ep.pages.observe(records)
+            ep.records += records
+
+def record_retry(url, method="GET"):
+    """Count a retry against the url's endpoint when the wait is not a sleep (e.g. concurrent workers)."""
+    name = endpoint_name(method, url)
+    with _lock:
+        for reg in _registries():
+            reg.ep(name).retries += 1
+
+def sleep(seconds, kind="pacing", url=None, method="GET"):
+    """time.sleep that is accounted for. kind='backoff' also counts a retry against the url's endpoint."""
+    if seconds <= 0:
+        return
+    name = endpoint_name(method, url) if kind == "backoff" and url else None
+    with _lock:
+        for reg in _registries():
+            reg.sleep[kind] = reg.sleep.get(kind, 0.0) + seconds
+            if name:
+                reg.ep(name).retries += 1
+    time.sleep(seconds)
+
+def summary_line():
+    """summary() in one line (None when no request was made), e.g.
+    '57 request(s) in 12.3s (10.1s in requests, 0.5s backoff, 1.2s pacing); 2 HTTP 429, 3 retries; slowest p95 2.5s GET investigate'."""
+    s = summary()
+    eps = s["endpoints"]
+    n = sum(ep["requests"] for ep in eps.values())
+    if not n:
+        return None
+    slowest = max(eps, key=lambda name: eps[name]["p95_s"] or 0)
+    return (f"{n} request(s) in {s['wall_seconds']:.1f}s ({s['request_seconds']:.1f}s in requests, "
+            f"{s['backoff_sleep_seconds']:.1f}s backoff, {s['pacing_sleep_seconds']:.1f}s pacing); "
+            f"{sum(ep['http_429'] for ep in eps.values())} HTTP 429, {sum(ep['retries'] for ep in eps.values())} retries; "
+            f"slowest p95 {eps[slowest]['p95_s']}s {slowest}")
+
+def reset():
+    """Clear the process-wide registry."""
+    global _global
+    with _lock:
+        _global = Registry()
+
+# ---------------------------
+# requests integration
+# ---------------------------
+def install():
+    """Wrap requests.Session.send so every request made through requests is recorded. Idempotent."""
+    global _installed
+    if _installed:
+        return
+    import requests
+    original = requests.Session.send
+
+    def send(self, request, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            resp = original(self, request, **kwargs)
+        except Exception as e:
+            record_request(request.method, request.url, time.perf_counter() - t0, exc=e)
+            raise
+        if kwargs.get("stream"):
+            nbytes = int(resp.headers.get("Content-Length") or 0)
+        else:
+            nbytes = len(resp.content or b"")
+        record_request(request.method, request.url, time.perf_counter() - t0, resp.status_code, nbytes)
+        return resp
+
+    requests.Session.send = send
+    _installed = True
+
+# ---------------------------
+# Reporting
+# ---------------------------
+def summary():
+    """Compact per-endpoint view (counts, p50/p95/p99 latency, 429s, retries, bytes) plus sleep vs work time."""
+    reg = _current()
+    with _lock:
+        eps = {}
+        work = 0.0
+        for name, ep in sorted(reg.endpoints.items()):
+            work += ep.latency.total
+            row = {
+                "requests": ep.latency.n,
+                "p50_s": ep.latency.quantile(0.5),
+                "p95_s": ep.latency.quantile(0.95),
+                "p99_s": ep.latency.quantile(0.99),
+                "status": {str(k): v for k, v in sorted(ep.status.items(), key=lambda kv: str(kv[0]))},
+                "http_429": ep.status.get(429, 0),
+                "retries": ep.retries,
+                "exceptions": ep.exceptions,
+                "bytes": ep.bytes,
+            }
+            if ep.pages.n:
+                row["pages"] = ep.pages.n
+                row["avg_records_per_page"] = round(ep.records / ep.pages.n, 1)
+            eps[name] = row
+        return {
+            "endpoints": eps,
+            "request_seconds": round(work, 3),
+            "backoff_sleep_seconds": round(reg.sleep.get("backoff", 0.0), 3),
+            "pacing_sleep_seconds": round(reg.sleep.get("pacing", 0.0), 3),
+            "wall_seconds": round(time.time() - reg.started, 3),
+        }
+
+def to_dict():
+    reg = _current()
+    with _lock:
+        return {
+            "endpoints": {name: {"latency_seconds": ep.latency.to_dict(),
+                                 "status": {str(k): v for k, v in ep.status.items()},
+                                 "response_bytes": ep.bytes, "exceptions": ep.exceptions, "retries": ep.retries,
+                                 "records_per_page": ep.pages.to_dict(), "records": ep.records}
+                          for name, ep in sorted(reg.endpoints.items())},
+            "sleep_seconds": dict(reg.sleep),
+            "wall_seconds": round(time.time() - reg.started, 3),
+        }
+
+def _label(v):
+    return str(v).replace("\\", "\\\\").replace('"', '\\"')
+
+def _prom_histogram(lines, metric, labels, h):
+    acc = 0
+    for b, c in zip(list(h.buckets) + ["+Inf"], h.counts):
+        acc += c
+        lines.append(f'{metric}_bucket{{{labels},le="{b}"}} {acc}')
+    lines.append(f"{metric}_sum{{{labels}}} {h.total}")
+    lines.append(f"{metric}_count{{{labels}}} {h.n}")
+
+def prometheus_text():
+    lines = [
+        "# HELP cf_api_request_duration_seconds Latency of Cloudflare API requests.",
+        "# TYPE cf_api_request_duration_seconds histogram",
+    ]
+    reg = _current()
+    with _lock:
+        items = sorted(reg.endpoints.items())
+        for name, ep in items:
+            _prom_histogram(lines, "cf_api_request_duration_seconds", f'endpoint="{_label(name)}"', ep.latency)
+        lines += ["# HELP cf_api_requests_total Cloudflare API responses by status.", "# TYPE cf_api_requests_total counter"]
+        for name, ep in items:
+            for status, n in ep.status.items():
+                lines.append(f'cf_api_requests_total{{endpoint="{_label(name)}",status="{status}"}} {n}')
+        lines += ["# HELP cf_api_request_exceptions_total Requests that failed without a response.", "# TYPE cf_api_request_exceptions_total counter"]
+        lines += [f'cf_api_request_exceptions_total{{endpoint="{_label(n)}"}} {ep.exceptions}' for n, ep in items]
+        lines += ["# HELP cf_api_retries_total Retries after a backoff sleep.", "# TYPE cf_api_retries_total counter"]
+        lines += [f'cf_api_retries_total{{endpoint="{_label(n)}"}} {ep.retries}' for n, ep in items]
+        lines += ["# HELP cf_api_response_bytes_total Response body bytes.", "# TYPE cf_api_response_bytes_total counter"]
+        lines += [f'cf_api_response_bytes_total{{endpoint="{_label(n)}"}} {ep.bytes}' for n, ep in items]
+        lines += ["# HELP cf_api_records_per_page Records returned per search page.", "# TYPE cf_api_records_per_page histogram"]
+        for name, ep in items:
+            if ep.pages.n:
+                _prom_histogram(lines, "cf_api_records_per_page", f'endpoint="{_label(name)}"', ep.pages)
+        lines += ["# HELP cf_sleep_seconds_total Time spent sleeping, by reason.", "# TYPE cf_sleep_seconds_total counter"]
+        lines += [f'cf_sleep_seconds_total{{kind="{k}"}} {v}' for k, v in sorted(reg.sleep.items())]
+    return "\n".join(lines) + "\n"
+
+def export(path):
+    """Write metrics to path: Prometheus text format for .prom/.txt, JSON otherwise."""
+    p = Path(path).expanduser()
+    p.parent.mkdir(parents=True, exist_ok=True)
+    if p.suffix.lower() in (".prom", ".txt"):
+        p.write_text(prometheus_text(), encoding="utf-8")
+    else:
+        p.write_text(json.dumps(to_dict(), indent=2), encoding="utf-8")
+    return str(p)
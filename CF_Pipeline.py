@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cloudflare Batch Pipeline
+
+Runs a list of IDs through a batch endpoint with several batches in flight. Pacing comes
+from the shared CF_RateLimit bucket on CFG.session, not from fixed sleeps, and two limits
+adapt to what the API reports back (AdaptiveLimits):
+
+  - batch size grows additively while batches come back faster than the target latency,
+    shrinks when they are slow or fail with a 5xx/timeout, and is capped below any size
+    the API rejects as too large (HTTP 413);
+  - the number of batches in flight halves on a 429 and grows back by one after a run of
+    successes.
+
+Transient failures (connection errors, 429, 5xx) are retried as the same batch after a
+backoff (Retry-After when given); a batch still failing after max_retries is reported as
+failed as a whole. A batch the API rejects with a 4xx is bisected: both halves are sent
+again as batches and only a half that fails again is split further, so the IDs that make
+a batch fail are isolated in O(log n) requests per bad ID instead of one request per ID.
+Single IDs that still fail are reported through on_done as permanent failures, with the
+API error for that ID. A 401/403 is not about the IDs: it is reported for its batch and
+stops the run, like should_stop().
+
+The caller supplies send(batch) -> BatchOutcome and on_done(batch, outcome); on_done runs
+in the calling thread, in completion order, so it can stream results to a file. The IDs
+can be a list, or a Feed that another thread (e.g. a running search) keeps filling: batches
+are sent as soon as enough IDs have arrived, and run_batches returns once the feed is
+closed and drained. When the run stops early it cancels the feed, so its producer can stop too.
+
+Endpoints that take one ID per GET (raw EML, previews, traces) use run_per_id with a send
+from get_one: batches of one, FETCH_TARGET_LATENCY as the latency target, failures
+printed and listed in a (postfix_id, error) CSV by write_failures.
+"""
+
+import csv
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+
+import CFScriptConfig as CFG
+import CF_Decode as CFDecode
+import CF_Metrics as CFMetrics
+import CF_Profile as CFProfile
+
+# ---------------------------
+# Outcomes
+# ---------------------------
+class BatchOutcome:
+    """ok: accepted. transient: worth retrying as is. throttled: a 429. too_large: rejected for its size.
+    auth: the credentials were refused (401/403), so no other batch will be accepted either."""
+
+    def __init__(self, ok, results=None, error=None, status=None, transient=False, throttled=False,
+                 too_large=False, retry_after=None, auth=False):
+        self.ok = ok
+        self.results = results or []
+        self.error = error
+        self.status = status
+        self.transient = transient
+        self.throttled = throttled
+        self.too_large = too_large
+        self.retry_after = retry_after
+        self.auth = auth
+        self.code = None           # the API's first error code, or "HTTP <status>" when it sent none
+        self.latency = None
+        self.attempts = 0
+
+def api_error(parsed, response):
+    """The API's first error as 'code N: message', else a short slice of the body."""
+    errors = parsed.get("errors") if isinstance(parsed, dict) else None
+    if errors and isinstance(errors, list) and isinstance(errors[0], dict):
+        e = errors[0]
+        return f"code {e.get('code')}: {e.get('message')}"
+    return f"HTTP {response.status_code}: {(response.text or '')[:300]}"
+
+def error_code(parsed, response):
+    errors = parsed.get("errors") if isinstance(parsed, dict) else None
+    if errors and isinstance(errors, list) and isinstance(errors[0], dict) and errors[0].get("code") is not None:
+        return errors[0]["code"]
+    return f"HTTP {response.status_code}"
+
+def outcome_from_response(response, parsed, error=None):
+    """Classify an HTTP response the way every batch endpoint is handled."""
+    outcome = _classify(response, parsed, error)
+    if not outcome.ok:
+        outcome.code = error_code(parsed, response)
+    return outcome
+
+def retry_after_seconds(response):
+    """The response's Retry-After in seconds (delta-seconds or an HTTP date), or None when absent or unreadable."""
+    value = (response.headers.get("Retry-After") or "").strip()
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+def _classify(response, parsed, error):
+    status = response.status_code
+    if status in (200, 201, 202, 204):
+        result = parsed.get("result") if isinstance(parsed, dict) else None
+        if result is not None and not isinstance(result, list):
+            result = [result]
+        return BatchOutcome(True, results=result or [], status=status)
+    if status == 429:
+        return BatchOutcome(False, error="HTTP 429", status=status, transient=True, throttled=True,
+                            retry_after=retry_after_seconds(response))
+    if status >= 500:
+        return BatchOutcome(False, error=f"HTTP {status}", status=status, transient=True)
+    if status == 413:
+        return BatchOutcome(False, error="HTTP 413: batch too large", status=status, too_large=True)
+    if status in (401, 403):
+        return BatchOutcome(False, error=error or api_error(parsed, response), status=status, auth=True)
+    return BatchOutcome(False, error=error or api_error(parsed, response), status=status)
+
+# ---------------------------
+# Adaptive batch size + concurrency
+# ---------------------------
+class AdaptiveLimits:
+    """Batch size and batches in flight. A slow batch shrinks the size; once the size is at
+    min_size (always, for one ID per request) it takes one batch out of flight instead."""
+
+    SIZE_STEP = 10          # additive increase per fast batch
+    SLOW_FACTOR = 0.75      # multiplicative decrease for a slow batch
+
+    def __init__(self, initial_size, max_size, workers, target_latency, min_size=1):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.size = max(min_size, min(initial_size, max_size))
+        self.max_workers = max(1, workers)
+        self.workers = self.max_workers
+        self.target_latency = target_latency
+        self._streak = 0
+        self.lock = threading.Lock()
+
+    def on_success(self, size, latency):
+        with self.lock:
+            if latency <= self.target_latency:
+                if size >= self.size:
+                    self.size = min(self.max_size, self.size + self.SIZE_STEP)
+            elif self.size > self.min_size:
+                self.size = max(self.min_size, int(self.size * self.SLOW_FACTOR))
+            else:
+                self.workers = max(1, self.workers - 1)
+                self._streak = 0
+                return
+            self._streak += 1
+            if self._streak >= self.workers and self.workers < self.max_workers:
+                self.workers += 1
+                self._streak = 0
+
+    def on_throttle(self):
+        with self.lock:
+            self.workers = max(1, self.workers // 2)
+            self._streak = 0
+
+    def on_server_error(self):
+        with self.lock:
+            self.size = max(self.min_size, self.size // 2)
+
+    def on_too_large(self, size):
+        with self.lock:
+            self.max_size = max(self.min_size, min(self.max_size, size - 1, size // 2 or 1))
+            self.size = min(self.size, self.max_size)
+
+    def snapshot(self):
+        with self.lock:
+            return {"batch_size": self.size, "max_batch_size": self.max_size, "in_flight": self.workers}
+
+# ---------------------------
+# Feed of IDs from a producer thread
+# ---------------------------
+FEED_LINGER = 0.5   # seconds an idle runner waits to fill a batch before sending a partial one
+FEED_POLL = 0.25    # seconds between checks of an open feed while batches are in flight
+
+class Feed:
+    """IDs handed over by a producer thread; call close() when it is finished (also on error)."""
+
+    def __init__(self, items=None):
+        self._items = deque(items or [])
+        self._cond = threading.Condition()
+        self.closed = items is not None
+        self.cancelled = False   # the consumer stopped taking IDs; a producer should stop putting them
+        self.total = len(self._items)
+
+    def put(self, items):
+        with self._cond:
+            self._items.extend(items)
+            self.total += len(items)
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def pending(self):
+        return len(self._items)
+
+    def done(self):
+        return self.closed and not self._items
+
+    def take(self, n, wait=0.0):
+        """Up to n IDs; waits up to `wait` seconds for n to be available unless the feed is closed."""
+        deadline = time.monotonic() + wait
+        with self._cond:
+            while len(self._items) < n and not self.closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return [self._items.popleft() for _ in range(min(n, len(self._items)))]
+
+# ---------------------------
+# Runner
+# ---------------------------
+def _timed(send, batch):
+    t0 = time.perf_counter()
+    try:
+        outcome = send(batch)
+    except Exception as e:
+        outcome = BatchOutcome(False, error=f"request failed: {e}", transient=True)
+    outcome.latency = time.perf_counter() - t0
+    return outcome
+
+def run_batches(ids, send, on_done, limits, max_retries=CFG.MAX_RETRIES, url=None, method="POST", label="batch",
+                on_submit=None, should_stop=None):
+    """Send every ID in ids (a list or a Feed) through send(batch); returns a stats dict.
+
+    on_done(batch, outcome) is called once per final outcome: for accepted batches, for
+    single IDs the API rejected, and for batches that ran out of retries. on_submit(batch), if
+    given, is called (in the calling thread) each time a batch is handed to a worker. Once
+    should_stop() returns True, or a batch gets a 401/403, nothing more is sent: the batches
+    already in flight are finished and reported, and run_batches returns
+    (stats["stopped_early"] is True; after a 401/403 stats["aborted"] holds the error and
+    stats["unsent"] the number of IDs never reported).
+    """
+    feed = ids if isinstance(ids, Feed) else Feed(list(ids))
+    retry = []           # heap of (not_before, seq, batch, attempts)
+    seq = itertools.count()
+    in_flight = {}
+    stats = {"ids": 0, "requests": 0, "accepted_batches": 0, "retries": 0, "splits": 0, "failed_ids": 0, "aborted": None}
+    timed = CFMetrics.in_scope(_timed)   # workers record into the caller's metrics scope
+
+    def _submit(pool, batch, attempts):
+        if on_submit is not None:
+            on_submit(batch)
+        fut = pool.submit(timed, send, batch)
+        in_flight[fut] = (batch, attempts)
+        stats["requests"] += 1
+
+    with ThreadPoolExecutor(max_workers=limits.max_workers) as pool:
+        while True:
+            now = time.monotonic()
+            if stats["aborted"] is not None or (should_stop is not None and should_stop()):
+                stats["stopped_early"] = True
+                feed.cancel()
+                if not in_flight:
+                    break
+                _finish(wait(list(in_flight))[0], in_flight, on_done, stats)
+                continue
+            while len(in_flight) < limits.workers:
+                if retry and retry[0][0] <= now:
+                    _, _, batch, attempts = heapq.heappop(retry)
+                    _submit(pool, batch, attempts)
+                elif feed.pending() >= limits.size or (feed.closed and feed.pending()):
+                    _submit(pool, feed.take(limits.size), 0)
+                elif not in_flight and not feed.closed:
+                    # idle: give the producer a moment to fill a batch, then send what there is
+                    batch = feed.take(limits.size, wait=FEED_LINGER)
+                    if not batch:
+                        break
+                    _submit(pool, batch, 0)
+                else:
+                    break
+
+            if not in_flight:
+                if feed.done() and not retry:
+                    break
+                if feed.done():
+                    CFMetrics.sleep(max(0.0, retry[0][0] - time.monotonic()), "backoff", url=url, method=method)
+                continue
+
+            # with a free slot, wake for a due retry or to check the feed; otherwise for a finished batch
+            timeout = None
+            if len(in_flight) < limits.workers:
+                if retry:
+                    timeout = max(0.0, retry[0][0] - now)
+                if not feed.closed:
+                    timeout = FEED_POLL if timeout is None else min(timeout, FEED_POLL)
+            done, _ = wait(list(in_flight), timeout=timeout, return_when=FIRST_COMPLETED)
+            for fut in done:
+                batch, attempts = in_flight.pop(fut)
+                outcome = fut.result()
+                outcome.attempts = attempts + 1
+                if outcome.ok:
+                    limits.on_success(len(batch), outcome.latency)
+                    stats["accepted_batches"] += 1
+                    on_done(batch, outcome)
+                    continue
+
+                if outcome.throttled:
+                    limits.on_throttle()
+                elif outcome.transient:
+                    limits.on_server_error()
+                elif outcome.too_large:
+                    limits.on_too_large(len(batch))
+
+                if (outcome.transient and attempts + 1 < max_retries) or (outcome.too_large and len(batch) > 1):
+                    if outcome.too_large:
+                        for i in range(0, len(batch), max(1, limits.max_size)):
+                            heapq.heappush(retry, (0.0, next(seq), batch[i:i + limits.max_size], 0))
+                        stats["splits"] += 1
+                    else:
+                        delay = outcome.retry_after if outcome.retry_after is not None else (2 ** attempts) * 0.5 + CFG.RATE_LIMIT_SLEEP
+                        heapq.heappush(retry, (time.monotonic() + delay, next(seq), batch, attempts + 1))
+                        stats["retries"] += 1
+                        if url:
+                            CFMetrics.record_retry(url, method)
+                    print(f"[{label}] {len(batch)} IDs: {outcome.error}; retrying ({limits.snapshot()})")
+                    continue
+
+                if outcome.auth:
+                    if stats["aborted"] is None:
+                        print(f"[error] {label}: {outcome.error}; the API refused the credentials, sending nothing more")
+                    stats["aborted"] = outcome.error
+                elif len(batch) > 1 and outcome.status is not None and 400 <= outcome.status < 500:
+                    # the API rejected something in a multi-ID batch: retry both halves, recurse into those that fail again
+                    half = len(batch) // 2
+                    print(f"[{label}] {len(batch)} IDs failed ({outcome.error}); retrying as {half} + {len(batch) - half}")
+                    heapq.heappush(retry, (0.0, next(seq), batch[:half], 0))
+                    heapq.heappush(retry, (0.0, next(seq), batch[half:], 0))
+                    stats["splits"] += 1
+                    continue
+
+                stats["failed_ids"] += len(batch)
+                on_done(batch, outcome)
+
+    stats["ids"] = feed.total
+    stats.setdefault("stopped_early", False)
+    if stats["aborted"] is not None:
+        stats["unsent"] = feed.pending() + sum(len(entry[2]) for entry in retry)
+        print(f"[info] {label}: {stats['unsent']} IDs were not sent")
+    stats.update(limits.snapshot())
+    return stats
+
+# ---------------------------
+# One GET per ID
+# ---------------------------
+def get_one(path, handle, stream=False, headers=None):
+    """send(batch) for run_per_id: GET CFG.API_BASE_URL + path.format(pid=<the batch's ID>).
+    A non-200 answer is classified by outcome_from_response; a 200 goes to handle(pid, resp),
+    which returns the BatchOutcome (with stream=True it reads the body itself)."""
+    def send(batch):
+        pid = batch[0]
+        with CFProfile.span("fetch"):
+            resp = CFG.session.get(CFG.API_BASE_URL + path.format(pid=pid), headers=headers, stream=stream)
+        with resp:
+            if resp.status_code != 200:
+                try:
+                    parsed = CFDecode.decode_response(resp)
+                except ValueError:
+                    parsed = None      # a non-JSON error body is reported by its HTTP status
+                return outcome_from_response(resp, parsed)
+            return handle(pid, resp)
+    return send
+
+def run_per_id(ids, send, on_result, workers, label, failed_file=None):
+    """run_batches with one ID per request and up to `workers` in flight. on_result(pid, outcome)
+    gets every accepted answer, in the calling thread. Failures are printed as they come and
+    listed in failed_file when given. Returns the list of (postfix_id, error) failures."""
+    failures = []
+
+    def on_done(batch, outcome):
+        if outcome.ok:
+            on_result(batch[0], outcome)
+        else:
+            failures.append((batch[0], outcome.error))
+            print(f"[error] {batch[0]}: {outcome.error}")
+
+    limits = AdaptiveLimits(1, 1, workers, CFG.FETCH_TARGET_LATENCY)
+    run_batches(ids, send, on_done, limits, label=label)
+    if failures and failed_file:
+        write_failures(failed_file, failures)
+        print(f"[error] {len(failures)} postfix IDs failed; listed in {failed_file}")
+    return failures
+
+def failed_path(out_file):
+    """<out_file stem>_failed.csv next to out_file."""
+    out_file = Path(out_file)
+    return out_file.with_name(f"{out_file.stem}_failed.csv")
+
+def write_failures(path, failures):
+    """(postfix_id, error) pairs as a CSV with a header row."""
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["postfix_id", "error"])
+        writer.writerows(failures)
+    return path
+
+def _finish(done, in_flight, on_done, stats):
+    """Report batches that completed after a stop: nothing is retried or split any more."""
+    for fut in done:
+        batch, attempts = in_flight.pop(fut)
+        outcome = fut.result()
+        outcome.attempts = attempts + 1
+        if outcome.ok:
+            stats["accepted_batches"] += 1
+        else:
+            stats["failed_ids"] += len(batch)
+        on_done(batch, outcome)
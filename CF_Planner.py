@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cloudflare Search Planner
+
+Estimates what a divide-and-conquer search will cost before running it, and pre-splits
+real runs into well-sized initial slices.
+
+Every search run records how many records each completed chunk held, and the request
+latency, into a per-query density profile (debug/density_profile.json, 168 hour-of-week
+buckets). 'CFTools.py search --plan' combines that profile with a few probe requests to
+predict the record count, request count and runtime. A real run uses the same profile
+to cut the range into slices that should each fit in about half a page, which skips the
+full-page requests at the top of the bisection tree.
+"""
+
+import json
+import time
+from datetime import datetime, timedelta, timezone
+
+import CFFullSearch as CFSearch
+import CFScriptConfig as CFG
+
+# ---------------------------
+# CONFIG / TUNABLES
+# ---------------------------
+PROFILE_DECAY = 0.7          # weight kept by older observations each time a run is merged in
+TARGET_FILL = 0.5            # aim for initial slices holding this fraction of a page
+MAX_INITIAL_SLICES = 5000
+DEFAULT_PROBES = 4
+PROBE_SECONDS = 3600         # width of each probe window
+PROBE_SHRINK = 8             # a full probe page is retried on a window this many times narrower
+MAX_PROBE_REQUESTS = 16
+
+HOURS_PER_WEEK = 168
+HOUR = timedelta(hours=1)
+
+def _how(dt):
+    return dt.weekday() * 24 + dt.hour
+
+def _hour_floor(dt):
+    return dt.replace(minute=0, second=0, microsecond=0)
+
+def _hour_overlaps(s_dt, e_dt):
+    """Yield (hour_of_week, overlap_seconds) for every clock hour touched by [s_dt, e_dt)."""
+    h = _hour_floor(s_dt)
+    while h < e_dt:
+        a, b = max(s_dt, h), min(e_dt, h + HOUR)
+        if b > a:
+            yield _how(h), (b - a).total_seconds()
+        h += HOUR
+
+# ---------------------------
+# Profile persistence
+# ---------------------------
+def _profile_path():
+    return CFG.DEBUG_DIR / "density_profile.json"
+
+def load_profiles():
+    path = _profile_path()
+    if path.exists():
+        try:
+            return json.loads(path.read_text(encoding="utf-8"))
+        except Exception:
+            return {}
+    return {}
+
+def save_profiles(profiles):
+    try:
+        _profile_path().write_text(json.dumps(profiles, indent=2), encoding="utf-8")
+    except Exception as e:
+        print("[debug] failed to write density profile:", e)
+
+def get_profile(fkey):
+    return load_profiles().get(fkey)
+
+class DensityRecorder:
+    """on_chunk callback for fetch_all_by_time_divide_and_conquer that learns the query's density."""
+
+    def __init__(self, fkey, per_page=CFG.PER_PAGE):
+        self.fkey = fkey
+        self.per_page = per_page
+        self.records = [0.0] * HOURS_PER_WEEK
+        self.seconds = [0.0] * HOURS_PER_WEEK
+        self.requests = 0
+        self.latency_total = 0.0
+
+    def on_chunk(self, s_dt, e_dt, plen, elapsed):
+        self.requests += 1
+        self.latency_total += elapsed
+        if plen >= self.per_page:
+            return   # truncated page: only a lower bound, its children will report exact counts
+        duration = (e_dt - s_dt).total_seconds()
+        if duration <= 0:
+            return
+        for how, overlap in _hour_overlaps(s_dt, e_dt):
+            self.records[how] += plen * overlap / duration
+            self.seconds[how] += overlap
+
+    def save(self):
+        if not self.requests:
+            return
+        profiles = load_profiles()
+        old = profiles.get(self.fkey) or {}
+        old_records = old.get("records") or [0.0] * HOURS_PER_WEEK
+        old_seconds = old.get("seconds") or [0.0] * HOURS_PER_WEEK
+        old_lat, old_req = old.get("latency", 0.0), old.get("requests", 0) * PROFILE_DECAY
+        profiles[self.fkey] = {
+            "records": [o * PROFILE_DECAY + n for o, n in zip(old_records, self.records)],
+            "seconds": [o * PROFILE_DECAY + n for o, n in zip(old_seconds, self.seconds)],
+            "latency": (old_lat * old_req + self.latency_total) / (old_req + self.requests),
+            "requests": old_req + self.requests,
+            "updated": CFSearch._iso(datetime.now(timezone.utc)),
+        }
+        save_profiles(profiles)
+
+def _rates_from_profile(profile):
+    """Records per second for each hour-of-week bucket; unseen buckets get the overall mean rate."""
+    records, seconds = profile.get("records") or [], profile.get("seconds") or []
+    total_s = sum(seconds)
+    if not total_s:
+        return None
+    mean = sum(records) / total_s
+    return [r / s if s > 0 else mean for r, s in zip(records, seconds)]
+
+# ---------------------------
+# Density model over a concrete time range
+# ---------------------------
+class DensityModel:
+    """Expected record counts over sub-windows of [start_dt, end_dt), via hourly prefix sums."""
+
+    def __init__(self, rates, start_dt, end_dt, scale=1.0):
+        self.start_dt = start_dt
+        self.base = _hour_floor(start_dt)
+        self.rates = [r * scale for r in rates]
+        self.prefix = [0.0]
+        h = self.base
+        while h < end_dt:
+            self.prefix.append(self.prefix[-1] + self.rates[_how(h)] * 3600)
+            h += HOUR
+
+    def _cumulative(self, dt):
+        x = (dt - self.base).total_seconds() / 3600
+        i = max(0, min(int(x), len(self.prefix) - 2))
+        return self.prefix[i] + (self.prefix[i + 1] - self.prefix[i]) * (x - i)
+
+    def expected(self, a, b):
+        return max(0.0, self._cumulative(b) - self._cumulative(a))
+
+def plan_slices(start_dt, end_dt, fkey, per_page=CFG.PER_PAGE, model=None):
+    """Return interior boundaries that cut the range into slices of ~TARGET_FILL pages, or [] without a profile."""
+    if model is None:
+        profile = get_profile(fkey)
+        rates = _rates_from_profile(profile) if profile else None
+        if not rates:
+            return []
+        model = DensityModel(rates, start_dt, end_dt)
+
+    target = per_page * TARGET_FILL
+    total = model.expected(start_dt, end_dt)
+    if total <= target:
+        return []
+    n = min(MAX_INITIAL_SLICES, int(total / target) + 1)
+    step = total / n
+
+    # walk the hourly prefix sums and cut where the cumulative expectation crosses each step
+    bounds = []
+    want = model._cumulative(start_dt) + step
+    h = model.base
+    for i in range(len(model.prefix) - 1):
+        lo, hi = model.prefix[i], model.prefix[i + 1]
+        while want < hi and len(bounds) < n - 1:
+            frac = (want - lo) / (hi - lo) if hi > lo else 0.0
+            cut = h + timedelta(seconds=3600 * frac)
+            if start_dt < cut < end_dt and (not bounds or (cut - bounds[-1]).total_seconds() >= 1):
+                bounds.append(cut)
+            want += step
+        h += HOUR
+    return bounds
+
+def simulate_requests(model, start_dt, end_dt, per_page=CFG.PER_PAGE, bounds=None):
+    """Count the requests the bisection would make if the model were exact."""
+    edges = [start_dt] + list(bounds or []) + [end_dt]
+    stack = [(a, b, 0) for a, b in zip(edges, edges[1:])]
+    requests = 0
+    while stack and requests < CFG.MAX_TOTAL_REQUESTS:
+        a, b, depth = stack.pop()
+        requests += 1
+        if model.expected(a, b) < per_page or depth >= CFG.MAX_RECURSION_DEPTH:
+            continue
+        if (b - a).total_seconds() <= CFG.MIN_CHUNK_SECONDS:
+            continue
+        mid = a + (b - a) / 2
+        stack.append((a, mid, depth + 1))
+        stack.append((mid, b, depth + 1))
+    return requests
+
+# ---------------------------
+# Probing + estimate (search --plan)
+# ---------------------------
+def probe(start_dt, end_dt, filters, per_page=CFG.PER_PAGE, probes=DEFAULT_PROBES):
+    """Fetch a few evenly spaced sample windows. Returns (samples, requests, error): samples is
+    [(s_dt, e_dt, count, elapsed, exact)], requests the page requests sent (a full probe page is
+    fetched again on a narrower window), error the failure that stopped probing early, or None."""
+    out = []
+    requests = 0
+    if probes <= 0:
+        return out, requests, None
+    span = (end_dt - start_dt).total_seconds()
+    width = min(PROBE_SECONDS, span / probes)
+    budget = MAX_PROBE_REQUESTS
+    for i in range(probes):
+        center = start_dt + timedelta(seconds=span * (i + 0.5) / probes)
+        w = width
+        while budget > 0:
+            a = max(start_dt, center - timedelta(seconds=w / 2))
+            b = min(end_dt, a + timedelta(seconds=w))
+            t0 = time.perf_counter()
+            requests += 1
+            budget -= 1
+            try:
+                _, plen, _ = CFSearch._fetch_page(CFSearch._iso(a), CFSearch._iso(b), per_page=per_page, **filters)
+            except Exception as e:
+                return out, requests, str(e)
+            elapsed = time.perf_counter() - t0
+            exact = plen < per_page
+            if exact or budget == 0 or w / PROBE_SHRINK < 1:
+                out.append((a, b, plen, elapsed, exact))
+                break
+            w /= PROBE_SHRINK
+    return out, requests, None
+
+def estimate(start_dt, end_dt, filters, per_page=CFG.PER_PAGE, probes=DEFAULT_PROBES):
+    fkey = CFSearch.filter_key(**filters)
+    profile = get_profile(fkey)
+    rates = _rates_from_profile(profile) if profile else None
+    samples, probe_requests, probe_error = probe(start_dt, end_dt, filters, per_page, probes)
+
+    latency = None
+    if samples:
+        latency = sum(s[3] for s in samples) / len(samples)
+    elif profile:
+        latency = profile.get("latency")
+
+    scale = 1.0
+    if rates and samples:
+        predicted = sum(DensityModel(rates, s[0], s[1]).expected(s[0], s[1]) for s in samples)
+        observed = sum(s[2] for s in samples)
+        if predicted > 0 and observed > 0:
+            scale = observed / predicted
+    elif samples:
+        probe_seconds = sum((s[1] - s[0]).total_seconds() for s in samples)
+        rates = [sum(s[2] for s in samples) / probe_seconds] * HOURS_PER_WEEK if probe_seconds else None
+
+    est = {
+        "filter_key": fkey,
+        "start": CFSearch._iso(start_dt),
+        "end": CFSearch._iso(end_dt),
+        "profile": bool(profile),
+        "probe_requests": probe_requests,
+        "probe_samples": len(samples),
+        "probe_error": probe_error,
+        "lower_bound": any(not s[4] for s in samples),
+        "calibration": round(scale, 3),
+    }
+    if not rates:
+        est.update({"expected_records": None, "requests_unsplit": None, "requests_presplit": None, "est_seconds": None})
+        return est
+
+    model = DensityModel(rates, start_dt, end_dt, scale)
+    bounds = plan_slices(start_dt, end_dt, fkey, per_page, model=model)
+    unsplit = simulate_requests(model, start_dt, end_dt, per_page)
+    presplit = simulate_requests(model, start_dt, end_dt, per_page, bounds)
+    est.update({
+        "expected_records": int(model.expected(start_dt, end_dt)),
+        "initial_slices": len(bounds) + 1,
+        "requests_unsplit": unsplit,
+        "requests_presplit": presplit,
+        "latency_seconds": round(latency, 3) if latency else None,
+        "est_seconds": round(presplit * latency) if latency else None,
+        "exceeds_request_cap": presplit >= CFG.MAX_TOTAL_REQUESTS,
+    })
+    return est
+
+def print_plan(est):
+    print(f"[plan] {est['start']} -> {est['end']} filters={est['filter_key']}")
+    print(f"[plan] density profile: {'yes' if est['profile'] else 'no (first run for this query)'}; probe requests made: {est['probe_requests']}")
+    if est.get("probe_error"):
+        print(f"[plan] probing stopped early ({est['probe_samples']} sample windows): {est['probe_error']}; the estimate is partial")
+    if est.get("expected_records") is None:
+        print("[plan] no profile and no probe data; cannot estimate. Run with --probes > 0.")
+        return
+    bound = " (lower bound: a probe window was still a full page)" if est["lower_bound"] else ""
+    print(f"[plan] expected records: ~{est['expected_records']}{bound}")
+    print(f"[plan] requests: ~{est['requests_presplit']} with {est['initial_slices']} pre-split slices (~{est['requests_unsplit']} bisecting from one window)")
+    if est.get("est_seconds") is not None:
+        print(f"[plan] estimated runtime: ~{timedelta(seconds=est['est_seconds'])} at {est['latency_seconds']}s per request")
+    if est.get("exceeds_request_cap"):
+        print(f"[plan] WARNING: this would hit MAX_TOTAL_REQUESTS={CFG.MAX_TOTAL_REQUESTS}. Narrow the filters or the time range.")
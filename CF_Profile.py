@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cloudflare Toolkit Profiling
+
+Named timing spans around pipeline stages (fetch, decode, dedup, flatten, write,
+debug_dump, ...) plus the 'CFTools.py --profile' wrapper that runs a subcommand under
+cProfile and, with --profile-memory, tracemalloc. Spans are always recorded (they are
+a perf_counter pair per stage, not per record); the dumps and the summary are only
+written when profiling is requested.
+
+Output goes to DEBUG_DIR:
+    profile_<command>_<timestamp>.prof   cProfile stats (python -m pstats, snakeviz, ...)
+    profile_<command>_<timestamp>.txt    spans table, top-N functions, top allocations
+"""
+
+import io
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import CFScriptConfig as CFG
+
+DEFAULT_TOP = 30
+
+_lock = threading.Lock()
+_spans = {}   # name -> [count, total_seconds, max_seconds]
+
+# ---------------------------
+# Spans
+# ---------------------------
+@contextmanager
+def span(name):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        dt = time.perf_counter() - t0
+        with _lock:
+            s = _spans.get(name)
+            if s is None:
+                _spans[name] = [1, dt, dt]
+            else:
+                s[0] += 1
+                s[1] += dt
+                if dt > s[2]:
+                    s[2] = dt
+
+def spans():
+    with _lock:
+        return {name: {"count": c, "seconds": round(t, 6), "max_seconds": round(m, 6)}
+                for name, (c, t, m) in sorted(_spans.items(), key=lambda kv: -kv[1][1])}
+
+def reset_spans():
+    with _lock:
+        _spans.clear()
+
+def format_spans():
+    rows = spans()
+    if not rows:
+        return "(no spans recorded)\n"
+    out = [f"{'span':<16}{'count':>10}{'seconds':>14}{'max':>12}"]
+    for name, r in rows.items():
+        out.append(f"{name:<16}{r['count']:>10}{r['seconds']:>14.3f}{r['max_seconds']:>12.3f}")
+    return "\n".join(out) + "\n"
+
+# ---------------------------
+# Whole-command profiling
+# ---------------------------
+def run_profiled(func, args, label, top=DEFAULT_TOP, memory=False):
+    """Run func(args) under cProfile (and tracemalloc if memory=True); write the dump and summary to DEBUG_DIR."""
+    import cProfile
+    import pstats
+
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    base = CFG.DEBUG_DIR / f"profile_{label}_{stamp}"
+    reset_spans()
+    if memory:
+        tracemalloc.start()
+    prof = cProfile.Profile()
+    t0 = time.perf_counter()
+    try:
+        return prof.runcall(func, args)
+    finally:
+        wall = time.perf_counter() - t0
+        snapshot = tracemalloc.take_snapshot() if memory else None
+        peak = tracemalloc.get_traced_memory()[1] if memory else None
+        if memory:
+            tracemalloc.stop()
+
+        prof.dump_stats(str(base) + ".prof")
+        buf = io.StringIO()
+        buf.write(f"command: {label}\nwall seconds: {wall:.3f}\n\n== spans ==\n")
+        buf.write(format_spans())
+        buf.write(f"\n== top {top} functions by cumulative time ==\n")
+        pstats.Stats(prof, stream=buf).sort_stats("cumulative").print_stats(top)
+        buf.write(f"\n== top {top} functions by own time ==\n")
+        pstats.Stats(prof, stream=buf).sort_stats("tottime").print_stats(top)
+        if snapshot is not None:
+            buf.write(f"\n== memory: peak {peak / (1024 * 1024):.1f} MB; top {top} allocation sites ==\n")
+            for stat in snapshot.statistics("lineno")[:top]:
+                buf.write(f"{stat}\n")
+        (base.with_suffix(".txt")).write_text(buf.getvalue(), encoding="utf-8")
+
+        print(f"\n[profile] wall {wall:.2f}s; stage spans:\n{format_spans()}")
+        print(f"[profile] cProfile dump: {base}.prof (view with: python -m pstats {base}.prof)")
+        print(f"[profile] summary: {base}.txt")
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cloudflare Search-to-Purge Pipeline
+
+Replaces the 'search -f' -> CSV -> 'move -i' round trip. The time-bisection search runs in
+a background thread and every page's messages delivered to a purgable inbox
+(CFFullSearch.is_delivered_to_purgable) go straight into the concurrent move stage
+(CF_BULKMOVE.move_ids) through a CF_Pipeline.Feed, so the first moves are sent while later
+time slices are still being fetched. Records are streamed, never held as a full result set.
+
+Every action lands in the results CSV as it happens (the move CSV; IDs that could not be
+moved are also in <out>_failed.csv) and in a 'move' job of the CF_Journal.py journal, so
+'CFTools.py move --resume JOB_ID' finishes the moves of an interrupted purge (for the IDs
+its search had found). When the moves stop on a 401/403 the search stops too, and the
+summary counts the IDs moved, failed and never sent separately. With dry_run nothing is
+moved: the CSV lists what would have been, one row per postfix ID.
+"""
+
+import csv
+import threading
+import time
+
+import CFScriptConfig as CFG
+import CFFullSearch as CFSearch
+import CF_BULKMOVE as CFBulkMove
+import CF_Journal as CFJournal
+import CF_Metrics as CFMetrics
+import CF_Pipeline as CFPipeline
+
+DRY_RUN_FIELDNAMES = ["ts", "postfix_id", "message_id", "from", "subject", "recipient", "status", "destination"]
+
+def _purgable_ids(records, seen):
+    """(postfix_id, record) for each delivered-to-purgable record not seen before."""
+    out = []
+    for rec in records:
+        if not CFSearch.is_delivered_to_purgable(rec):
+            continue
+        pid = rec.get("postfix_id")
+        if pid and pid not in seen:
+            seen.add(pid)
+            out.append((pid, rec))
+    return out
+
+def purge(start_iso, end_iso, filters, destination, out_file, dry_run=False, workers=CFG.MOVE_WORKERS,
+          initial_slices=None, on_chunk=None):
+    """Search start..end with filters and move every delivered match to destination.
+    Returns (search_meta, failures); failures is the list of (postfix_id, error) not moved."""
+    seen = set()
+    search_meta = {}
+    started = time.perf_counter()
+
+    def _search(on_records, should_stop=None):
+        _, meta = CFSearch.fetch_all_by_time_divide_and_conquer(
+            start_iso, end_iso, per_page=CFG.PER_PAGE, on_records=on_records, keep_records=False,
+            initial_slices=initial_slices, on_chunk=on_chunk, should_stop=should_stop, **filters)
+        search_meta.update(meta)
+
+    if dry_run:
+        with open(out_file, "w", newline='', encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=DRY_RUN_FIELDNAMES, extrasaction='ignore')
+            writer.writeheader()
+
+            def on_records(records):
+                for pid, rec in _purgable_ids(records, seen):
+                    writer.writerow({"ts": rec.get("ts"), "postfix_id": pid, "message_id": rec.get("message_id"),
+                                     "from": CFSearch.record_sender(rec), "subject": CFSearch.record_subject(rec),
+                                     "recipient": "; ".join(rec.get("client_recipients") or []),
+                                     "status": "DRY_RUN", "destination": destination})
+                f.flush()
+
+            _search(on_records)
+        print(f"[dry-run] {len(seen)} delivered messages would be moved to {destination}; listed in {out_file}")
+        return search_meta, []
+
+    feed = CFPipeline.Feed()
+    job = CFJournal.create("move", {"destination": destination, "out_file": str(out_file), "source": "purge",
+                                    "start": start_iso, "end": end_iso, "filters": filters})
+
+    def on_records(records):
+        ids = [pid for pid, _ in _purgable_ids(records, seen)]
+        job.add(ids)
+        feed.put(ids)
+
+    def producer():
+        try:
+            # once the moves stop (401/403) there is no point in finding more IDs
+            _search(on_records, should_stop=lambda: feed.cancelled)
+        except Exception as e:
+            print("[error] search failed:", e)
+            search_meta["completed"] = False
+            search_meta["reason"] = f"search failed: {e}"
+        finally:
+            feed.close()
+
+    def first_move():
+        print(f"[info] first move accepted {time.perf_counter() - started:.1f}s after the search started")
+
+    search_thread = threading.Thread(target=CFMetrics.in_scope(producer), name="purge-search", daemon=True)
+    search_thread.start()
+    totals = {}
+    failures = CFBulkMove.move_ids(feed, destination, out_file, workers=workers, on_first_move=first_move, job=job,
+                                   totals=totals)
+    search_thread.join()
+    unsent = len(seen) - totals["answered"] - len(failures)
+    print(f"[done] purge: {len(seen)} delivered messages found, {totals['moved']} moved to {destination}, "
+          f"{len(seen) - totals['moved'] - unsent} failed, {unsent} not sent "
+          f"in {time.perf_counter() - started:.1f}s; search requests={search_meta.get('requests_made')}")
+    if unsent:
+        print(f"[info] the moves stopped ({totals['aborted']}); 'CFTools.py move --resume {job.id}' sends the rest "
+              f"once that is fixed")
+    return search_meta, failures
@@ -4,87 +4,210 @@ Created on Thu Dec  4 12:42:52 2025
 
 CLOUDLFARE - RELEASE FROM QUARANTINE
 
+Releases postfix IDs through CF_Pipeline.py: IDs are read from the input file as a stream,
+sent in size-bounded chunks with several in flight under the shared rate limiter, and a
+chunk the API rejects is retried in halves. Each ID's delivered / failed / undelivered
+recipients are written to the results CSV as its chunk comes back, and every ID's state is
+journalled (CF_Journal.py) so an interrupted release continues with --resume JOB_ID.
+
+    python CFTools.py release -i ids.csv
+    python CF_QuarantineRelease.py ids.txt
+
 @author: rasmit10
 """
 
-import requests
-import json
+import argparse
+import csv
 import sys
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
 
-import CFSearchConfig as CFG
-
-# -----------------------------------------------------------
-# USER CONFIG — TXT INPUT FILE
-# -----------------------------------------------------------
-
-INPUT_FILE = r"C:\Users\rasmit10\Dropbox\PC\Documents\quarantinerelease.txt" # EDIT THIS
-
-# -----------------------------------------------------------
-
-# Read postfix IDs from file
-try:
-    with open(INPUT_FILE, "r", encoding="utf-8") as f:
-        postfix_ids = [line.strip() for line in f if line.strip()]
-except Exception as e:
-    print(f"Could not read file: {e}")
-    sys.exit(1)
+import CFScriptConfig as CFG
+import CF_Decode as CFDecode
+import CF_Journal as CFJournal
+import CF_Metrics as CFMetrics
+import CF_Pipeline as CFPipeline
+import CF_Profile as CFProfile
 
-if not postfix_ids:
-    print("No postfix IDs found in input file.")
-    sys.exit(1)
-
-print(f"Loaded {len(postfix_ids)} postfix IDs.")
-print("Releasing from quarantine...\n")
+FIELDNAMES = ["postfix_id", "status", "delivered", "failed", "undelivered",
+              "delivered_to", "failed_to", "undelivered_to", "error"]
+READ_CHUNK = 1000   # IDs handed to the pipeline at a time while the input file is read
 
 # -----------------------------------------------------------
-# API REQUEST
+# INPUT — TXT (one ID per line) or CSV (postfix_id column, else the first column)
 # -----------------------------------------------------------
-
-url = CFG.API_BASE_URL + f"/investigate/release"
-
-headers = {
-    "X-Auth-Email": CFG.AUTH_EMAIL,
-    "X-Auth-Key": CFG.AUTH_KEY,
-    "Content-Type": "application/json",
-}
-
-# Cloudflare expects: ["id1", "id2", "id3"]
-payload = postfix_ids
-
-resp = requests.post(url, headers=headers, json=payload)
-
-# Attempt to decode JSON
-try:
-    data = resp.json()
-except:
-    print("Non-JSON response from Cloudflare:")
-    print(resp.text)
-    sys.exit(1)
-
-print(f"HTTP {resp.status_code}")
-print("\n=== FULL JSON RESPONSE ===")
-print(json.dumps(data, indent=2))
+def iter_postfix_ids(path):
+    """Yield postfix IDs from path without reading the whole file into memory: a .csv by its
+    postfix_id column (e.g. a search export) or first column, any other file one ID per line."""
+    path = Path(path)
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        if path.suffix.lower() != ".csv":
+            for line in f:
+                if line.strip():
+                    yield line.strip()
+            return
+        reader = csv.reader(f)
+        first = next(reader, None)
+        if first is None:
+            return
+        header = [c.strip().lower() for c in first]
+        col = next((header.index(n) for n in ("postfix_id", "postfix-id", "postfix indent") if n in header), None)
+        if col is None:
+            col = 0
+            rows = [first]
+        else:
+            rows = []
+        for r in rows:
+            if len(r) > col and r[col].strip():
+                yield r[col].strip()
+        for r in reader:
+            if len(r) > col and r[col].strip():
+                yield r[col].strip()
 
 # -----------------------------------------------------------
-# SIMPLE SUMMARY
+# API REQUEST
 # -----------------------------------------------------------
-
-result = data.get("result", [])
-
-print("\n=== RELEASE SUMMARY ===\n")
-
-if isinstance(result, dict):
-    result = [result]  # Cloudflare might return a single object
-
-for entry in result:
-    pid = entry.get("postfix_id", "<unknown>")
+def _send_chunk(url):
+    def send(batch):
+        # Cloudflare expects: ["id1", "id2", "id3"]
+        with CFProfile.span("fetch"):
+            response = CFG.session.post(url, json=batch)
+        with CFProfile.span("decode"):
+            try:
+                parsed, error = CFDecode.decode_response(response), None
+            except ValueError as e:
+                parsed, error = None, f"JSON decode error: {e}; body: {response.text[:300]}"
+        return CFPipeline.outcome_from_response(response, parsed, error)
+    return send
+
+def _row(pid, entry):
     delivered = entry.get("delivered") or []
     failed = entry.get("failed") or []
     undelivered = entry.get("undelivered") or []
+    status = "RELEASED" if delivered and not failed and not undelivered else "PARTIAL" if delivered else "FAILED"
+    return {"postfix_id": pid, "status": status, "delivered": len(delivered), "failed": len(failed),
+            "undelivered": len(undelivered), "delivered_to": ";".join(map(str, delivered)),
+            "failed_to": ";".join(map(str, failed)), "undelivered_to": ";".join(map(str, undelivered))}
+
+def release_ids(postfix_ids, out_file, workers=CFG.RELEASE_WORKERS, job=None, append=False):
+    """Release postfix IDs (a list, or a CF_Pipeline.Feed still being filled) and write one row
+    per ID to out_file as results come back. Returns {status: count}."""
+    url = CFG.API_BASE_URL + "/investigate/release"
+    feed = postfix_ids if isinstance(postfix_ids, CFPipeline.Feed) else CFPipeline.Feed(postfix_ids)
+    limits = CFPipeline.AdaptiveLimits(CFG.RELEASE_INITIAL_BATCH, CFG.RELEASE_MAX_BATCH, workers, CFG.MOVE_TARGET_LATENCY)
+    totals = {"RELEASED": 0, "PARTIAL": 0, "FAILED": 0}
+    append = append and Path(out_file).exists()
+
+    with open(out_file, "a" if append else "w", newline='', encoding="utf-8") as file:
+        writer = csv.DictWriter(file, fieldnames=FIELDNAMES, extrasaction='ignore')
+        if not append:
+            writer.writeheader()
+
+        def on_done(batch, outcome):
+            if outcome.ok:
+                by_id = {e.get("postfix_id"): e for e in outcome.results if isinstance(e, dict)}
+                for pid in batch:
+                    entry = by_id.get(pid)
+                    row = _row(pid, entry) if entry is not None else {"postfix_id": pid, "status": "FAILED",
+                                                                      "error": "missing from the API's response"}
+                    writer.writerow(row)
+                    totals[row["status"]] += 1
+                    if job is not None:
+                        if row["status"] == "FAILED":
+                            job.failed(pid, row.get("error") or f"no recipient delivered ({row['failed']} failed, {row['undelivered']} undelivered)")
+                        else:
+                            job.done(pid, entry)
+            else:
+                for pid in batch:
+                    writer.writerow({"postfix_id": pid, "status": "FAILED", "error": outcome.error})
+                    totals["FAILED"] += 1
+                    if job is not None:
+                        job.failed(pid, outcome.error)
+                print(f"[error] {', '.join(batch)}: {outcome.error}")
+            file.flush()
+            done = sum(totals.values())
+            if outcome.ok:
+                print(f"[info] released chunk of {len(batch)} in {outcome.latency:.1f}s ({done}/{feed.total} IDs done)")
+
+        try:
+            with CFProfile.span("release"):
+                stats = CFPipeline.run_batches(feed, _send_chunk(url), on_done, limits, url=url, label="release",
+                                               on_submit=job.in_flight if job is not None else None)
+        finally:
+            if job is not None:
+                job.close()
+
+    print(f"[info] {stats['requests']} requests, {stats['retries']} retries, {stats['splits']} split chunks; "
+          f"final chunk size {stats['batch_size']}, {stats['in_flight']} in flight")
+    # a resumed job lists the failures of its earlier runs too
+    failures = job.failures() if job is not None else []
+    if failures:
+        _write_failures(out_file, failures)
+    return totals
+
+def _write_failures(out_file, failures):
+    failed_file = CFPipeline.write_failures(CFPipeline.failed_path(out_file), failures)
+    print(f"{len(failures)} postfix IDs not released; listed in {failed_file}")
 
-    print(f"Postfix ID: {pid}")
-    print(f"  Delivered   : {len(delivered)}")
-    print(f"  Failed      : {len(failed)}")
-    print(f"  Undelivered : {len(undelivered)}\n")
-
-print("Done.")
+# -----------------------------------------------------------
+# SIMPLE SUMMARY
+# -----------------------------------------------------------
+def print_summary(totals, out_file):
+    print("\n=== RELEASE SUMMARY ===\n")
+    print(f"  Released            : {totals['RELEASED']}")
+    print(f"  Partially delivered : {totals['PARTIAL']}")
+    print(f"  Failed              : {totals['FAILED']}")
+    print(f"\nPer-ID results saved to {out_file}")
+
+def release_file(input_file, out_file=None, workers=CFG.RELEASE_WORKERS, resume=None):
+    """Release every ID in input_file (or what is left of journalled job resume). Returns an exit code."""
+    if resume:
+        job = CFJournal.open_job(resume, kind="release")
+        out_file = job.params.get("out_file") or out_file
+        feed = CFPipeline.Feed(job.remaining())
+        print(f"Resuming job {job.id}: {feed.total} postfix IDs left to release.")
+    else:
+        if not Path(input_file).exists():
+            print(f"Could not read file: {input_file} does not exist")
+            return 1
+        out_file = out_file or f"release_results_{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}.csv"
+        job = CFJournal.create("release", {"in_file": str(input_file), "out_file": str(out_file)})
+        feed = CFPipeline.Feed()
+
+        def reader():
+            chunk = []
+            try:
+                for pid in iter_postfix_ids(input_file):
+                    chunk.append(pid)
+                    if len(chunk) >= READ_CHUNK:
+                        job.add(chunk)
+                        feed.put(chunk)
+                        chunk = []
+                job.add(chunk)
+                feed.put(chunk)
+            except Exception as e:
+                print(f"[error] could not read {input_file}: {e}")
+            finally:
+                feed.close()
+
+        threading.Thread(target=CFMetrics.in_scope(reader), name="release-reader", daemon=True).start()
+
+    print("Releasing from quarantine...\n")
+    totals = release_ids(feed, out_file, workers=workers, job=job, append=bool(resume))
+    if not sum(totals.values()) and not resume:
+        print("No postfix IDs found in input file.")
+        return 1
+    print_summary(totals, out_file)
+    return 1 if totals["FAILED"] else 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Release messages from quarantine.')
+    parser.add_argument('input_file', nargs='?', default=None, help='CSV (postfix_id column) or text file with one postfix ID per line.')
+    parser.add_argument('-o', '--output_file', action='store', dest='output_file', default=None, help='Per-ID results CSV. Default: release_results_<timestamp>.csv')
+    parser.add_argument('-w', '--workers', action='store', dest='workers', type=int, default=CFG.RELEASE_WORKERS, help='Chunks in flight.')
+    parser.add_argument('--resume', action='store', dest='resume', default=None, help='Continue a journalled release job (see CFTools.py jobs).')
+    args = parser.parse_args()
+    if not (args.input_file or args.resume):
+        parser.error("an input file or --resume JOB_ID is required")
+    sys.exit(release_file(args.input_file, args.output_file, workers=args.workers, resume=args.resume))
@@ -7,54 +7,174 @@ Created on Thu Dec  4 10:47:16 2025
 
 # -*- coding: utf-8 -*-
 """
-Fetch raw EML for one Cloudflare postfix_id
+Fetch raw EML for Cloudflare postfix IDs
+
+Run on its own it asks for one postfix_id and prints the message. For many IDs
+('CFTools.py raw -i ids.csv', or download_raw()), messages are fetched with
+CF_Pipeline.run_per_id and each body is streamed to disk in RAW_CHUNK_BYTES pieces while it is hashed, never held
+whole in memory. Files are stored by content:
+
+    <store>/objects/<first 2 hex>/<sha256>.eml
+    <store>/manifest.csv     postfix_id, sha256, path, bytes, fetched_at
+
+so a message fetched under two postfix IDs is saved once, and IDs already in the
+manifest (with their file present) are skipped on the next run.
 """
 
-import requests
+import csv
+import hashlib
+import os
 import sys
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
 
-import CFSCriptConfig as CFG
+import CFScriptConfig as CFG
+import CF_Decode as CFDecode
+import CF_Pipeline as CFPipeline
+import CF_Profile as CFProfile
 
+MANIFEST_FIELDS = ["postfix_id", "sha256", "path", "bytes", "fetched_at"]
 
 # -----------------------------------------------------------
-# USER INPUT — one postfix ID
+# CONTENT-ADDRESSED STORE
 # -----------------------------------------------------------
+class RawStore:
+    def __init__(self, root):
+        self.root = Path(root)
+        self.objects = self.root / "objects"
+        self.manifest_path = self.root / "manifest.csv"
+        self.objects.mkdir(parents=True, exist_ok=True)
 
-POSTFIX_ID = input("Enter postfix_id: ").strip()
+    def object_path(self, sha256):
+        return self.objects / sha256[:2] / f"{sha256}.eml"
 
-if not POSTFIX_ID:
-    print("No postfix_id entered. Exiting.")
-    sys.exit(1)
+    def stored_ids(self):
+        """postfix_id -> sha256 for manifest entries whose file is still on disk."""
+        stored = {}
+        if not self.manifest_path.exists():
+            return stored
+        with open(self.manifest_path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                if row.get("sha256") and self.object_path(row["sha256"]).exists():
+                    stored[row["postfix_id"]] = row["sha256"]
+        return stored
+
+    def write_stream(self, chunks):
+        """Write an iterable of byte chunks into the store; returns (sha256, path, bytes, new)."""
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp = tempfile.mkstemp(dir=self.objects, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    if chunk:
+                        digest.update(chunk)
+                        f.write(chunk)
+                        size += len(chunk)
+            sha256 = digest.hexdigest()
+            path = self.object_path(sha256)
+            if path.exists():
+                os.remove(tmp)
+                return sha256, path, size, False
+            path.parent.mkdir(exist_ok=True)
+            os.replace(tmp, path)   # same content under the same name, so a concurrent writer is harmless
+            return sha256, path, size, True
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
 
 # -----------------------------------------------------------
 # API REQUEST
 # -----------------------------------------------------------
-url = CFG.API_BASE_URL + f"/investigate/{POSTFIX_ID}/raw"
+def _store_body(store):
+    def handle(pid, resp):
+        if "json" in resp.headers.get("Content-Type", ""):
+            # no rfc822 from this endpoint: the EML comes back as a JSON string and has to be read whole
+            result = (CFDecode.decode_response(resp).get("result") or {})
+            chunks = [str(result.get("raw") or "").encode("utf-8")]
+        else:
+            chunks = resp.iter_content(chunk_size=CFG.RAW_CHUNK_BYTES)
+        with CFProfile.span("write"):
+            sha256, path, size, new = store.write_stream(chunks)
+        return CFPipeline.BatchOutcome(True, results=[{"postfix_id": pid, "sha256": sha256, "path": path,
+                                                       "bytes": size, "new": new}], status=200)
+    return CFPipeline.get_one("/investigate/{pid}/raw", handle, stream=True, headers={"Accept": "message/rfc822"})
 
-headers = {
-    "X-Auth-Email": CFG.AUTH_EMAIL,
-    "X-Auth-Key": CFG.AUTH_KEY,
-    "Accept": "message/rfc822",   # asks for raw EML
-}
+# -----------------------------------------------------------
+# BULK DOWNLOAD
+# -----------------------------------------------------------
+def download_raw(postfix_ids, store_dir, workers=CFG.RAW_WORKERS):
+    """Fetch the raw EML of every postfix ID into the store at store_dir.
+    Returns {"stored", "duplicates", "skipped", "failed"} counts."""
+    store = RawStore(store_dir)
+    already = store.stored_ids()
+    todo, seen = [], set()
+    for pid in postfix_ids:
+        if pid not in seen and pid not in already:
+            todo.append(pid)
+        seen.add(pid)
+    counts = {"stored": 0, "duplicates": 0, "skipped": len(seen) - len(todo), "failed": 0}
+    print(f"[info] {len(seen)} postfix IDs; {counts['skipped']} already in {store.manifest_path}, fetching {len(todo)}")
+    if not todo:
+        return counts
 
-print(f"\nRequesting raw EML for {POSTFIX_ID}...\n")
+    write_header = not store.manifest_path.exists()
+    with open(store.manifest_path, "a", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=MANIFEST_FIELDS, extrasaction="ignore")
+        if write_header:
+            writer.writeheader()
 
-resp = requests.get(url, headers=headers)
+        def on_result(pid, outcome):
+            entry = outcome.results[0]
+            counts["stored" if entry["new"] else "duplicates"] += 1
+            writer.writerow(dict(entry, path=entry["path"].relative_to(store.root).as_posix(),
+                                 fetched_at=datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")))
+            f.flush()
+            done = counts["stored"] + counts["duplicates"]
+            if done % 100 == 0:
+                print(f"[info] {done}/{len(todo)} fetched")
+
+        with CFProfile.span("raw"):
+            failures = CFPipeline.run_per_id(todo, _store_body(store), on_result, workers, "raw",
+                                             failed_file=store.root / "manifest_failed.csv")
+    counts["failed"] = len(failures)
+    print(f"[success] {counts['stored']} new files, {counts['duplicates']} duplicates of stored content, "
+          f"{counts['skipped']} already stored; manifest: {store.manifest_path}")
+    return counts
 
 # -----------------------------------------------------------
-# HANDLE RESPONSE
+# USER INPUT — one postfix ID
 # -----------------------------------------------------------
-if resp.status_code == 200:
-    print("===== RAW EML START =====\n")
-    try:
-        # Decode as text; EML headers are ASCII-safe
-        print(resp.content.decode("utf-8", errors="replace"))
-    except:
-        print(resp.text)
-    print("\n===== RAW EML END =====")
-else:
-    print(f"HTTP {resp.status_code} ERROR")
-    try:
-        print(resp.json())
-    except:
-        print(resp.text)
+def print_raw(postfix_id):
+    url = CFG.API_BASE_URL + f"/investigate/{postfix_id}/raw"
+    headers = {
+        "Accept": "message/rfc822",   # asks for raw EML
+    }
+
+    print(f"\nRequesting raw EML for {postfix_id}...\n")
+    resp = CFG.session.get(url, headers=headers)
+
+    if resp.status_code == 200:
+        print("===== RAW EML START =====\n")
+        try:
+            # Decode as text; EML headers are ASCII-safe
+            print(resp.content.decode("utf-8", errors="replace"))
+        except:
+            print(resp.text)
+        print("\n===== RAW EML END =====")
+    else:
+        print(f"HTTP {resp.status_code} ERROR")
+        try:
+            print(resp.json())
+        except:
+            print(resp.text)
+
+if __name__ == "__main__":
+    POSTFIX_ID = input("Enter postfix_id: ").strip()
+
+    if not POSTFIX_ID:
+        print("No postfix_id entered. Exiting.")
+        sys.exit(1)
+    print_raw(POSTFIX_ID)
@@ -7,8 +7,17 @@ Created on Tue Dec  2 15:14:49 2025
 import requests
 from pathlib import Path
 import csv
+import json
+import time
+from collections import Counter
+from datetime import datetime, timezone
 
 import CFScriptConfig as CFG
+import CFFullSearch as CFSearch
+import CF_Decode as CFDecode
+import CF_Journal as CFJournal
+import CF_Pipeline as CFPipeline
+import CF_Profile as CFProfile
 
 def read_postfix_id_csv(path): # pyright: ignore[reportMissingParameterType]
     path = Path(path)
@@ -38,6 +47,131 @@ def read_postfix_id_csv(path): # pyright: ignore[reportMissingParameterType]
             ids.append(v)
     return ids
 
+# ---------------------------
+# Candidate ranking
+# ---------------------------
+def read_candidates(path):
+    """Rows of the input CSV as dicts with at least 'postfix_id'. A search export keeps its other
+    columns (ts, is_quarantined, final_disposition, ...), which rank_candidates uses."""
+    with open(path, newline="", encoding="utf-8-sig") as cf:
+        reader = csv.DictReader(cf)
+        fields = {(f or "").strip().lower(): f for f in reader.fieldnames or []}
+        key = next((fields[n] for n in ("postfix_id", "postfix-id", "postfix indent") if n in fields), None)
+        if key is not None:
+            return [dict(row, postfix_id=row[key].strip()) for row in reader if (row.get(key) or "").strip()]
+    return [{"postfix_id": pid} for pid in read_postfix_id_csv(path)]
+
+def _truthy(value):
+    if isinstance(value, bool) or value is None:
+        return value
+    v = str(value).strip().lower()
+    return True if v == "true" else False if v == "false" else None
+
+def _age_hours(row, now):
+    ts = CFSearch._parse_iso_to_dt_or_none(str(row.get("ts") or row.get("sent_date") or ""))
+    return (now - ts).total_seconds() / 3600 if ts else None
+
+def rank_candidates(rows, disposition, rejections, skip_known=True):
+    """Order candidates so the likely-accepted ones go first; returns (ranked_rows, skipped).
+
+    skipped lists (postfix_id, reason) for IDs the rejection cache says will be refused
+    (none when skip_known is False). The rest are tiered, then within a tier ordered by age in
+    whole days, delivered before quarantined within a day, and newest first:
+      0  metadata known and nothing against it
+      1  no timestamp (not in the CSV or the local index)
+      2  older than RECLASSIFY_RAW_RETENTION_HOURS, so the raw message is likely gone
+      3  already carrying the requested disposition
+    Rows without metadata are looked up in the local index (CF_LocalIndex.py) when it is enabled.
+    """
+    missing = [r["postfix_id"] for r in rows if not (r.get("ts") or r.get("sent_date"))]
+    if missing and CFG.LOCAL_INDEX_ENABLED:
+        try:
+            import CF_LocalIndex
+            known = CF_LocalIndex.records_by_postfix_id(missing)
+            rows = [dict(known[r["postfix_id"]], **{k: v for k, v in r.items() if v}) if r["postfix_id"] in known else r
+                    for r in rows]
+        except Exception as e:
+            print("[debug] local index lookup failed:", e)
+
+    now = datetime.now(timezone.utc)
+    retention = CFG.RECLASSIFY_RAW_RETENTION_HOURS or None
+    ranked, skipped = [], []
+    for i, row in enumerate(rows):
+        pid = row["postfix_id"]
+        reason = skip_known and rejections.skip_reason(pid, disposition)
+        if reason:
+            skipped.append((pid, reason))
+            continue
+        age = _age_hours(row, now)
+        if str(row.get("final_disposition") or "").upper() == disposition.upper():
+            tier = 3
+        elif age is None:
+            tier = 1
+        elif retention is not None and age > retention:
+            tier = 2
+        else:
+            tier = 0
+        quarantined = _truthy(row.get("is_quarantined"))
+        age_key = age if age is not None else 0   # only tier 1 has no age, and there file order decides
+        ranked.append(((tier, age_key // 24, {False: 0, None: 1, True: 2}[quarantined], age_key, i), row))
+    ranked.sort(key=lambda kv: kv[0])
+    return [row for _, row in ranked], skipped
+
+# ---------------------------
+# Rejection cache (debug/reclassify_rejections.json)
+# ---------------------------
+# HTTP statuses that refuse this one message: the API understood the request and will not
+# reclassify it. Only these are cached. 401/403 (credentials), 404 (as often a wrong account or
+# route as an unknown ID), 429 and 5xx say nothing about the message. The API's error codes are
+# not documented, so they are kept for the report but not acted on.
+REJECTION_STATUSES = frozenset({400, 422})
+
+class RejectionCache:
+    """postfix ID -> the API's last refusal (status, code, disposition, when), kept
+    RECLASSIFY_REJECTION_TTL_DAYS. An ID is skipped when it was refused for the same disposition."""
+
+    VERSION = 2
+
+    def __init__(self, path=None):
+        self.path = Path(path or CFG.RECLASSIFY_REJECTIONS)
+        self.entries = {}
+        self.dirty = False
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            data = {}
+        if data.get("version") != self.VERSION:
+            data = {}   # earlier files also cached auth errors and 404s
+        cutoff = time.time() - CFG.RECLASSIFY_REJECTION_TTL_DAYS * 86400
+        self.entries = {pid: e for pid, e in (data.get("entries") or {}).items() if e.get("at", 0) >= cutoff}
+
+    def skip_reason(self, pid, disposition):
+        e = self.entries.get(pid)
+        if e is None or e.get("disposition") != disposition.upper():
+            return None
+        return f"refused as {e['disposition']} before ({e['code']})"
+
+    def record(self, pid, outcome, disposition):
+        """Remember a refusal; anything but a REJECTION_STATUSES answer is ignored."""
+        if outcome.status not in REJECTION_STATUSES:
+            return False
+        self.entries[pid] = {"status": outcome.status, "code": outcome.code, "disposition": disposition.upper(),
+                             "at": time.time()}
+        self.dirty = True
+        return True
+
+    def forget(self, pid):
+        if self.entries.pop(pid, None) is not None:
+            self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"version": self.VERSION, "entries": self.entries}), encoding="utf-8")
+        tmp.replace(self.path)
+        self.dirty = False
+
 def reclassify_message(postfix_id=None, disposition=None):
     VALID_DISPOSITIONS=["NONE", "BULK", "MALICIOUS", "SPAM", "SPOOF", "SUSPICIOUS"]
     
@@ -51,42 +185,125 @@ def reclassify_message(postfix_id=None, disposition=None):
     url = CFG.API_BASE_URL + f"/investigate/{postfix_id}/reclassify"
     
     print(f"Making request to {url} with body {body}")
-    r = CFG.session.post(url, json=body, timeout=CFG.TIMEOUT)
+    r = CFG.session.post(url, json=body)
 
     if(r.status_code == 202):
         print(f'\n[success] message submitted with disposition: {disposition}')
     else:
         print(r)
 
-def bulk_reclassify(input_file, num_submissions, disposition):
+def _send_one(disposition):
     body = {
         "expected_disposition": disposition.upper()
-    }  
-    
-    num_successes = 0
-    successful_ids = []
-    postfix_ids = read_postfix_id_csv(input_file)
+    }
+    def send(batch):
+        url = CFG.API_BASE_URL + f"/investigate/{batch[0]}/reclassify"
+        with CFProfile.span("fetch"):
+            r = CFG.session.post(url, json=body)
+        try:
+            parsed = CFDecode.decode_response(r) if r.content else None
+        except ValueError:
+            parsed = None      # a non-JSON error body is reported by its HTTP status
+        if r.status_code == 202:
+            return CFPipeline.BatchOutcome(True, status=r.status_code)
+        if r.status_code in (200, 201, 204):
+            # accepted codes other than 202 are not a submission; report them like any other refusal
+            outcome = CFPipeline.BatchOutcome(False, error=f"HTTP {r.status_code}: not accepted", status=r.status_code)
+            outcome.code = f"HTTP {r.status_code}"
+            return outcome
+        return CFPipeline.outcome_from_response(r, parsed)
+    return send
 
-    print(f"Loaded {len(postfix_ids)} ids to reclassify. Submitting until {num_submissions} are successful. Expect a lot of errors.")
+def bulk_reclassify(input_file, num_submissions, disposition, resume=None, workers=CFG.RECLASSIFY_WORKERS,
+                    rank=True, use_cache=True):
+    """Submit IDs from input_file until num_submissions are accepted, with up to `workers`
+    submissions in flight (CF_Pipeline.py). Once the target is reached nothing more is sent;
+    submissions already in flight still finish, so at most workers - 1 extra can be accepted.
+    Candidates are tried in rank_candidates order (rank=False keeps the CSV order), and IDs the
+    rejection cache knows will be refused are skipped (use_cache=False tries them anyway).
+    Every attempt is journalled (CF_Journal.py); resume=JOB_ID continues that job with its
+    original disposition and target. Returns the list of accepted postfix IDs."""
+    rejections = RejectionCache()
+    if resume:
+        job = CFJournal.open_job(resume, kind="reclassify")
+        disposition, num_submissions = job.params["disposition"], job.params["num_submissions"]
+        already = job.counts().get(CFJournal.DONE, 0)
+        postfix_ids = job.remaining()
+        print(f"Resuming job {job.id}: {already}/{num_submissions} already accepted, {len(postfix_ids)} ids left to try.")
+        if use_cache:
+            postfix_ids = [pid for pid in postfix_ids if not rejections.skip_reason(pid, disposition)]
+    else:
+        already = 0
+        with CFProfile.span("read"):
+            rows = read_candidates(input_file)
+        print(f"Loaded {len(rows)} ids to reclassify.")
+        with CFProfile.span("rank"):
+            if rank:
+                rows, skipped = rank_candidates(rows, disposition, rejections, skip_known=use_cache)
+            else:
+                skipped = [(r["postfix_id"], rejections.skip_reason(r["postfix_id"], disposition)) for r in rows] if use_cache else []
+                skipped = [(pid, reason) for pid, reason in skipped if reason]
+                skipped_ids = {pid for pid, _ in skipped}
+                rows = [r for r in rows if r["postfix_id"] not in skipped_ids]
+        if skipped:
+            print(f"[info] skipping {len(skipped)} ids the API already refused (--retry-rejected to try them anyway)")
+        postfix_ids = [r["postfix_id"] for r in rows]
+        job = CFJournal.create("reclassify", {"disposition": disposition, "num_submissions": int(num_submissions),
+                                              "in_file": str(input_file)}, postfix_ids)
+        print(f"Submitting {len(postfix_ids)} ids until {num_submissions} are successful ({workers} in flight).")
 
+    target = int(num_submissions)
+    successful_ids = []
+    errors = Counter()          # error code -> count
+    samples = {}                # error code -> first error message seen
+    unfinished = []
 
-    for id in postfix_ids:
-        url = CFG.API_BASE_URL + f"/investigate/{id}/reclassify"
-        r = CFG.session.post(url, json=body, timeout=CFG.TIMEOUT)
-        if r.status_code == 202:
-            num_successes += 1
-            successful_ids.append(id)
-            print(f"message {id} resubmitted as {disposition}. {num_successes}/{num_submissions} completed.")
+    def on_done(batch, outcome):
+        pid = batch[0]
+        if outcome.ok:
+            successful_ids.append(pid)
+            rejections.forget(pid)
+            job.done(pid, {"status": outcome.status})
+            print(f"message {pid} resubmitted as {disposition}. {already + len(successful_ids)}/{target} completed.")
+        elif outcome.transient or outcome.auth:
+            # throttled or server error after the retries ran out, credentials refused, or cut short by the stop: left for --resume
+            unfinished.append(pid)
         else:
-            print(f"failed to resubmit {id} with error {r.json()["errors"][0]["code"]}")
-        
-        if num_successes >= int(num_submissions):
-            print(f"[success] reclassified {successful_ids} as {disposition}")
-            break
-    if num_successes > 0:
-        print(f"[partial success] reclassified {successful_ids} as {disposition}. {num_submissions} of desired {num_submissions} mesasges were submitted.")
+            errors[outcome.code] += 1
+            rejections.record(pid, outcome, disposition)
+            samples.setdefault(outcome.code, outcome.error)
+            job.failed(pid, outcome.error)
+            print(f"failed to resubmit {pid} with error {outcome.error}")
+
+    limits = CFPipeline.AdaptiveLimits(1, 1, max(1, int(workers)), CFG.MOVE_TARGET_LATENCY)
+    url = CFG.API_BASE_URL + "/investigate/{id}/reclassify"
+    try:
+        if already < target and postfix_ids:
+            stats = CFPipeline.run_batches(postfix_ids, _send_one(disposition), on_done, limits, url=url, label="reclassify",
+                                           on_submit=job.in_flight,
+                                           should_stop=lambda: already + len(successful_ids) >= target)
+        else:
+            stats = {"requests": 0, "retries": 0, "stopped_early": False}
+    finally:
+        job.close(status="done" if already + len(successful_ids) >= target else None)
+        rejections.save()
+
+    accepted = already + len(successful_ids)
+    print(f"\n[info] {stats['requests']} submissions ({stats['retries']} retried after 429/5xx), "
+          f"{sum(errors.values())} rejected, {len(unfinished)} left unfinished")
+    if errors:
+        print("[info] rejections by error code:")
+        for code, n in errors.most_common():
+            print(f"  {n:>6}  {samples[code]}")
+    if accepted > target:
+        print(f"[info] {accepted - target} more than the target were accepted (they were already in flight).")
+    if accepted >= target:
+        print(f"[success] reclassified {successful_ids} as {disposition}")
+    elif accepted > 0:
+        print(f"[partial success] reclassified {successful_ids} as {disposition}. {accepted} of desired {target} mesasges were submitted.")
     else:
         print("[error] no messages are able to be submitted. Consider uploading a .eml file via the GUI.")
+    return successful_ids
 
 if __name__ == "__main__":
     POSTFIX_ID = "4dSd1n3JVjz16PyJ"         # <-- change this
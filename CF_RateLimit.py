@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cloudflare API Rate Limiter
+
+A limiter shared by every request made through CFG.session. The defaults mirror the
+Cloudflare API's per-user limit (1200 requests per 5 minutes) with two checks:
+
+  - a token bucket paces requests at RATE_LIMIT_RPS, with a small burst
+    (RATE_LIMIT_BURST) so a rested run does not have to wait for its first requests;
+  - a sliding window keeps the send times of the last RATE_LIMIT_WINDOW seconds and holds
+    a request back while RATE_LIMIT_WINDOW_MAX were already sent in it. A bucket alone
+    allows burst + rate * window requests in a window, a little over the API's limit.
+
+The daemon (CF_Daemon.py) keeps the limiter across commands, so back-to-back playbook runs
+share it instead of each assuming a fresh allowance.
+"""
+
+import threading
+import time
+from collections import deque
+
+import CFScriptConfig as CFG
+import CF_Metrics as CFMetrics
+
+class TokenBucket:
+    def __init__(self, rate, burst, window=0.0, window_max=0):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.window = float(window)
+        self.window_max = int(window_max) if window else 0
+        self.sent = deque()     # monotonic send times within the last `window` seconds
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _window_wait(self, now, n):
+        """Seconds until n more requests fit in the window (0 when they fit now)."""
+        while self.sent and self.sent[0] <= now - self.window:
+            self.sent.popleft()
+        over = len(self.sent) + n - self.window_max
+        if not self.window_max or over <= 0:
+            return 0.0
+        return self.sent[min(over, len(self.sent)) - 1] + self.window - now
+
+    def acquire(self, n=1):
+        """Take n tokens, sleeping (accounted as pacing in CF_Metrics) until they are available."""
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = max((n - self.tokens) / self.rate, self._window_wait(now, n))
+                if wait <= 0:
+                    self.tokens -= n
+                    if self.window_max:
+                        self.sent.extend([now] * n)
+                    return
+            CFMetrics.sleep(wait)
+
+    def available(self):
+        with self.lock:
+            self._refill(time.monotonic())
+            return self.tokens
+
+    def in_window(self):
+        with self.lock:
+            self._window_wait(time.monotonic(), 0)
+            return len(self.sent)
+
+limiter = TokenBucket(CFG.RATE_LIMIT_RPS, CFG.RATE_LIMIT_BURST, CFG.RATE_LIMIT_WINDOW, CFG.RATE_LIMIT_WINDOW_MAX)
+
+def acquire(n=1):
+    limiter.acquire(n)
+
+def status():
+    return {"rate_per_second": limiter.rate, "burst": limiter.burst, "tokens": round(limiter.available(), 1),
+            "window_seconds": limiter.window, "window_max": limiter.window_max, "sent_in_window": limiter.in_window()}
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cloudflare Settings Snapshot Store
+
+Local SQLite copy (CFG.SETTINGS_SNAPSHOT_PATH) of the settings lists every check reads:
+settings/allow_policies, settings/block_senders and settings/domains. get_allow_policies,
+get_block_senders and get_domains answer from it, and only touch the API when the
+snapshot is older than SETTINGS_MAX_AGE seconds:
+
+  - first sync (or --full): page 1 gives total_count, the remaining pages are fetched
+    SETTINGS_WORKERS at a time under the shared rate limiter;
+  - later syncs send page 1 with If-None-Match (the list's last ETag); a 304 means
+    nothing changed. Otherwise pages are read newest first (order=last_modified,
+    direction=desc) and only until an entry older than the snapshot's newest
+    last_modified is reached; those entries are upserted.
+
+An incremental sync falls back to a full one when it cannot be trusted: an HTTP error
+(not an unreachable API) or undecodable page (e.g. the API does not support
+order=last_modified), entries without last_modified, pages the API did not return in
+that order, or a total_count that differs from the merged snapshot. A deletion that coincides with an addition leaves total_count
+unchanged, so a list whose last full sync is older than SETTINGS_FULL_SYNC_AGE is always
+synced in full. Each list remembers the API_BASE_URL it was synced from; a snapshot of
+another account or API is never served, it is replaced by a full sync. When a due sync
+fails (SettingsFetchError), lookups keep answering from the existing snapshot, with a warning.
+
+    python CFTools.py settings sync [--full]
+    python CFTools.py settings status
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import requests
+
+import CFScriptConfig as CFG
+import CF_Decode as CFDecode
+import CF_Metrics as CFMetrics
+import CF_Pipeline as CFPipeline
+
+LISTS = ("allow_policies", "block_senders", "domains")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    name TEXT PRIMARY KEY,
+    synced_at REAL,
+    etag TEXT,
+    high_water TEXT,
+    total INTEGER,
+    mode TEXT,
+    full_at REAL,
+    source TEXT
+);
+CREATE TABLE IF NOT EXISTS entries (
+    name TEXT,
+    key TEXT,
+    seq INTEGER,
+    last_modified TEXT,
+    body TEXT,
+    PRIMARY KEY (name, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_entries_seq ON entries(name, seq);
+"""
+
+_lock = threading.RLock()
+_conn = None
+
+class IncrementalSyncError(Exception):
+    """The incremental answer cannot be trusted; do a full sync."""
+
+class SettingsFetchError(Exception):
+    """A settings page could not be fetched: an HTTP error, or retries (429 / 5xx / connection) ran out.
+    status is the last HTTP status, None when the API never answered."""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+# ---------------------------
+# Connection
+# ---------------------------
+def _db():
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(str(CFG.SETTINGS_SNAPSHOT_PATH), check_same_thread=False)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("PRAGMA synchronous=NORMAL")
+        _conn.executescript(_SCHEMA)
+        cols = {row[1] for row in _conn.execute("PRAGMA table_info(snapshots)")}
+        for col, kind in (("full_at", "REAL"), ("source", "TEXT")):
+            if col not in cols:
+                _conn.execute(f"ALTER TABLE snapshots ADD COLUMN {col} {kind}")
+    return _conn
+
+def _key(entry):
+    if entry.get("id") is not None:
+        return str(entry["id"])
+    return json.dumps(entry, sort_keys=True, default=str)
+
+# ---------------------------
+# API pages
+# ---------------------------
+def _url(name):
+    return CFG.API_BASE_URL + f"/settings/{name}"
+
+def _get_page(name, page, extra=None, headers=None):
+    """(response, entries, result_info) for one page; retries 429 / 5xx / connection errors, raises SettingsFetchError."""
+    url = _url(name)
+    params = dict({"page": page, "per_page": CFG.PER_PAGE}, **(extra or {}))
+    last_exc = None
+    for attempt in range(CFG.MAX_RETRIES):
+        try:
+            r = CFG.session.get(url, params=params, headers=headers)
+        except requests.RequestException as e:
+            last_exc = SettingsFetchError(f"{name} page {page}: {e}")
+            CFMetrics.sleep((2 ** attempt) * 0.5, "backoff", url=url)
+            continue
+        if r.status_code in (429, 500, 502, 503, 504):
+            last_exc = SettingsFetchError(f"{name} page {page}: HTTP {r.status_code}", r.status_code)
+            CFMetrics.record_retry(url)
+            delay = CFPipeline.retry_after_seconds(r)
+            CFMetrics.sleep((2 ** attempt) * 0.5 + CFG.RATE_LIMIT_SLEEP if delay is None else delay, "backoff", url=url)
+            continue
+        if r.status_code == 304:
+            return r, None, {}
+        if r.status_code >= 400:
+            try:
+                parsed = CFDecode.decode_response(r)
+            except ValueError:
+                parsed = None
+            error = CFPipeline.api_error(parsed, r)
+            raise SettingsFetchError(f"{name} page {page}: {error if error.startswith('HTTP') else f'HTTP {r.status_code}, {error}'}",
+                                     r.status_code)
+        data = CFDecode.decode_response(r)
+        items = data.get("result") or []
+        if not isinstance(items, list):
+            items = list(items) if items else []
+        return r, items, data.get("result_info") or {}
+    raise last_exc if last_exc else SettingsFetchError(f"{name} page {page}: unknown request failure")
+
+def fetch_all(name):
+    """Every entry of a settings list, in API order: page 1, then the rest concurrently. Returns (entries, etag)."""
+    r, first, info = _get_page(name, 1)
+    etag = r.headers.get("ETag")
+    total = info.get("total_count")
+    if total is None or len(first) < CFG.PER_PAGE:
+        # no total to plan from: page on until a short page, as the original fetch did
+        entries, page, items = list(first), 1, first
+        while len(items) >= CFG.PER_PAGE:
+            page += 1
+            _, items, _ = _get_page(name, page)
+            entries.extend(items)
+        return entries, etag
+    pages = range(2, -(-int(total) // CFG.PER_PAGE) + 1)
+    with ThreadPoolExecutor(max_workers=CFG.SETTINGS_WORKERS) as pool:
+        rest = list(pool.map(CFMetrics.in_scope(lambda p: _get_page(name, p)[1]), pages))
+    entries = list(first)
+    for items in rest:
+        entries.extend(items)
+    return entries, etag
+
+# ---------------------------
+# Snapshot
+# ---------------------------
+_STATE_COLS = ("synced_at", "etag", "high_water", "total", "mode", "full_at", "source")
+
+def _state(name):
+    """The list's snapshot row, or None when it was never synced from the current API_BASE_URL."""
+    with _lock:
+        row = _db().execute(f"SELECT {', '.join(_STATE_COLS)} FROM snapshots WHERE name = ?", (name,)).fetchone()
+    if row is None:
+        return None
+    state = dict(zip(_STATE_COLS, row))
+    return state if state["source"] == CFG.API_BASE_URL else None
+
+def _high_water(entries):
+    stamps = [str(e["last_modified"]) for e in entries if e.get("last_modified")]
+    if len(stamps) != len(entries):
+        return None
+    return max(stamps, default=None)
+
+def _save_full(name, entries, etag):
+    now = time.time()
+    with _lock:
+        db = _db()
+        with db:
+            db.execute("DELETE FROM entries WHERE name = ?", (name,))
+            db.executemany("INSERT OR REPLACE INTO entries (name, key, seq, last_modified, body) VALUES (?, ?, ?, ?, ?)",
+                           [(name, _key(e), i, e.get("last_modified"), json.dumps(e, default=str)) for i, e in enumerate(entries)])
+            total = db.execute("SELECT COUNT(*) FROM entries WHERE name = ?", (name,)).fetchone()[0]
+            db.execute("INSERT OR REPLACE INTO snapshots (name, synced_at, etag, high_water, total, mode, full_at, source) "
+                       "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (name, now, etag, _high_water(entries), total, "full", now, CFG.API_BASE_URL))
+
+def upsert(name, entries, touch=False, etag=None):
+    """Add or replace entries (e.g. one just created through the API); new keys go to the end."""
+    with _lock:
+        db = _db()
+        with db:
+            seq = db.execute("SELECT COALESCE(MAX(seq), -1) + 1 FROM entries WHERE name = ?", (name,)).fetchone()[0]
+            for e in entries:
+                key = _key(e)
+                row = db.execute("SELECT seq FROM entries WHERE name = ? AND key = ?", (name, key)).fetchone()
+                if row is None:
+                    row, seq = (seq,), seq + 1
+                db.execute("INSERT OR REPLACE INTO entries (name, key, seq, last_modified, body) VALUES (?, ?, ?, ?, ?)",
+                           (name, key, row[0], e.get("last_modified"), json.dumps(e, default=str)))
+            total = db.execute("SELECT COUNT(*) FROM entries WHERE name = ?", (name,)).fetchone()[0]
+            stamps = [e.get("last_modified") for e in entries if e.get("last_modified")]
+            db.execute("UPDATE snapshots SET total = ?, high_water = MAX(COALESCE(high_water, ''), ?) WHERE name = ?",
+                       (total, max(stamps, default=""), name))
+            if touch:
+                db.execute("UPDATE snapshots SET synced_at = ?, mode = 'incremental', etag = COALESCE(?, etag) WHERE name = ?",
+                           (time.time(), etag, name))
+    return total
+
+def _sync_incremental(name, state):
+    if not state.get("high_water"):
+        raise IncrementalSyncError("snapshot has no last_modified high-water mark")
+    headers = {"If-None-Match": state["etag"]} if state.get("etag") else None
+    order = {"order": "last_modified", "direction": "desc"}
+    r, items, info = _get_page(name, 1, order, headers=headers)
+    if items is None:
+        with _lock:
+            db = _db()
+            with db:
+                db.execute("UPDATE snapshots SET synced_at = ?, mode = 'not_modified' WHERE name = ?", (time.time(), name))
+        return 0
+    etag = r.headers.get("ETag")
+    changed, page, prev = [], 1, None
+    while True:
+        for e in items:
+            stamp = e.get("last_modified")
+            if not stamp:
+                raise IncrementalSyncError("entries without last_modified")
+            stamp = str(stamp)
+            if prev is not None and stamp > prev:
+                raise IncrementalSyncError("the API did not return the list newest first")
+            prev = stamp
+            if stamp < state["high_water"]:
+                break
+            changed.append(e)
+        else:
+            if len(items) >= CFG.PER_PAGE:
+                page += 1
+                _, items, _ = _get_page(name, page, order)
+                continue
+        break
+    total = upsert(name, changed, touch=True, etag=etag)
+    if info.get("total_count") is not None and int(info["total_count"]) != total:
+        raise IncrementalSyncError(f"API lists {info['total_count']} entries, snapshot has {total} (deletions)")
+    return len(changed)
+
+def sync(name, full=False):
+    """Bring the snapshot of one list up to date; returns a short description of what was done."""
+    state = _state(name)
+    t0 = time.perf_counter()
+    if state is not None and time.time() - (state["full_at"] or 0) > CFG.SETTINGS_FULL_SYNC_AGE:
+        full = True     # catches deletions that total_count does not show
+    if state is not None and not full:
+        try:
+            n = _sync_incremental(name, state)
+            return f"{name}: incremental, {n} changed entries ({time.perf_counter() - t0:.2f}s)"
+        except (IncrementalSyncError, SettingsFetchError, ValueError) as e:
+            if isinstance(e, SettingsFetchError) and e.status is None:
+                raise       # the API is unreachable; a full sync would not get further
+            print(f"[info] {name}: {e}; doing a full sync")
+    entries, etag = fetch_all(name)
+    _save_full(name, entries, etag)
+    return f"{name}: full, {len(entries)} entries ({time.perf_counter() - t0:.2f}s)"
+
+def sync_all(full=False):
+    for name in LISTS:
+        print(f"[info] {sync(name, full=full)}")
+
+# ---------------------------
+# Lookups
+# ---------------------------
+def entries(name, max_age=None):
+    """The list from the snapshot, synced first if it is missing or older than max_age (SETTINGS_MAX_AGE).
+    When that sync fails and a snapshot exists, the snapshot is returned with a warning."""
+    max_age = CFG.SETTINGS_MAX_AGE if max_age is None else max_age
+    state = _state(name)
+    if state is None or time.time() - (state["synced_at"] or 0) > max_age:
+        try:
+            sync(name)
+        except (SettingsFetchError, ValueError) as e:
+            if state is None:
+                raise
+            print(f"[warn] {name}: sync failed ({e}); using the snapshot from "
+                  f"{time.time() - (state['synced_at'] or 0):.0f}s ago")
+    with _lock:
+        rows = _db().execute("SELECT body FROM entries WHERE name = ? ORDER BY seq", (name,)).fetchall()
+    return [json.loads(body) for (body,) in rows]
+
+def status():
+    """Each list's snapshot state (only "name" for lists never synced from this API_BASE_URL)."""
+    return [{"name": name, **(_state(name) or {})} for name in LISTS]
+
+def print_status(rows):
+    for r in rows:
+        if not r.get("synced_at"):
+            print(f"{r['name']:<16} never synced")
+            continue
+        synced = datetime.fromtimestamp(r["synced_at"], timezone.utc).strftime("%Y-%m-%d %H:%M:%SZ")
+        age = time.time() - r["synced_at"]
+        stale = " (stale)" if age > CFG.SETTINGS_MAX_AGE else ""
+        print(f"{r['name']:<16} {r['total']:>7} entries  synced {synced} ({age:.0f}s ago, {r['mode']}){stale}  newest {r['high_water']}")
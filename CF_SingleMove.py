@@ -4,10 +4,7 @@ Created on Thu Dec  4 07:59:50 2025
 
 @author: rasmit10
 """
-import os
 import requests
-from dotenv import load_dotenv
-from pathlib import Path
 
 import CFScriptConfig as CFG
 
@@ -29,17 +26,11 @@ def move_message(postfix_id: str, destination: str):
     if destination not in VALID_DESTINATIONS:
         raise ValueError(f"Invalid destination. Must be one of: {sorted(VALID_DESTINATIONS)}")
 
-    url = CFG.API_BASE_URL + f"investigate/{postfix_id}/move"
+    url = CFG.API_BASE_URL + f"/investigate/{postfix_id}/move"
     body = {"destination": destination}
 
-    headers = {
-        "X-Auth-Email": CFG.AUTH_EMAIL,
-        "X-Auth-Key": CFG.AUTH_KEY,
-        "Content-Type": "application/json",
-    }
-
     try:
-        response = requests.post(url, json=body, headers=headers, timeout=CFG.TIMEOUT)
+        response = CFG.session.post(url, json=body)
     except requests.RequestException as e:
         return {"success": False, "error": f"Request failed: {e}"}
 
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cloudflare API Transport
+
+The one HTTP session every script uses (as CFG.session). It carries:
+  - a connection pool sized for the concurrent workers (HTTP_POOL_SIZE keep-alive
+    connections per host), mounted for https and http (the emulator);
+  - gzip/deflate Accept-Encoding on every request;
+  - the same auth headers everywhere: CF_AUTH_MODE=token sends 'Authorization: Bearer',
+    CF_AUTH_MODE=key sends X-Auth-Email / X-Auth-Key; the default 'auto' picks key mode
+    for a 37-character hex Global API Key and token mode for anything else;
+  - a default (connect, read) timeout per endpoint class, used when a call passes none;
+  - the shared CF_RateLimit token bucket, and CF_Metrics instrumentation;
+  - inside the daemon, a stop at the next request once the command's client went away.
+
+Endpoint classes (see endpoint_class):
+    search    GET  investigate
+    bulk      POST investigate/move, investigate/release (many IDs per call)
+    action    POST investigate/{id}/move, investigate/{id}/reclassify
+    content   GET  investigate/{id}/raw, preview, trace
+    settings  settings/allow_policies, block_senders, domains
+"""
+
+import re
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import CFScriptConfig as CFG
+import CF_Daemon as CFDaemon
+import CF_Metrics as CFMetrics
+import CF_RateLimit as CFRateLimit
+
+def endpoint_class(method, url):
+    path = CFMetrics.endpoint_name(method, url).split(" ", 1)[1]
+    parts = path.split("/")
+    if parts[0] == "settings":
+        return "settings"
+    if parts[0] == "investigate":
+        if len(parts) == 1:
+            return "search"
+        if path in ("investigate/move", "investigate/release"):
+            return "bulk"
+        if parts[-1] in ("raw", "preview", "trace"):
+            return "content"
+        return "action"
+    return "other"
+
+def timeout_for(method, url):
+    return (CFG.CONNECT_TIMEOUT, CFG.READ_TIMEOUTS.get(endpoint_class(method, url), CFG.TIMEOUT))
+
+def auth_headers():
+    mode = CFG.AUTH_MODE
+    if mode == "auto":
+        mode = "key" if re.fullmatch(r"[0-9a-f]{37}", CFG.AUTH_KEY) else "token"
+    if mode == "key":
+        return {"X-Auth-Email": CFG.AUTH_EMAIL, "X-Auth-Key": CFG.AUTH_KEY}
+    if mode == "token":
+        return {"Authorization": f"Bearer {CFG.AUTH_KEY}"}
+    raise EnvironmentError(f"CF_AUTH_MODE must be auto, token or key (got {CFG.AUTH_MODE!r})")
+
+class Session(requests.Session):
+    def request(self, method, url, *args, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = timeout_for(method, url)
+        CFDaemon.check_cancelled()
+        CFRateLimit.acquire()
+        return super().request(method, url, *args, **kwargs)
+
+def build_session():
+    CFMetrics.install()
+    session = Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=CFG.HTTP_POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({
+        "Accept": "application/json",
+        "Accept-Encoding": "gzip, deflate",
+    })
+    session.headers.update(auth_headers())
+    return session
+
+def session():
+    """The shared session (same object as CFG.session)."""
+    return CFG.session
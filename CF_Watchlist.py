@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cloudflare Watchlist Runner
+
+Runs a file of saved searches ("watches") as fused crawls. Watches over the same window
+("days") that share at least one server-side filter are fetched ONCE with the filters
+they have in common, and the records are demultiplexed to each watch with a compiled
+matcher as the pages stream in. Watches that share nothing get their own crawl, so
+fusing never turns a selective watch into an unfiltered crawl of the mailbox.
+
+Watchlist file (JSON):
+    {
+      "watches": [
+        {"name": "vip-ceo", "recipient": "ceo@asu.edu", "days": 1},
+        {"name": "vip-ceo-invoices", "recipient": "ceo@asu.edu", "subject": "invoice", "days": 1},
+        {"name": "bad-domain", "domain": "evil.example", "days": 7},
+        {"name": "rare-term", "query": "invoice 4471", "days": 30, "fuse": false}
+      ]
+    }
+
+Each watch takes the same filters as 'CFTools.py search' (subject, sender, recipient,
+domain, query) plus "days" (default 1). Set "fuse": false to give a watch its own
+server-side crawl. Matches are spooled to disk per watch while the crawl runs and turned
+into one CSV per watch afterwards, so no crawl is ever held in memory.
+"""
+
+import csv
+import json
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import CFFullSearch as CFSearch
+import CFScriptConfig as CFG
+
+# ---------------------------
+# CONFIG — edit this (IDE)
+# ---------------------------
+WATCHLIST_FILE = "watchlists.json"
+OUTPUT_DIR = "watchlist_out"
+
+FILTER_FIELDS = ("subject", "sender", "recipient", "domain", "query")
+
+# ---------------------------
+# Load + validate watches
+# ---------------------------
+def load_watchlist(path):
+    path = Path(path)
+    if not path.exists():
+        raise FileNotFoundError(path)
+    data = json.loads(path.read_text(encoding="utf-8"))
+    raw = data.get("watches", []) if isinstance(data, dict) else data
+
+    watches = []
+    seen_names = set()
+    file_names = {}     # each watch's output files are named after it; case-insensitive filesystems included
+    for i, w in enumerate(raw, start=1):
+        if not isinstance(w, dict):
+            raise ValueError(f"watch #{i} is not an object")
+        name = str(w.get("name") or f"watch_{i}")
+        if name in seen_names:
+            raise ValueError(f"duplicate watch name: {name}")
+        seen_names.add(name)
+        safe = _safe_name(name).lower()
+        if safe in file_names:
+            raise ValueError(f"watch names '{file_names[safe]}' and '{name}' would share the output file "
+                             f"{_safe_name(name)}.csv; rename one")
+        file_names[safe] = name
+        filters = {k: w[k] for k in FILTER_FIELDS if w.get(k)}
+        if not filters:
+            raise ValueError(f"watch '{name}' has no search criteria")
+        watches.append({
+            "name": name,
+            "filters": _effective_filters(filters),
+            "days": int(w.get("days", 1)),
+            "fuse": bool(w.get("fuse", True)),
+        })
+    return watches
+
+def _effective_filters(filters):
+    # the API ignores field filters when a query is present (see CFFullSearch._fetch_page)
+    if filters.get("query"):
+        return {"query": filters["query"]}
+    return dict(filters)
+
+def _safe_name(name):
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", name).strip("_") or "watch"
+
+# ---------------------------
+# Fusion planning
+# ---------------------------
+def plan_fused_queries(watches):
+    """
+    Group watches into server-side crawls.
+    Returns a list of {"filters": {...}, "days": N, "watches": [...]}. A watch joins an earlier
+    fusable group with the same days when the two still share at least one filter; the group's
+    server filters are then narrowed to the shared ones. Otherwise it starts its own group.
+    """
+    groups = []
+    for w in watches:
+        if w["fuse"]:
+            for g in groups:
+                if g["days"] != w["days"] or not all(x["fuse"] for x in g["watches"]):
+                    continue
+                common = {k: v for k, v in g["filters"].items() if w["filters"].get(k) == v}
+                if common:
+                    g["filters"] = common
+                    g["watches"].append(w)
+                    break
+            else:
+                groups.append({"filters": dict(w["filters"]), "days": w["days"], "watches": [w]})
+        else:
+            groups.append({"filters": dict(w["filters"]), "days": w["days"], "watches": [w]})
+    return groups
+
+def _spool_to_csv(spool_path, out_csv):
+    """Write the JSONL spool of one watch as a CSV with the same columns export_csv_and_validate uses.
+    Two passes over the file (columns, then rows), so the records are never all in memory."""
+    fieldnames = set()
+    with open(spool_path, encoding="utf-8") as f:
+        for line in f:
+            fieldnames.update(CFSearch.flatten_record(json.loads(line)).keys())
+    written = 0
+    with open(spool_path, encoding="utf-8") as f, open(out_csv, "w", newline="", encoding="utf-8") as cf:
+        writer = csv.DictWriter(cf, fieldnames=sorted(fieldnames), restval="")
+        writer.writeheader()
+        for line in f:
+            writer.writerow(CFSearch.flatten_record(json.loads(line)))
+            written += 1
+    return written
+
+# ---------------------------
+# Run
+# ---------------------------
+def run_watchlist(watchlist_path, out_dir=OUTPUT_DIR, per_page=CFG.PER_PAGE):
+    watches = load_watchlist(watchlist_path)
+    if not watches:
+        print("[watchlist] no watches found. Nothing to do.")
+        return {}
+
+    groups = plan_fused_queries(watches)
+    print(f"[watchlist] {len(watches)} watches fused into {len(groups)} server-side crawl(s)")
+
+    out_dir = Path(out_dir).expanduser()
+    out_dir.mkdir(parents=True, exist_ok=True)
+    end_dt = datetime.now(timezone.utc)
+    summary = {"started": CFSearch._iso(end_dt), "groups": [], "watches": {}}
+
+    for gi, group in enumerate(groups, start=1):
+        start_dt = end_dt - timedelta(days=group["days"])
+        names = ", ".join(w["name"] for w in group["watches"])
+        print(f"[watchlist] crawl {gi}/{len(groups)} days={group['days']} filters={group['filters']} watches=[{names}]")
+
+        # demultiplex while streaming: one compiled matcher and one spool file per watch
+        routes = []
+        for w in group["watches"]:
+            spool = out_dir / f"{_safe_name(w['name'])}.jsonl.part"
+            routes.append({"watch": w, "match": CFSearch.compile_record_matcher(**w["filters"]),
+                           "spool": spool, "file": open(spool, "w", encoding="utf-8"), "matched": 0})
+
+        def on_records(records):
+            for rec in records:
+                line = None
+                for r in routes:
+                    if r["match"](rec):
+                        line = line or json.dumps(rec, ensure_ascii=False, default=str) + "\n"
+                        r["file"].write(line)
+                        r["matched"] += 1
+
+        try:
+            _, meta = CFSearch.fetch_all_by_time_divide_and_conquer(
+                CFSearch._iso(start_dt), CFSearch._iso(end_dt), per_page=per_page,
+                on_records=on_records, keep_records=False, **group["filters"])
+        finally:
+            for r in routes:
+                r["file"].close()
+        print(f"[watchlist] crawl {gi} streamed {meta.get('records_seen', 0)} items; meta={meta}")
+        summary["groups"].append({"filters": group["filters"], "days": group["days"],
+                                  "items": meta.get("records_seen", 0), "meta": meta,
+                                  "watches": [w["name"] for w in group["watches"]]})
+
+        for r in routes:
+            w = r["watch"]
+            entry = {"matched": r["matched"], "output": None, "complete": meta.get("completed", False)}
+            if r["matched"]:
+                out_csv = out_dir / f"{_safe_name(w['name'])}.csv"
+                written = _spool_to_csv(r["spool"], out_csv)
+                entry["output"] = str(out_csv)
+                status = "success" if written == r["matched"] else "warning"
+                print(f"[{status}] watch '{w['name']}': {written} rows -> {out_csv}")
+            else:
+                print(f"[watchlist] watch '{w['name']}': 0 matches")
+            os.remove(r["spool"])
+            summary["watches"][w["name"]] = entry
+
+    summary_path = out_dir / "watchlist_summary.json"
+    summary_path.write_text(json.dumps(summary, indent=2, default=str), encoding="utf-8")
+    total_requests = sum(g["meta"].get("requests_made", 0) for g in summary["groups"])
+    print(f"[watchlist] done. {total_requests} API requests total. Summary written to {summary_path}")
+    return summary
+
+if __name__ == "__main__":
+    run_watchlist(WATCHLIST_FILE, OUTPUT_DIR)